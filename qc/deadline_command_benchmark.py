@@ -0,0 +1,122 @@
+"""
+Times deadlinecommand calls made one at a time, as CallDeadlineCommand does, against the
+same calls run through the deadline scheduler's DeadlineCommandPool, which still starts a process
+per call, and through DeadlineWebServicePool, which reuses one connection per worker.
+A fake deadlinecommand that sleeps for --startup seconds stands in for the JVM startup of the
+real one, and a fake web service that takes --latency seconds per request stands in for the
+Deadline Web Service, so no Deadline install is needed.
+Usage: python qc/deadline_command_benchmark.py [--calls 32] [--startup 0.5] [--latency 0.005] [--workers 4]
+"""
+import os, sys, json, time, uuid, shutil, tempfile, argparse, threading, subprocess
+import BaseHTTPServer, SocketServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'modules'))
+import deadline_command
+
+fake_command = '''#!{python}
+import sys, time, uuid
+time.sleep({startup})
+if len(sys.argv) > 1 and sys.argv[1].lower() == '-submitjob':
+    print 'Result=Success'
+    print 'JobID=' + uuid.uuid4().hex[:24]
+else:
+    print 'Status=Active'
+'''
+
+parser = argparse.ArgumentParser(description='Benchmark deadlinecommand calls with a fake deadlinecommand and web service.')
+parser.add_argument('--calls', type=int, default=32, help='number of calls')
+parser.add_argument('--startup', type=float, default=0.5, help='seconds each fake call takes to start')
+parser.add_argument('--latency', type=float, default=0.005, help='seconds the fake web service takes per request')
+parser.add_argument('--workers', type=int, default=4, help='pool worker threads')
+args = parser.parse_args()
+
+connections = []
+
+class fake_web_service(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # buffer replies, so headers and body aren't sent as separate small packets
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        connections.append(self.client_address)
+
+    def reply(self, data):
+        body = json.dumps(data)
+        time.sleep(args.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.reply({'_id': uuid.uuid4().hex[:24]})
+
+    def do_GET(self):
+        job_ids = self.path.partition('JobID=')[2].split('%2C')
+        self.reply([{'_id': job_id, 'Stat': 1} for job_id in job_ids])
+
+    def log_message(self, *args):
+        pass
+
+class threaded_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def run_pool(pool, arguments):
+    start = time.time()
+    requests = [pool.callAsync(call_args) for call_args in arguments]
+    results = [request.result() for request in requests]
+    elapsed = time.time() - start
+    workers = list(pool.workers)
+    pool.stop()
+    for worker in workers:
+        worker.join()
+    return elapsed, results
+
+temp_dir = tempfile.mkdtemp()
+server = threaded_server(('127.0.0.1', 0), fake_web_service)
+server_thread = threading.Thread(target=server.serve_forever)
+server_thread.daemon = True
+server_thread.start()
+try:
+    command = os.path.join(temp_dir, 'deadlinecommand')
+    with open(command, 'w') as command_file:
+        command_file.write(fake_command.format(python=sys.executable, startup=args.startup))
+    os.chmod(command, 0755)
+    for name in ('job_info.txt', 'plugin_info.txt'):
+        with open(os.path.join(temp_dir, name), 'w') as info_file:
+            info_file.write('Plugin=CommandLine\nName=benchmark\n')
+    job_info = os.path.join(temp_dir, 'job_info.txt')
+    plugin_info = os.path.join(temp_dir, 'plugin_info.txt')
+    arguments = [['-SubmitJob', job_info, plugin_info] if i % 2 else ['GetJob', str(i)] for i in range(args.calls)]
+    resolve = lambda: (command, None, 0, dict(os.environ))
+
+    # one call at a time, launched as CallDeadlineCommand does
+    start = time.time()
+    for call_args in arguments:
+        proc = subprocess.Popen([command] + call_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                env=dict(os.environ))
+        proc.communicate()
+    serial = time.time() - start
+
+    # the same calls queued on the pools, then waited on
+    pooled, results = run_pool(deadline_command.DeadlineCommandPool(resolve, num_workers=args.workers), arguments)
+    address = '127.0.0.1:{}'.format(server.server_address[1])
+    web, web_results = run_pool(deadline_command.DeadlineWebServicePool(address, resolve, num_workers=args.workers), arguments)
+
+    failed = [errors for output, errors in results + web_results if errors]
+    failed += [output for output in zip(*web_results)[0] if output.startswith('Error')]
+    print '{} calls with {:.2f}s startup, {:.3f}s web service latency'.format(args.calls, args.startup, args.latency)
+    print 'serial: {:.2f}s ({:.3f}s per call)'.format(serial, serial / args.calls)
+    print 'command pool of {}: {:.2f}s ({:.3f}s per call), {:.1f}x'.format(args.workers, pooled, pooled / args.calls, serial / pooled)
+    print 'web service pool of {}: {:.2f}s ({:.3f}s per call), {:.1f}x, {} connections'.format(
+        args.workers, web, web / args.calls, serial / web, len(connections))
+    if failed:
+        print 'failed calls:', len(failed), failed[0]
+        sys.exit(1)
+finally:
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(temp_dir)
@@ -0,0 +1,143 @@
+"""
+Times writing the job info files of work items in the deadline scheduler, with the cached job templates of
+DeadlineScheduler.getJobTemplate off and on, and checks both write the same files.  A second node has a pool
+of @pool, which refers to the work item, to check such nodes aren't cached.
+Parm evaluation is stood in for by a fixed value per parm, taking --eval-us microseconds each, so no hip file
+or cook is needed.  Outside hython the hou and pdg stand-ins in qc/standins are used.
+Usage: python qc/job_template_benchmark.py [--items 5000] [--eval-us 20]
+"""
+import os, sys, imp, time, argparse
+from cStringIO import StringIO
+
+qc_dir = os.path.dirname(os.path.abspath(__file__))
+try:
+    import pdg
+except ImportError:
+    sys.path.append(os.path.join(qc_dir, 'standins'))
+os.environ.setdefault('FIREHAWK_HOUDINI_TOOLS', os.path.dirname(qc_dir))
+tbdeadline = imp.load_source('firehawk_tbdeadline', os.path.join(qc_dir, '..', 'scripts', 'snippets', 'tbdeadline.py'))
+import hou
+
+parser = argparse.ArgumentParser(description='Benchmark the deadline scheduler job templates.')
+parser.add_argument('--items', type=int, default=5000, help='number of work items')
+parser.add_argument('--eval-us', type=float, default=20, help='microseconds each parm evaluation takes')
+args = parser.parse_args()
+
+parm_values = {
+    'plugin': 'CommandLine', 'job_pool': 'houdini', 'job_group': 'linux', 'job_dept': 'fx', 'job_batch_name': 'shot_v001',
+    'job_comment': 'pdg', 'on_job_complete': 'Nothing', 'force_reload_plugin': 'false', 'job_priority': 50,
+    'job_frames': '0', 'hfs': '/opt/hfs17.5', 'jobfile_kvpair': 2, 'jobfile_key1': 'MachineLimit', 'jobfile_value1': '4',
+    'jobfile_key2': 'ConcurrentTasks', 'jobfile_value2': '1', 'envmulti': 1, 'envname1': 'OCIO',
+    'envvalue1': '/prod/config/aces/config.ocio', 'pluginfile_kvpair': 1, 'pluginfile_key1': 'Shell', 'pluginfile_value1': 'bash',
+}
+
+class parm(object):
+    def __init__(self, name, raw):
+        self._name = name
+        self.raw = raw
+
+    def name(self):
+        return self._name
+
+    def expression(self):
+        raise hou.OperationFailed()
+
+    def unexpandedString(self):
+        return self.raw
+
+class top_node(object):
+    def __init__(self, values):
+        self.values = values
+
+    def parms(self):
+        return [parm('deadline_' + name, str(value)) for name, value in self.values.iteritems()]
+
+    def parent(self):
+        return None
+
+    def addEventCallback(self, event_types, callback):
+        pass
+
+    def path(self):
+        return '/obj/topnet/' + str(id(self))
+
+class node(object):
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+        self.top_node = top_node(values)
+
+    def topNode(self):
+        return self.top_node
+
+class work_item(object):
+    def __init__(self, node, index):
+        self.node = node
+        self.name = '{}_{}'.format(node.name, index)
+        self.index = index
+        self.attribs = {'@pool': 'pool{}'.format(index % 3)}
+
+class scheduler(tbdeadline.DeadlineScheduler):
+    """
+    The deadline scheduler with its parms stood in for by the values of each node.
+    """
+    def __init__(self, cache_job_templates):
+        tbdeadline.DeadlineScheduler.__init__(self, None, 'deadlinescheduler')
+        self.cache_job_templates = cache_job_templates
+        self.deadline_pool.stop()
+
+    def evaluate(self, node, name, work_item):
+        end = time.time() + args.eval_us / 1e6
+        while time.time() < end:
+            pass
+        if node is None:
+            return None
+        value = node.values.get(name)
+        return work_item.attribs.get(value, value)
+
+    def evaluateStringOverride(self, node, prefix, name, work_item, default):
+        value = self.evaluate(node if node is not None else work_item.node, name, work_item)
+        return default if value is None else str(value)
+
+    def evaluateIntOverride(self, node, prefix, name, work_item, default):
+        value = self.evaluate(node, name, work_item)
+        return default if value is None else int(value)
+
+    def workingDir(self, local):
+        return '/prod/shot/pdg'
+
+    def tempDir(self, local):
+        return '/prod/shot/pdg/temp'
+
+    def scriptDir(self, local):
+        return '/prod/shot/pdg/temp/scripts'
+
+    def workItemResultServerAddr(self):
+        return 'localhost:50000'
+
+varying_values = dict(parm_values, job_pool='@pool')
+nodes = [node('ropfetch1', parm_values), node('ropfetch2', varying_values)]
+
+def write_jobs(cache_job_templates, items):
+    instance = scheduler(cache_job_templates)
+    files = []
+    start = time.time()
+    for item in items:
+        job_file = StringIO()
+        template = instance.writeJobInfo(job_file, item, 'plugin', item.name, [('PDG_ITEM_NAME', item.name)])
+        files.append(job_file.getvalue() + template.plugin_lines)
+    return files, time.time() - start
+
+failed = False
+for test_node in nodes:
+    items = [work_item(test_node, index) for index in range(args.items)]
+    uncached, uncached_time = write_jobs(False, items)
+    cached, cached_time = write_jobs(True, items)
+    print '{}, {} work items, pool {}'.format(test_node.name, len(items), test_node.values['job_pool'])
+    print '  templates off: {:.3f}s ({:.1f}us per job)'.format(uncached_time, 1e6 * uncached_time / len(items))
+    print '  templates on: {:.3f}s ({:.1f}us per job), {:.1f}x'.format(cached_time, 1e6 * cached_time / len(items), uncached_time / cached_time)
+    if cached != uncached:
+        print 'ERROR: the job files written from templates differ'
+        failed = True
+if failed:
+    sys.exit(1)
@@ -0,0 +1,130 @@
+"""
+Times building the environments of work items in the local scheduler, with the per node environment
+cache of LocalScheduler._generateEnvironment off and on, and checks both build the same environments.
+A second node has an env value of @wedge, which refers to the work item, to check such nodes aren't cached.
+The scheduler's parms are stood in for, so no hip file or cook is needed.  Outside hython the hou and pdg
+stand-ins in qc/standins are used.
+Usage: python qc/local_env_cache_benchmark.py [--items 5000] [--nodes 4] [--env-size 200]
+"""
+import os, sys, imp, time, argparse
+
+qc_dir = os.path.dirname(os.path.abspath(__file__))
+try:
+    import pdg
+except ImportError:
+    sys.path.append(os.path.join(qc_dir, 'standins'))
+os.environ.setdefault('FIREHAWK_HOUDINI_TOOLS', os.path.dirname(qc_dir))
+local = imp.load_source('firehawk_local', os.path.join(qc_dir, '..', 'scripts', 'snippets', 'local.py'))
+import hou
+
+parser = argparse.ArgumentParser(description='Benchmark the local scheduler environment cache.')
+parser.add_argument('--items', type=int, default=5000, help='number of work items')
+parser.add_argument('--nodes', type=int, default=4, help='number of nodes the work items belong to')
+parser.add_argument('--env-size', type=int, default=200, help='variables added to the host environment')
+args = parser.parse_args()
+
+for index in range(args.env_size):
+    os.environ['FIREHAWK_BENCHMARK_VAR{}'.format(index)] = '/prod/tools/houdini/package{}'.format(index)
+
+class parm(object):
+    def __init__(self, name, raw):
+        self._name = name
+        self.raw = raw
+
+    def name(self):
+        return self._name
+
+    def expression(self):
+        raise hou.OperationFailed()
+
+    def unexpandedString(self):
+        return self.raw
+
+class top_node(object):
+    def __init__(self, env):
+        self.env = env
+
+    def parms(self):
+        parms = [parm('local_envmulti', str(len(self.env)))]
+        for index, (name, value) in enumerate(sorted(self.env.iteritems())):
+            parms += [parm('local_envname{}'.format(index + 1), name), parm('local_envvalue{}'.format(index + 1), value)]
+        return parms
+
+    def parent(self):
+        return None
+
+class node(object):
+    def __init__(self, name, env):
+        self.name = name
+        self.env = env
+
+    def topNode(self):
+        return top_node(self.env)
+
+class work_item(object):
+    def __init__(self, node, index):
+        self.node = node
+        self.name = '{}_{}'.format(node.name, index)
+        self.index = index
+        self.environment = {u'WEDGE_INDEX': unicode(index % 8), u'FRAME': unicode(1001 + index)}
+
+class scheduler(object):
+    """
+    The parts of LocalScheduler that environments are built from, with the env parms of each node.
+    """
+    _generateEnvironment = local.LocalScheduler._generateEnvironment.__func__
+    _nodeEnvironment = local.LocalScheduler._nodeEnvironment.__func__
+    _checkEnvironmentParms = local.LocalScheduler._checkEnvironmentParms.__func__
+
+    def __init__(self, cache_environment):
+        self.name = 'localscheduler'
+        self.cache_environment = cache_environment
+        self.env_cache = {}
+        self.env_varying = {}
+        self.env_checks = set()
+        self.max_cpu_slots = 4
+        self.cook_id = '1'
+
+    def evaluateIntOverride(self, node, prefix, name, item, default):
+        return default
+
+    def resolveEnvParams(self, prefix, item, to_string):
+        env = dict((name, value.replace('@wedge', str(item.index % 8))) for name, value in item.node.env.iteritems())
+        return env, ['DISPLAY']
+
+    def workItemResultServerAddr(self):
+        return 'localhost:50000'
+
+    def workingDir(self, local):
+        return '/prod/shot'
+
+    def tempDir(self, local):
+        return '/prod/shot/pdgtemp/1'
+
+    def scriptDir(self, local):
+        return '/prod/shot/pdgtemp/1/scripts'
+
+node_env = {'OCIO': '/prod/config/aces/config.ocio', 'PATH': '/prod/tools/bin'}
+nodes = [node('ropfetch{}'.format(index), node_env) for index in range(args.nodes)]
+varying_node = node('wedgefetch', dict(node_env, WEDGE_CACHE='/prod/shot/cache/wedge@wedge'))
+
+def build(cache_environment, items):
+    instance = scheduler(cache_environment)
+    start = time.time()
+    envs = [instance._generateEnvironment(item, 1) for item in items]
+    return envs, time.time() - start
+
+failed = False
+print '{} environment variables'.format(len(os.environ))
+for label, item_nodes in (('{} nodes'.format(len(nodes)), nodes), (varying_node.name, [varying_node])):
+    items = [work_item(item_nodes[index % len(item_nodes)], index) for index in range(args.items)]
+    uncached, uncached_time = build(False, items)
+    cached, cached_time = build(True, items)
+    print '{}, {} work items'.format(label, len(items))
+    print '  cache off: {:.3f}s ({:.1f}us per work item)'.format(uncached_time, 1e6 * uncached_time / len(items))
+    print '  cache on: {:.3f}s ({:.1f}us per work item), {:.1f}x'.format(cached_time, 1e6 * cached_time / len(items), uncached_time / cached_time)
+    if cached != uncached:
+        print 'ERROR: the cached environments differ'
+        failed = True
+if failed:
+    sys.exit(1)
@@ -0,0 +1,59 @@
+"""
+Times mapping paths to PROD_ROOT with the root trie of scripts/modules/path_mapping.py, against a loop
+over the roots testing each as a prefix, and against the cached map_site_path for repeated paths.
+Usage: python qc/path_mapping_benchmark.py [--paths 100000] [--roots 3] [--repeats 5]
+"""
+import os, sys, time, random, argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'modules'))
+import path_mapping
+
+parser = argparse.ArgumentParser(description='Benchmark path_mapping on random paths.')
+parser.add_argument('--paths', type=int, default=100000, help='number of paths to map')
+parser.add_argument('--roots', type=int, default=3, help='number of site roots')
+parser.add_argument('--repeats', type=int, default=5, help='passes over the paths')
+args = parser.parse_args()
+
+random.seed(0)
+
+roots = ['/prod'] + ['/mnt/site{}/prod'.format(index) for index in range(1, args.roots)]
+target = '/prod'
+names = ['shot', 'sq010', 'sh0100', 'cache', 'v001', 'v002', 'geo', 'render', 'sphere.{:04d}.bgeo.sc']
+
+def random_path():
+    parts = [random.choice(names).format(random.randint(1, 240)) for i in range(random.randint(2, 6))]
+    return '/'.join([random.choice(roots + ['/other'])] + parts)
+
+paths = [random_path() for i in range(args.paths)]
+
+def prefix_map(path):
+    # the longest root that is a prefix of the path, as the mapping would be written without the trie
+    best = None
+    for root in roots:
+        if (path == root or path.startswith(root + '/')) and (best is None or len(root) > len(best)):
+            best = root
+    if best is None:
+        return None
+    return target + path[len(best):]
+
+def timed(label, function):
+    best = None
+    for repeat in range(args.repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print '{}: {:.3f}s ({:.2f}us per path)'.format(label, best, 1e6 * best / len(paths))
+    return result
+
+mapping = path_mapping.root_mapping(roots, target)
+os.environ['PROD_ROOT'] = target
+
+print '{} paths, {} roots, best of {}'.format(len(paths), len(roots), args.repeats)
+prefixed = timed('prefix loop', lambda: [prefix_map(path) for path in paths])
+mapped = timed('root trie', lambda: [mapping.map_path(path) for path in paths])
+cached = timed('map_site_path', lambda: [path_mapping.map_site_path(path) for path in paths])
+
+if mapped != prefixed:
+    print 'ERROR: the root trie and prefix loop disagree'
+    sys.exit(1)
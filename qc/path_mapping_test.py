@@ -0,0 +1,92 @@
+"""
+Property tests of the site root mapping in scripts/modules/path_mapping.py, checked on random paths
+against a plain prefix match over the roots.
+Usage: python qc/path_mapping_test.py [--paths 20000] [--seed 0]
+"""
+import os, sys, random, argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'modules'))
+import path_mapping
+
+parser = argparse.ArgumentParser(description='Property tests of path_mapping with random paths.')
+parser.add_argument('--paths', type=int, default=20000, help='number of random paths')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+names = ['prod', 'onsite', 'cloud', 'shot', 'sq010', 'cache', 'v001', 'geo', 'sphere.0001.bgeo.sc', 'prodx', 'a']
+roots = ['/prod', '/mnt/onsite/prod', '/mnt/onsite/prod/shot', '/cloud/prod', 'P:/prod']
+target = '/prod'
+mapping = path_mapping.root_mapping(roots, target)
+
+failures = []
+
+def check(condition, message, path):
+    if not condition and len(failures) < 20:
+        failures.append('{}: {!r}'.format(message, path))
+
+def expected(path):
+    """
+    The mapping by the longest root that is a whole-component prefix of path, with separators normalised.
+    """
+    parts = path_mapping.split_path(path)
+    best = 0
+    for root in roots:
+        root_parts = path_mapping.split_path(root)
+        keys = [path_mapping.part_key(part) for part in parts[:len(root_parts)]]
+        if keys == [path_mapping.part_key(part) for part in root_parts]:
+            best = max(best, len(root_parts))
+    if not best:
+        return None
+    mapped = '/'.join([target] + parts[best:])
+    if len(path) > 1 and path[-1] in '/\\':
+        mapped += '/'
+    return mapped
+
+def random_path():
+    start = random.choice(roots + ['/mnt', '/cloud', '/other', 'p:/prod', 'C:'])
+    parts = [random.choice(names) for i in range(random.randint(0, 5))]
+    path = '/'.join([start] + parts)
+    if random.random() < 0.2:
+        path += '/'
+    # any separator may be a backslash, as in paths written on windows
+    if random.random() < 0.5:
+        path = ''.join(c if c != '/' or random.random() < 0.5 else '\\' for c in path)
+    return path
+
+for i in range(args.paths):
+    path = random_path()
+    mapped = mapping.map_path(path)
+    check(mapped == expected(path), 'mapped {!r}, expected {!r}'.format(mapped, expected(path)), path)
+
+    # mapping doesn't depend on which separators a path is written with
+    posix = path.replace('\\', '/')
+    check(mapping.map_path(posix) == mapped, 'separators changed the mapping', path)
+
+    if mapped is not None:
+        # mapped paths are under the target, so map to themselves
+        check(mapped.startswith(target), 'mapped outside the target', path)
+        check(mapping.map_path(mapped) == mapped, 'mapping is not idempotent', path)
+        check(path_mapping.split_path(mapped)[-1] == path_mapping.split_path(path)[-1] or
+              len(path_mapping.split_path(mapped)) == len(path_mapping.split_path(target)),
+              'file name changed', path)
+
+    # unmapped paths are left unchanged by map_paths
+    check(mapping.map_paths([path]) == [path if mapped is None else mapped], 'map_paths differs', path)
+
+# a windows target joins with backslashes
+windows = path_mapping.root_mapping(['/prod'], 'P:\\prod')
+check(windows.map_path('/prod/shot/v001/a.hip') == 'P:\\prod\\shot\\v001\\a.hip', 'windows target', '/prod/shot/v001/a.hip')
+check(windows.map_path('/prodx/a.hip') is None, 'partial component matched', '/prodx/a.hip')
+
+# the hip argument of a hython command is mapped in place
+command = 'hython rop.py -p "\\mnt\\onsite\\prod\\shot\\a.hip" -n /out/geo'
+check(mapping.map_hip_argument(command) == 'hython rop.py -p "/prod/a.hip" -n /out/geo', 'hip argument', command)
+
+if failures:
+    print 'FAILED'
+    for failure in failures:
+        print failure
+    sys.exit(1)
+print 'ok, {} paths'.format(args.paths)
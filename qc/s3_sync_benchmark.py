@@ -0,0 +1,120 @@
+"""
+Times s3_sync pushes and pulls of a directory of small files, file by file as syncfile does them, against
+one syncbatch for the whole directory, and repeat pushes with nothing to transfer with the sync state cache
+off and on.
+By default the bucket is mocked in process with moto (pip install moto).  With --endpoint the benchmark
+runs against a real S3 api instead, eg. a local MinIO server, using the credentials of the environment.
+Usage: python qc/s3_sync_benchmark.py [--files 200] [--size 4096] [--repeats 3] [--endpoint http://localhost:9000]
+"""
+import os, sys, time, shutil, tempfile, argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 's3_sync'))
+
+parser = argparse.ArgumentParser(description='Benchmark s3_sync against a mocked or local S3.')
+parser.add_argument('--files', type=int, default=200, help='number of files to sync')
+parser.add_argument('--size', type=int, default=4096, help='bytes per file')
+parser.add_argument('--repeats', type=int, default=3, help='repeat pushes with nothing to transfer')
+parser.add_argument('--bucket', default='firehawk-s3-sync-benchmark', help='bucket name, created if missing')
+parser.add_argument('--endpoint', default=None, help='S3 endpoint url, eg. a MinIO server.  Without it moto is used')
+args = parser.parse_args()
+
+mock = None
+if args.endpoint is None:
+    try:
+        from moto import mock_aws as mock_s3
+    except ImportError:
+        try:
+            from moto import mock_s3
+        except ImportError:
+            print 'moto is not installed, pip install moto or pass --endpoint'
+            sys.exit(1)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    mock = mock_s3()
+    mock.start()
+
+import boto3
+import s3_sync
+
+if args.endpoint is not None:
+    s3_sync._client = boto3.client('s3', endpoint_url=args.endpoint)
+
+def timed(label, function, count):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    print '{}: {:.2f}s ({:.2f}ms per file)'.format(label, elapsed, 1000.0 * elapsed / count)
+    return elapsed
+
+def push_each(paths, state):
+    for path in paths:
+        batch = s3_sync.syncbatch([path], args.bucket, state=state)
+        batch.quiet = True
+        batch.push()
+
+def push_batch(paths, state):
+    batch = s3_sync.syncbatch(paths, args.bucket, state=state)
+    batch.quiet = True
+    batch.push()
+
+def pull_batch(paths, state):
+    batch = s3_sync.syncbatch(paths, args.bucket, state=state)
+    batch.quiet = True
+    batch.pull()
+
+def clear_bucket(client):
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=args.bucket):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            client.delete_objects(Bucket=args.bucket, Delete={'Objects': keys})
+
+temp_dir = tempfile.mkdtemp()
+try:
+    client = s3_sync.get_client()
+    try:
+        client.head_bucket(Bucket=args.bucket)
+    except Exception:
+        client.create_bucket(Bucket=args.bucket)
+
+    source_dir = os.path.join(temp_dir, 'cache', 'v001')
+    os.makedirs(source_dir)
+    paths = []
+    for index in range(args.files):
+        path = os.path.join(source_dir, 'sphere.{:04d}.bgeo.sc'.format(index))
+        with open(path, 'wb') as file:
+            file.write(os.urandom(args.size))
+        paths.append(path)
+    no_state = None
+    os.environ['FIREHAWK_S3_SYNC_STATE'] = '0'
+    state = s3_sync.sync_state(os.path.join(temp_dir, 's3_sync_state.db'), ttl=600)
+
+    print '{} files of {} bytes, {}'.format(args.files, args.size, args.endpoint or 'moto')
+
+    # first uploads, one batch per file as syncfile does, then one batch for the directory
+    clear_bucket(client)
+    each = timed('push per file', lambda: push_each(paths, no_state), args.files)
+    clear_bucket(client)
+    batched = timed('push batch', lambda: push_batch(paths, no_state), args.files)
+    print 'batch speedup: {:.1f}x'.format(each / batched)
+
+    # pushes with nothing to transfer, which list the prefix, or read the listing from the state cache
+    for repeat in range(args.repeats):
+        timed('repeat push per file, no state', lambda: push_each(paths, no_state), args.files)
+        timed('repeat push per file, state', lambda: push_each(paths, state), args.files)
+        timed('repeat push batch, no state', lambda: push_batch(paths, no_state), args.files)
+        timed('repeat push batch, state', lambda: push_batch(paths, state), args.files)
+
+    # downloads into an empty directory
+    shutil.rmtree(source_dir)
+    timed('pull batch', lambda: pull_batch(paths, no_state), args.files)
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing:
+        print 'ERROR: {} files were not pulled'.format(len(missing))
+        sys.exit(1)
+    clear_bucket(client)
+finally:
+    shutil.rmtree(temp_dir)
+    if mock is not None:
+        mock.stop()
@@ -0,0 +1,37 @@
+"""
+Stand-in for the parts of hou the scheduler modules use when they are imported and timed by the qc scripts,
+so the scripts also run outside hython.  Nothing here cooks or evaluates a hip file.
+"""
+
+class Error(Exception):
+    pass
+
+class OperationFailed(Error):
+    pass
+
+class ObjectWasDeleted(Error):
+    pass
+
+class nodeEventType(object):
+    ParmTupleChanged = 'ParmTupleChanged'
+
+class hipFile(object):
+    @staticmethod
+    def path():
+        return '/prod/shot/untitled.hip'
+
+    @staticmethod
+    def hasUnsavedChanges():
+        return False
+
+def isUIAvailable():
+    return False
+
+def node(path):
+    return None
+
+def pwd():
+    return None
+
+def expandString(value):
+    return value
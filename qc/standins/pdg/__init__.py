@@ -0,0 +1,17 @@
+"""
+Stand-in for the parts of pdg the scheduler modules use when they are imported and timed by the qc scripts.
+"""
+
+class scheduleResult(object):
+    Succeeded = 'Succeeded'
+    Failed = 'Failed'
+    CookSucceeded = 'CookSucceeded'
+    Deferred = 'Deferred'
+    FullDeferred = 'FullDeferred'
+
+class EventType(object):
+    CookComplete = 'CookComplete'
+    WorkItemStateChange = 'WorkItemStateChange'
+
+createHarsServer = None
+createProcessJob = None
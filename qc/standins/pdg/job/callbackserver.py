@@ -0,0 +1,3 @@
+class CallbackServerMixin(object):
+    def __init__(self, *args):
+        pass
@@ -0,0 +1,15 @@
+class PyScheduler(object):
+    def __init__(self, scheduler=None, name=''):
+        self.name = name
+
+    def initLogger(self, logger, level):
+        logger.setLevel(level)
+
+def evaluateParamOr(scheduler, name, default):
+    return default
+
+def convertEnvMapToUTF8(env):
+    converted = {}
+    for key, value in env.iteritems():
+        converted[str(key)] = value.encode('utf8') if isinstance(value, unicode) else str(value)
+    return converted
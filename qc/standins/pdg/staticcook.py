@@ -0,0 +1,2 @@
+class StaticCookMixin(object):
+    pass
@@ -0,0 +1,7 @@
+class TickTimer(object):
+    def __init__(self, interval, callback):
+        self.interval = interval
+        self.callback = callback
+
+def expand_vars(value, *args):
+    return value
@@ -0,0 +1,105 @@
+"""
+Times firehawk_submit.upstream_pdg_nodes on a synthetic layered graph of PDG nodes, against the walk it replaced
+(repeated np.setdiff1d passes with list membership checks) when numpy is available, and checks that each node
+is ordered after all of its inputs.
+Stand-in nodes are used, so no hip file is needed.  Outside hython the hou and pdg stand-ins in qc/standins are used.
+Usage: python qc/upstream_nodes_benchmark.py [--nodes 5000] [--width 20] [--fan-in 3]
+"""
+import os, sys, time, random, argparse
+
+qc_dir = os.path.dirname(os.path.abspath(__file__))
+try:
+    import pdg
+except ImportError:
+    sys.path.append(os.path.join(qc_dir, 'standins'))
+os.environ.setdefault('FIREHAWK_HOUDINI_TOOLS', os.path.dirname(qc_dir))
+sys.path.append(os.path.join(qc_dir, '..', 'scripts', 'modules'))
+import firehawk_submit
+
+parser = argparse.ArgumentParser(description='Benchmark walking upstream PDG nodes.')
+parser.add_argument('--nodes', type=int, default=5000, help='number of nodes in the graph')
+parser.add_argument('--width', type=int, default=20, help='nodes per layer of the graph')
+parser.add_argument('--fan-in', type=int, default=3, help='inputs of each node from the layer above')
+args = parser.parse_args()
+
+random.seed(0)
+
+class connection(object):
+    def __init__(self, node):
+        self.node = node
+
+class port(object):
+    def __init__(self, nodes):
+        self.connections = [connection(node) for node in nodes]
+
+class pdg_node(object):
+    def __init__(self, name, inputs):
+        self.name = name
+        self.inputs = [port(inputs)] if inputs else []
+
+    def __repr__(self):
+        return self.name
+
+# each layer takes its inputs from the layer above, and the last node takes every node of the last layer
+layers = []
+count = 0
+while count < args.nodes - 1:
+    above = layers[-1] if layers else []
+    layer = []
+    for index in range(min(args.width, args.nodes - 1 - count)):
+        inputs = random.sample(above, min(args.fan_in, len(above)))
+        layer.append(pdg_node('node{}'.format(count), inputs))
+        count += 1
+    layers.append(layer)
+output = pdg_node('output', layers[-1] if layers else [])
+
+def setdiff_walk(pdg_node):
+    # the walk upstream_pdg_nodes replaced
+    added_nodes = [pdg_node]
+    added_node_dependencies = []
+
+    def append_node_dependencies(node):
+        added_node_dependencies.append(node)
+        for input in node.inputs:
+            for input_connection in input.connections:
+                if input_connection.node not in added_nodes:
+                    added_nodes.append(input_connection.node)
+
+    for node in added_nodes:
+        append_node_dependencies(node)
+    diff_list = np.setdiff1d(added_nodes, added_node_dependencies)
+    while len(diff_list) > 0:
+        for node in diff_list:
+            append_node_dependencies(node)
+        diff_list = np.setdiff1d(added_nodes, added_node_dependencies)
+    return added_nodes
+
+def timed(label, function):
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    print '{}: {:.4f}s'.format(label, elapsed)
+    return result
+
+print '{} nodes in {} layers'.format(count + 1, len(layers))
+ordered = timed('upstream_pdg_nodes', lambda: firehawk_submit.upstream_pdg_nodes(output))
+
+try:
+    import numpy as np
+except ImportError:
+    print 'numpy is not available, the setdiff walk is skipped'
+else:
+    walked = timed('setdiff walk', lambda: setdiff_walk(output))
+    if set(node.name for node in walked) != set(node.name for node in ordered):
+        print 'ERROR: the walks found different nodes'
+        sys.exit(1)
+
+position = dict((node.name, index) for index, node in enumerate(ordered))
+for node in ordered:
+    for dependency in firehawk_submit.pdg_node_inputs(node):
+        if position[dependency.name] > position[node.name]:
+            print 'ERROR: {} is ordered before its input {}'.format(node.name, dependency.name)
+            sys.exit(1)
+if ordered[-1] is not output or len(set(position)) != len(ordered):
+    print 'ERROR: the output node is not last, or a node is repeated'
+    sys.exit(1)
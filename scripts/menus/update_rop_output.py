@@ -1,21 +1,16 @@
 import hou
 import re
+import os
+import sys
+
+menu_path = os.environ['FIREHAWK_HOUDINI_TOOLS'] + '/scripts/modules'
+sys.path.append(menu_path)
+import preview_sweep
 
 print 'set naming conventions on rops'
 
 # all preview switches set to 0.
-for node in hou.node('/').allSubChildren():
-    if node.name().startswith('preview'):
-        print 'disable preview switch', node.path()
-        node.parm('input').set(0)
-    if node.type().name().startswith('read_wedges'):
-        try:
-            print 'disable preview switch', node.path()
-            parm = node.parm('preview_live')
-            if parm:
-                parm.set(0)
-        except:
-            print "didn't disable preview switch", node.path()
+preview_sweep.disable_previews()
 
 
 for node in hou.selectedNodes():
@@ -2,13 +2,19 @@
 
 
 import os
+import re
 import sys
 import traceback
 import json
+import shlex
 
 from Deadline.Scripting import *
 from Deadline.Plugins import *
 
+# The path mapping module is shared with the deadline scheduler and lives alongside this script.
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import path_mapping
+
 
 def append_hlibs_to_sys(hfs):
     """
@@ -35,6 +41,98 @@ def append_hlibs_to_sys(hfs):
     
 
 
+def quote_argument(argument):
+    """
+    Returns argument double quoted if it needs to be, to be split again as one argument.
+    """
+    if argument and not re.search(r'[\s"]', argument):
+        return argument
+    return '"{}"'.format(argument.replace('"', '\\"'))
+
+
+def map_hip_arguments(deadlinePlugin, arguments):
+    """
+    Returns a copy of a list of arguments with each hip file argument mapped to the local site root,
+    and whether any were mapped.
+    """
+    arguments = list(arguments)
+    changed = False
+    for i, argument in enumerate(arguments):
+        if '.hip' not in argument.lower():
+            continue
+        mapped = path_mapping.map_site_path(argument)
+        if mapped is None:
+            deadlinePlugin.LogInfo('no path match to convert path: {}'.format(argument))
+        elif mapped != argument:
+            arguments[i] = mapped
+            changed = True
+    return arguments, changed
+
+
+def map_hip_tokens(deadlinePlugin, command):
+    """
+    Returns command with each hip file argument mapped to the local site root.
+    Arguments are split with shlex so quoted paths containing spaces are handled.  The command is only rebuilt
+    from its arguments if one of them was mapped, so other arguments can't be changed by the mapping.
+    """
+    arguments, changed = map_hip_arguments(deadlinePlugin, shlex.split(str(command)))
+    if not changed:
+        return command
+    return ' '.join(quote_argument(argument) for argument in arguments)
+
+
+def batch_file_argument(arguments):
+    """
+    Returns the batch file of a frame batch job's arguments (runner --batch file), or None.
+    """
+    try:
+        arguments = shlex.split(str(arguments))
+    except ValueError:
+        return None
+    if '--batch' in arguments[:-1]:
+        return arguments[arguments.index('--batch') + 1]
+    return None
+
+
+def map_batch_file(deadlinePlugin, batch_path):
+    """
+    Maps the paths of each work item in a frame batch file as the arguments of a task file are mapped: the argv,
+    env values and log with Deadline's path mapping, and hip files of the argv to the local site root.
+    The file is only rewritten if the mapping changes it.
+    """
+    with open(batch_path, 'r') as batch_file:
+        requests = json.load(batch_file)
+
+    changed = False
+    for request in requests:
+        argv = [RepositoryUtils.CheckPathMapping(str(arg)) for arg in request['argv']]
+        argv, hip_changed = map_hip_arguments(deadlinePlugin, argv)
+        env = dict((key, RepositoryUtils.CheckPathMapping(str(value))) for key, value in request['env'].iteritems())
+        mapped = {'argv': argv, 'env': env}
+        if request.get('log'):
+            mapped['log'] = RepositoryUtils.CheckPathMapping(str(request['log']))
+        for key, value in mapped.iteritems():
+            if value != request[key]:
+                request[key] = value
+                changed = True
+
+    if changed:
+        write_task_file(batch_path, requests)
+        deadlinePlugin.LogInfo('batch updated, dump json data to file: {}'.format(batch_path))
+    else:
+        deadlinePlugin.LogInfo('batch unchanged, file not written: {}'.format(batch_path))
+
+
+def write_task_file(taskFilePath, json_obj):
+    """
+    Writes the task file (or a batch file), replacing it atomically so the plugin never reads a partially written file.
+    """
+    tmpFilePath = '{}.{}.tmp'.format(taskFilePath, os.getpid())
+    with open(tmpFilePath, 'w') as outfile:
+        json.dump(json_obj, outfile)
+    os.rename(tmpFilePath, taskFilePath)
+
+
 def __main__( *args ):
     deadlinePlugin = args[0]
     job = deadlinePlugin.GetJob()
@@ -55,6 +153,16 @@ def __main__( *args ):
     append_hlibs_to_sys(hfs_env)
 
 
+    # Frame batch jobs run the batch runner on a batch file of work items, rather than a task file
+    batch_path = batch_file_argument(deadlinePlugin.GetPluginInfoEntryWithDefault('Arguments', ''))
+    if batch_path:
+        try:
+            map_batch_file(deadlinePlugin, RepositoryUtils.CheckPathMapping(batch_path))
+        except:
+            deadlinePlugin.FailRender('Unable to map batch file {}\n\t {}'.format(batch_path, traceback.format_exc(1)))
+        deadlinePlugin.LogInfo("Finished Test Pre Task!")
+        return
+
     # The task index (corresponds to the task file)
     startFrame = deadlinePlugin.GetStartFrame()
     # deadlinePlugin.LogInfo("got start frame")
@@ -89,49 +197,29 @@ def __main__( *args ):
 
         json_obj = json.loads(line)
         deadlinePlugin.LogInfo('loaded JSON OBJ')
+
+        # Tasks of packed jobs each run a different work item, so the item environment is carried in the task file.
+        for key, value in json_obj.get('env', {}).iteritems():
+            deadlinePlugin.SetProcessEnvironmentVariable(str(key), str(value))
         
         executable = RepositoryUtils.CheckPathMapping(json_obj['executable'].replace( "\"", "" ))
         arguments = RepositoryUtils.CheckPathMapping(json_obj['arguments'])
 
         # ### Alter work item command path ###
+        # The mapped command is computed in memory, and the task file is only rewritten when it changes.
         command = arguments
 
         if '.hip' in command.lower():
-            prod_root = os.environ["PROD_ROOT"]
-            prod_onsite_root = os.environ["PROD_ONSITE_ROOT"]
-            prod_cloud_root = os.environ["PROD_CLOUD_ROOT"]
-
-            def convert_path(item, target_base_path):
-                result = None
-                
-                if item.startswith(prod_root):
-                    result = "{base}"+item[len(prod_root):]
-                elif item.startswith(prod_onsite_root):
-                    result = "{base}"+item[len(prod_onsite_root):]
-                elif item.startswith(prod_cloud_root):
-                    result = "{base}"+item[len(prod_cloud_root):]
-                else:
-                    deadlinePlugin.LogInfo('no path match to convert path')
-                result = str(target_base_path+result[len("{base}"):])
-                return result
-
-            command_list = command.split(' ')
-            new_command_list = []
-            for item in command_list:
-                if '.hip' in item.lower():
-                    item = convert_path(item, prod_root)
-                new_command_list.append(item)
-            
-            command = ' '.join(new_command_list)
-            deadlinePlugin.LogInfo('command updated:')
-            json_obj['arguments'] = command
-
-            arguments = RepositoryUtils.CheckPathMapping(json_obj['arguments'])
-
-            with open(taskFilePath, 'w') as outfile:
-                json.dump(json_obj, outfile)
-
-            deadlinePlugin.LogInfo('dump json data to file: {}'.format(taskFilePath))
+            command = map_hip_tokens(deadlinePlugin, command)
+
+            # compared with the arguments it was mapped from, so Deadline's own path mapping alone doesn't rewrite the file
+            if command != arguments:
+                json_obj['arguments'] = command
+                arguments = RepositoryUtils.CheckPathMapping(command)
+                write_task_file(taskFilePath, json_obj)
+                deadlinePlugin.LogInfo('command updated, dump json data to file: {}'.format(taskFilePath))
+            else:
+                deadlinePlugin.LogInfo('command unchanged, task file not written: {}'.format(taskFilePath))
 
         deadlinePlugin.LogInfo('Task Executable: %s' % executable)
         deadlinePlugin.LogInfo('Task Arguments: %s' % arguments)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Staged cooks of TOP nodes, eg. a preflight followed by the main cook.
+# The work items of every stage are generated up front, so the main node is ready to cook as soon as the preflight
+# completes.  Each stage starts once the stages it waits for have cooked successfully, so independent stages
+# overlap.  A stage downstream of a stage it waited for is generated again before it cooks, since its work items
+# may depend on the results.  If a stage fails or is cancelled, the stages waiting on it are not cooked.
+# The queue time (ready to cook start) and wall time (cook start to completion) of each stage are reported.
+# With hip_name, the session is named hip_name only while work items are generated (eg. as a hip snapshot, so jobs
+# load the snapshot), and the artist's own name is restored between generations, so a save while stages cook
+# can't overwrite the hip that jobs load.
+
+import time
+import threading
+
+import hou
+import pdg
+
+if hou.isUIAvailable():
+    import hdefereval
+
+
+def run_on_main_thread(func, *args):
+    """
+    Runs func on Houdini's main thread.  PDG events arrive on other threads.
+    """
+    if hou.isUIAvailable():
+        hdefereval.executeDeferred(func, *args)
+    else:
+        func(*args)
+
+
+def report(message):
+    """
+    Prints a message, and shows it in a dialog when there is a UI.
+    """
+    print message
+    if hou.isUIAvailable():
+        hou.ui.displayMessage(message)
+
+
+def upstream_names(pdg_node):
+    """
+    Returns the names of all PDG nodes upstream of pdg_node.
+    """
+    names = set()
+    pending = [pdg_node]
+    while pending:
+        node = pending.pop()
+        for input in node.inputs:
+            for connection in input.connections:
+                if connection.node.name not in names:
+                    names.add(connection.node.name)
+                    pending.append(connection.node)
+    return names
+
+
+def node_failed(pdg_node):
+    """
+    Returns True if any work item of pdg_node failed or was cancelled.
+    """
+    failed_states = (pdg.workItemState.CookedFail, pdg.workItemState.CookedCancel)
+    for work_item in pdg_node.workItems:
+        if work_item.state in failed_states:
+            return True
+    return False
+
+
+class stage():
+    def __init__(self, node, wait_for=None, dirty=False):
+        """
+        A TOP node to cook.  wait_for is the indices of the stages that must cook successfully first,
+        by default the previous stage.  With dirty, the node's work items are dirtied before it cooks.
+        """
+        self.node = node
+        self.wait_for = wait_for
+        self.dirty = dirty
+        self.pdg_node = None
+        self.handler = None
+        self.ready_time = None
+        self.start_time = None
+        self.end_time = None
+        self.succeeded = None
+
+    def name(self):
+        return self.node.path()
+
+    def timings(self):
+        """
+        Returns (queue seconds, wall seconds) of the stage, None for phases it hasn't reached.
+        """
+        queue_time = wall_time = None
+        if self.ready_time is not None and self.start_time is not None:
+            queue_time = self.start_time - self.ready_time
+        if self.start_time is not None and self.end_time is not None:
+            wall_time = self.end_time - self.start_time
+        return queue_time, wall_time
+
+
+class cook_pipeline():
+    def __init__(self, stages, on_stage_start=None, on_finish=None, hip_name=None):
+        """
+        Cooks stages in order of their dependencies.  on_stage_start(stage) is called as each stage starts
+        cooking, and on_finish(succeeded, stages) once all stages have cooked, or once one has failed and
+        no more will start.  hip_name is the name the session has while work items are generated.
+        """
+        self.stages = stages
+        for index, s in enumerate(self.stages):
+            if s.wait_for is None:
+                s.wait_for = [index - 1] if index > 0 else []
+        self.on_stage_start = on_stage_start
+        self.on_finish = on_finish
+        self.hip_name = hip_name
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.finished = False
+
+    def start(self):
+        """
+        Generates the work items of the stages that wait on nothing and starts them, then generates the work items
+        of the remaining stages while those cook.  Returns False if a stage can't be cooked.
+        """
+        self.start_time = time.time()
+        first = [s for s in self.stages if not s.wait_for]
+        rest = [s for s in self.stages if s.wait_for]
+        for s in first:
+            if not self.generate(s):
+                return False
+        self.start_ready_stages()
+        for s in rest:
+            if not self.generate(s):
+                return False
+        print "generated {} stages in {:.2f}s".format(len(self.stages), time.time() - self.start_time)
+        self.start_ready_stages()
+        return True
+
+    def generate(self, s):
+        # generate work items without cooking, named as hip_name
+        hip_path = hou.hipFile.path()
+        if self.hip_name is not None:
+            hou.hipFile.setName(self.hip_name)
+        try:
+            s.node.executeGraph(False, False, False, True)
+        finally:
+            if self.hip_name is not None:
+                hou.hipFile.setName(hip_path)
+        s.pdg_node = s.node.getPDGNode()
+        if s.pdg_node is None or not hasattr(s.pdg_node, 'cook'):
+            report("Failed to cook {}, try initiliasing the node first with a standard cook / generate.".format(s.name()))
+            self.finish(False)
+            return False
+        return True
+
+    def start_ready_stages(self):
+        with self.lock:
+            if self.finished:
+                return
+            ready = []
+            for s in self.stages:
+                if s.start_time is not None or s.pdg_node is None:
+                    continue
+                if all(self.stages[i].succeeded for i in s.wait_for):
+                    s.ready_time = s.ready_time or time.time()
+                    s.start_time = time.time()
+                    ready.append(s)
+        for s in ready:
+            self.cook_stage(s)
+
+    def cook_stage(self, s):
+        # deferred, as the cook was before stages, so the caller (eg. a menu callback) returns before it starts
+        run_on_main_thread(self.launch_stage, s)
+
+    def launch_stage(self, s):
+        if self.finished:
+            return
+        if s.dirty:
+            s.pdg_node.dirty(True)
+            regenerate = True
+        else:
+            # regenerate if a stage it waited for is upstream, as its work items may depend on the results
+            upstream = upstream_names(s.pdg_node)
+            regenerate = any(self.stages[i].pdg_node.name in upstream for i in s.wait_for)
+        if regenerate and not self.generate(s):
+            return
+
+        def cook_done(event):
+            run_on_main_thread(self.stage_done, s)
+
+        s.handler = s.pdg_node.addEventHandler(cook_done, pdg.EventType.CookComplete)
+        queue_time = s.start_time - s.ready_time
+        print "cooking stage", s.name(), "queued {:.2f}s".format(queue_time)
+        if self.on_stage_start:
+            self.on_stage_start(s)
+        s.pdg_node.cook(False)
+
+    def stage_done(self, s):
+        with self.lock:
+            if s.end_time is not None:
+                return
+            s.end_time = time.time()
+        if s.handler is not None:
+            s.pdg_node.removeEventHandler(s.handler)
+            s.handler = None
+        s.succeeded = not node_failed(s.pdg_node)
+        queue_time, wall_time = s.timings()
+        print "stage {} {} in {:.2f}s, queued {:.2f}s".format(
+            s.name(), 'cooked' if s.succeeded else 'failed or was cancelled', wall_time, queue_time)
+
+        if not s.succeeded:
+            # stages waiting on a failed stage will never start
+            self.finish(False)
+            return
+        if all(other.succeeded for other in self.stages):
+            self.finish(True)
+            return
+        for other in self.stages:
+            if other.start_time is None and all(self.stages[i].end_time is not None for i in other.wait_for):
+                other.ready_time = time.time()
+        self.start_ready_stages()
+
+    def finish(self, succeeded):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        for s in self.stages:
+            queue_time, wall_time = s.timings()
+            print "stage timing", s.name(), "queue", queue_time, "wall", wall_time
+        if self.start_time is not None:
+            print "pipeline {} in {:.2f}s".format('cooked' if succeeded else 'stopped', time.time() - self.start_time)
+        if self.on_finish:
+            self.on_finish(succeeded, self.stages)
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+# A pool of threads running deadlinecommand calls for the deadline scheduler (submit, status polling, fail and
+# log lookup).  deadlinecommand has no mode that takes commands over stdin, so each call of DeadlineCommandPool
+# starts its own process and pays for its startup.  The pool only resolves the command and its environment once
+# rather than per call, and runs independent calls concurrently.
+# Where a Deadline Web Service is running, DeadlineWebServicePool sends the same calls to its REST api instead,
+# over one kept alive connection per worker, so there is no startup per call.  Calls the REST api has no
+# equivalent for still run deadlinecommand.  qc/deadline_command_benchmark.py measures both against serial calls.
+
+import sys
+import json
+import Queue
+import httplib
+import urllib
+import datetime
+import threading
+import traceback
+import subprocess
+
+
+class DeadlineCommandRequest(object):
+    """
+    A pending call on a DeadlineCommandPool.
+    result() blocks until the call has completed and returns (output, errors).
+    """
+    def __init__(self, arguments, callback=None):
+        self.arguments = arguments
+        self.callback = callback
+        self.output = ""
+        self.errors = ""
+        self.done = threading.Event()
+
+    def result(self):
+        self.done.wait()
+        return self.output, self.errors
+
+
+class DeadlineCommandPool(object):
+    """
+    Runs deadlinecommand calls on a pool of worker threads, each call in a new process.
+    resolve() returns (deadline command, startupinfo, creationflags, environment) to launch it with.
+    """
+    def __init__(self, resolve, num_workers=4):
+        self.resolve = resolve
+        self.num_workers = num_workers
+        self.requests = Queue.Queue()
+        self.workers = []
+        self.workers_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-resolves the deadline command and its environment, eg. when the process environment has changed.
+        """
+        self.deadline_command, self.startupinfo, self.creationflags, self.environment = self.resolve()
+
+    def _ensureWorkers(self):
+        with self.workers_lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            for i in xrange(self.num_workers - len(self.workers)):
+                worker = threading.Thread(target=self._workerLoop, name='deadlinecommand_{}'.format(i))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def _workerLoop(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            try:
+                request.output, request.errors = self._execute(request.arguments)
+            except:
+                request.output, request.errors = "", traceback.format_exc()
+            request.done.set()
+            if request.callback:
+                try:
+                    request.callback(request)
+                except:
+                    traceback.print_exc()
+                    sys.stderr.flush()
+
+    def _execute(self, arguments):
+        if len(self.deadline_command) == 0:
+            return "", "deadlinecommand not found, ensure DEADLINE_PATH is set"
+
+        # Specifying PIPE for all handles to workaround a Python bug on Windows. The unused handles are then closed immediatley afterwards.
+        proc = subprocess.Popen([self.deadline_command] + list(arguments), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            startupinfo=self.startupinfo, env=self.environment, creationflags=self.creationflags)
+        output, errors = proc.communicate()
+        return output.strip(), errors.strip()
+
+    def callAsync(self, arguments, callback=None):
+        """
+        Queues a deadline command call and returns its DeadlineCommandRequest immediately.
+        If given, callback(request) is invoked on the worker thread once the call completes.
+        Callbacks may queue further calls with callAsync, but must not block on call().
+        """
+        self._ensureWorkers()
+        request = DeadlineCommandRequest(arguments, callback)
+        self.requests.put(request)
+        return request
+
+    def call(self, arguments):
+        """
+        Calls the deadline command with given arguments and blocks until it returns (output, errors).
+        """
+        return self.callAsync(arguments).result()
+
+    def stop(self):
+        """
+        Stops the worker threads once the requests already queued have been processed.
+        """
+        with self.workers_lock:
+            for worker in self.workers:
+                self.requests.put(None)
+            self.workers = []
+
+
+# Deadline's job and task status codes, as the REST api reports them
+job_status_names = {0: 'Unknown', 1: 'Active', 2: 'Suspended', 3: 'Completed', 4: 'Failed', 6: 'Pending'}
+task_status_names = {1: 'Unknown', 2: 'Queued', 3: 'Suspended', 4: 'Rendering', 5: 'Completed', 6: 'Failed', 8: 'Pending'}
+
+
+def read_info_file(path):
+    """
+    Returns the key=value lines of a job or plugin info file as a dict.
+    """
+    info = {}
+    with open(path, 'r') as info_file:
+        for line in info_file:
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                info[key.strip()] = value.strip()
+    return info
+
+
+def format_duration(seconds):
+    """
+    Returns seconds in the hh:mm:ss.fffffff form deadlinecommand reports render times in.
+    """
+    minutes, seconds = divmod(max(0.0, seconds), 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return '{:02d}:{:02d}:{:010.7f}'.format(hours, minutes, seconds)
+
+
+def parse_date(value):
+    """
+    Returns a datetime for a date of the REST api, or None.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+
+def elapsed_seconds(start, end):
+    start = parse_date(start)
+    end = parse_date(end)
+    if start is None or end is None:
+        return 0.0
+    return (end - start).total_seconds()
+
+
+class DeadlineWebServicePool(DeadlineCommandPool):
+    """
+    Runs deadline command calls as requests to a Deadline Web Service, on a pool of worker threads which each
+    keep their connection open between calls.  The calls the deadline scheduler makes (submitting one or more
+    jobs, failing jobs, and job and task status queries) are translated to the REST api, and their results are
+    returned in the form deadlinecommand prints them.  Other calls run deadlinecommand through resolve().
+    address is the host and port of the web service, eg. deadline-ws:8082.
+    """
+    def __init__(self, address, resolve, num_workers=4, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self.connections = threading.local()
+        DeadlineCommandPool.__init__(self, resolve, num_workers)
+
+    def _connection(self):
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            connection = self.connections.connection = httplib.HTTPConnection(self.address, timeout=self.timeout)
+        return connection
+
+    def _request(self, method, path, body=None):
+        """
+        Sends a request on the worker's connection and returns (status, parsed json or text).
+        A connection the server has closed since the last call is reopened once.
+        """
+        headers = {'Connection': 'keep-alive'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in (0, 1):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, IOError):
+                connection.close()
+                self.connections.connection = None
+                if attempt:
+                    raise
+        try:
+            data = json.loads(data)
+        except ValueError:
+            pass
+        return response.status, data
+
+    def _execute(self, arguments):
+        arguments = list(arguments)
+        # the web service serves its own repository
+        if arguments and arguments[0].lower() == '--runcommandforrepository':
+            arguments = arguments[3:]
+        command = arguments[0].lstrip('-').lower() if arguments else ''
+        if command == 'submitjob':
+            return self._submitJobs([(arguments[1], arguments[2])])
+        if command == 'submitmultiplejobs':
+            jobs = [(arguments[i + 1], arguments[i + 2]) for i in xrange(1, len(arguments) - 2, 3) if arguments[i].lower() == '-job']
+            return self._submitJobs(jobs)
+        if command == 'failjob':
+            return self._failJobs(arguments[1])
+        if command == 'getjob':
+            return self._getJobs(arguments[1])
+        if command == 'getjobtasks':
+            return self._getJobTasks(arguments[1])
+        return DeadlineCommandPool._execute(self, arguments)
+
+    def _submitJobs(self, jobs):
+        lines = []
+        for job_file, plugin_file in jobs:
+            body = {'JobInfo': read_info_file(job_file), 'PluginInfo': read_info_file(plugin_file), 'AuxFiles': [], 'IdOnly': True}
+            status, data = self._request('POST', '/api/jobs', body)
+            if status != 200 or not isinstance(data, dict) or '_id' not in data:
+                # the job ids already submitted are still reported, so the scheduler can fail them
+                lines.insert(0, 'Error: submission of {} failed with {}: {}'.format(job_file, status, data))
+                break
+            lines.append('JobID={}'.format(data['_id']))
+        if lines and not lines[0].startswith('Error'):
+            lines.insert(0, 'Result=Success')
+        return '\n'.join(lines), ''
+
+    def _failJobs(self, job_ids):
+        errors = []
+        for job_id in [job_id for job_id in job_ids.split(',') if job_id]:
+            status, data = self._request('PUT', '/api/jobs', {'Command': 'fail', 'JobID': job_id})
+            if status != 200:
+                errors.append('{}: {} {}'.format(job_id, status, data))
+        if errors:
+            return 'Error: unable to fail jobs', '\n'.join(errors)
+        return 'Success', ''
+
+    def _getJobs(self, job_ids):
+        status, data = self._request('GET', '/api/jobs?' + urllib.urlencode({'JobID': job_ids}))
+        if status != 200 or not isinstance(data, list):
+            return 'Error: job query failed with {}: {}'.format(status, data), ''
+        blocks = []
+        for job in data:
+            block = ['ID={}'.format(job.get('_id', '')), 'Status={}'.format(job_status_names.get(job.get('Stat'), 'Unknown'))]
+            block.append('TotalRenderTime={}'.format(format_duration(elapsed_seconds(job.get('DateStart'), job.get('DateComp')))))
+            blocks.append('\n'.join(block))
+        return '\n\n'.join(blocks), ''
+
+    def _getJobTasks(self, job_id):
+        status, data = self._request('GET', '/api/tasks?' + urllib.urlencode({'JobID': job_id}))
+        tasks = data.get('Tasks') if isinstance(data, dict) else data
+        if status != 200 or not isinstance(tasks, list):
+            return 'Error: task query failed with {}: {}'.format(status, data), ''
+        blocks = []
+        for task in tasks:
+            block = ['TaskId={}'.format(task.get('TaskID', '')), 'TaskStatus={}'.format(task_status_names.get(task.get('Stat'), 'Unknown'))]
+            block.append('TaskRenderTime={}'.format(format_duration(elapsed_seconds(task.get('Start'), task.get('Comp')))))
+            blocks.append('\n'.join(block))
+        return '\n\n'.join(blocks), ''
@@ -1,87 +1,86 @@
 print 'POST TASK SCRIPT'
 
+# This deadline post task script is used in the deadline scheduler in TOPS when "Report Completion From Post Task" is enabled.
+# It reports the task's work item as cooked, with its render time, straight to the PDG result server,
+# so the scheduler doesn't have to wait for its repository polling to discover the completion.
+# Polling remains as a slow reconciliation sweep for any message lost on the way.
+
 import os
 import sys
 import json
-import re
+import traceback
+import xmlrpclib
 
 from Deadline.Scripting import *
 from Deadline.Plugins import *
 
-hfs_env=os.environ['HFS']
-print 'hfs_env:', hfs_env
-houpythonlib = os.path.join(hfs_env, 'houdini/python2.7libs')
-print 'houpythonlib:', houpythonlib
-sys.path.append(houpythonlib)
-
-# pythonpath = os.environ['PYTHONPATH']
-# print 'pythonpath', pythonpath
 
-sys.path.append('/usr/lib64/python2.7/site-packages')
-sys.path.append('/home/deadlineuser/.local/lib/python2.7/site-packages')
-sys.path.append('/usr/lib/python2.7/site-packages')
+def get_task_work_item(deadlinePlugin, job):
+    """
+    Returns the work item name the current task cooked.
+    Tasks of packed jobs each cook a different work item, named in the task's task file.
+    Otherwise the job cooks a single work item, named in the job environment.
+    """
+    jobDir = deadlinePlugin.GetPluginInfoEntryWithDefault('PDGJobDirectory', '')
+    if jobDir:
+        taskFilePath = os.path.join(jobDir, 'task_{}.txt'.format(deadlinePlugin.GetStartFrame()))
+        try:
+            with open(taskFilePath, 'r') as task_file:
+                item_name = json.load(task_file).get('item_name')
+            if item_name:
+                return item_name
+        except (IOError, ValueError):
+            deadlinePlugin.LogWarning('Unable to read work item from task file: {}'.format(taskFilePath))
+    return job.GetJobEnvironmentKeyValue('PDG_ITEM_NAME')
+
+
+def get_render_time(task):
+    """
+    Returns the render time of the task in seconds, or 0 if it isn't available.
+    """
+    for attr in ('TaskRenderTime', 'RenderTime'):
+        value = getattr(task, attr, None)
+        if value is None:
+            continue
+        try:
+            return float(getattr(value, 'TotalSeconds', value))
+        except (TypeError, ValueError):
+            pass
+    return 0
+
+
+def report_work_item(result_server, item_name, succeeded, cook_duration, jobid):
+    """
+    Reports the work item's completion to the PDG result server (the scheduler's CallbackServerMixin).
+    """
+    proxy = xmlrpclib.ServerProxy('http://' + result_server)
+    if succeeded:
+        proxy.success(item_name, -1, cook_duration, jobid)
+    else:
+        proxy.failed(item_name, -1, jobid)
 
-# import pdgcmd
 
 def __main__( *args ):
-    
-    print 'main post task'
-    
     deadlinePlugin = args[0]
     job = deadlinePlugin.GetJob()
-
-    deadlinePlugin.LogInfo(str(args))
-    
-    # for item in args:
-    #     deadlinePlugin.LogInfo(str(item))
-
-    deadlinePlugin.LogInfo("In Test Task!")
-
-    for item in dir(job):
-
-        deadlinePlugin.LogInfo(str(item))
-        if 'get' in str(item).lower():
-            try:
-                method = 'job.'+str(item)+'()'
-                test = eval(method)
-                deadlinePlugin.LogInfo(str(test))
-            except:
-                test = None
-
-    deadlinePlugin.LogInfo("job.GetOutputFileNamesForTask()")
-    deadlinePlugin.LogInfo(str(job.GetOutputFileNamesForTask))
-    deadlinePlugin.LogInfo(str(job.GetOutputFileNamesForTask()))
-    #deadlinePlugin.LogInfo(dir(job.GetOutputFileNamesForTask()))
-    
-    # for item in job:
-    #     deadlinePlugin.LogInfo(str(item))
-
-
-    # if hfs_env:
-    #     # Append $PYTHONPATH if not set
-    #     houdini_python_libs = houpythonlib
-    #     python_path = GetProcessEnvironmentVariable('PYTHONPATH')
-    #     if python_path:
-    #         if not houdini_python_libs in python_path:
-    #             python_path.append(path_combine + houdini_python_libs)
-    #     else:
-    #         python_path = houdini_python_libs
-
-    #     LogInfo('Setting PYTHONPATH: {}'.format(python_path))
-    #     SetProcessEnvironmentVariable('PYTHONPATH', python_path)
-    # itemname = None
-    # callbackserver = None
-
-    # try:
-    #     if not itemname:
-    #         itemname = os.environ['PDG_ITEM_NAME']
-    #         print 'itemname', itemname
-    #     if not callbackserver:
-    #         callbackserver = os.environ['PDG_RESULT_SERVER']
-    # except KeyError as exception: 
-    #     print "ERROR: {} must be in environment or specified via argument flag.".format(exception.message)
-    #     exit(1)
-    # print 'get work item'
-    # work_item = WorkItem(getWorkItemJsonPath(itemname))
-
-    # print 'dir work_item', work_item
\ No newline at end of file
+    task = deadlinePlugin.GetCurrentTask()
+
+    result_server = job.GetJobEnvironmentKeyValue('PDG_RESULT_SERVER')
+    if not result_server:
+        deadlinePlugin.LogWarning('PDG_RESULT_SERVER not found in job environment, completion will be found by polling.')
+        return
+
+    item_name = get_task_work_item(deadlinePlugin, job)
+    if not item_name:
+        deadlinePlugin.LogWarning('No work item found for task, completion will be found by polling.')
+        return
+
+    # Post task scripts only run for tasks that rendered without error,
+    # failed tasks are reported by the scheduler's reconciliation sweep.
+    render_time = get_render_time(task)
+    try:
+        report_work_item(result_server, item_name, True, render_time, job.JobId)
+        deadlinePlugin.LogInfo('Reported work item {} cooked in {}s to {}'.format(item_name, render_time, result_server))
+    except:
+        # The sweep will still pick up the completion, so this must not fail the task.
+        deadlinePlugin.LogWarning('Unable to report work item {} to {}\n\t {}'.format(item_name, result_server, traceback.format_exc(1)))
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Frame batching of ROP fetch work items, shared by the local and deadline schedulers.
+# Consecutive frames of the same ROP and wedge are coalesced into one batch, which hython_worker.py --batch
+# cooks in a single hython session, reporting each work item to the PDG result server as it completes.
+# A frame that would leave a gap in the open batch ends it, so every batch is a run of consecutive frames,
+# though the frames of a run may become ready in any order.
+# The number of frames in a batch adapts to the measured cook time of a frame.
+
+import os
+import json
+import shlex
+import threading
+
+
+def rop_fetch_args(argv):
+    """
+    Returns (hip, rop) of a ROP fetch command's argv running rop.py, or None if it isn't one.
+    """
+    if len(argv) < 2 or os.path.basename(argv[1]) != 'rop.py':
+        return None
+    args = argv[2:-1]
+    if '-p' not in args:
+        return None
+    hip = argv[argv.index('-p') + 1]
+    rop = argv[argv.index('-n') + 1] if '-n' in args else None
+    return hip, rop
+
+
+def batch_key(work_item, item_command):
+    """
+    Returns the key of the batches a work item can join, or None if its command can't be batched.
+    Items with the same key cook the same ROP of the same hip and wedge.
+    """
+    try:
+        argv = shlex.split(item_command.encode('ascii', 'ignore'))
+    except ValueError:
+        return None
+    args = rop_fetch_args(argv)
+    if args is None:
+        return None
+    wedge = work_item.data.intData('wedgeindex', 0)
+    return (work_item.node.name, args[0], args[1], wedge)
+
+
+def frame_step(work_item):
+    """
+    Returns the frame increment between the work items of a ROP, 1 if it isn't known.
+    """
+    step = getattr(work_item, 'frameStep', 1)
+    return step if step > 0 else 1
+
+
+def continues_run(frames, frame, step):
+    """
+    Returns True if frame can join a batch of frames and leave it a run of consecutive frames, ie. it is no
+    more than step beyond either end of the run.
+    """
+    if not frames:
+        return True
+    tolerance = step * 1.001
+    return min(frames) - tolerance <= frame <= max(frames) + tolerance
+
+
+def write_batch(path, entries):
+    """
+    Writes a batch file for hython_worker.py --batch.  Each entry is a dict of the work item's
+    item_name, argv (the rop.py command), env and optionally the log to write its output to.
+    """
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as batch_file:
+        json.dump([dict((k, entry[k]) for k in ('item_name', 'argv', 'env', 'log') if k in entry) for entry in entries],
+                  batch_file)
+
+
+class batch_sizer():
+    def __init__(self, target_seconds, max_size, smoothing=0.3):
+        """
+        Sizes batches to take about target_seconds to cook, up to max_size frames, from a moving
+        average of the cook time of a frame for each batch key.
+        """
+        self.target_seconds = max(1, target_seconds)
+        self.max_size = max(1, max_size)
+        self.smoothing = smoothing
+        self.frame_times = {}
+        self.lock = threading.Lock()
+
+    def size(self, key):
+        """
+        Returns the number of frames to batch for key.  Until a frame has been timed,
+        small batches are used so the first measurement arrives quickly.
+        """
+        with self.lock:
+            frame_time = self.frame_times.get(key)
+        if frame_time is None:
+            return min(2, self.max_size)
+        if frame_time <= 0:
+            return self.max_size
+        return max(1, min(self.max_size, int(self.target_seconds / frame_time)))
+
+    def record(self, key, seconds):
+        """
+        Records the cook time of a frame of key.
+        """
+        if seconds is None or seconds < 0:
+            return
+        with self.lock:
+            frame_time = self.frame_times.get(key)
+            if frame_time is None:
+                self.frame_times[key] = seconds
+            else:
+                self.frame_times[key] = frame_time + self.smoothing * (seconds - frame_time)
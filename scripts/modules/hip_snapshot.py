@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+# Content addressed snapshots of hip files for submission.
+# A submission cooks from a snapshot of the hip instead of the artist's working file, so later saves can't change
+# what the farm loads.  Snapshots are named by the hash of their contents, so resubmitting an unchanged hip reuses the
+# existing snapshot, and only changed hips are written and synced to other sites.  Since each save writes the save
+# time into the hip, a submission only saves the hip when it has unsaved changes.
+# Snapshots are kept beside the hip as <hip basename>.<hash>.hip, so $HIP is the same for the cook, and the hip
+# version in the name (eg. _v003_) is still found by the versioning.  Each use of a snapshot is appended to
+# hip_snapshots.jsonl in the same directory.
+# Enabled with FIREHAWK_HIP_SNAPSHOTS=1.  FIREHAWK_HIP_SNAPSHOT_KEEP sets the number of snapshots kept per hip,
+# and FIREHAWK_HIP_SNAPSHOT_DAYS how long unused older snapshots are kept.
+
+import os
+import re
+import json
+import time
+import shutil
+import getpass
+import hashlib
+
+manifest_name = 'hip_snapshots.jsonl'
+hash_length = 16
+
+
+def snapshots_enabled():
+    return os.environ.get('FIREHAWK_HIP_SNAPSHOTS', '0') not in ('', '0')
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Returns the sha1 hex digest of a file's contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hip_base(hip_path):
+    """
+    Returns the name of a hip file without its extension, and without the hash if it is a snapshot.
+    """
+    base = os.path.splitext(os.path.basename(hip_path))[0]
+    match = re.match(r'^(.*)\.[0-9a-f]{%d}$' % hash_length, base)
+    if match:
+        return match.group(1)
+    return base
+
+
+class snapshot_store():
+    def __init__(self, directory, keep=None, days=None):
+        """
+        The snapshots of the hip files in directory.  The newest keep snapshots of each hip are always kept,
+        and older snapshots are removed once they haven't been used for days.
+        """
+        self.directory = directory
+        if keep is None:
+            keep = int(os.environ.get('FIREHAWK_HIP_SNAPSHOT_KEEP', 10))
+        if days is None:
+            days = float(os.environ.get('FIREHAWK_HIP_SNAPSHOT_DAYS', 7))
+        self.keep = max(1, keep)
+        self.days = days
+        self.manifest_path = os.path.join(directory, manifest_name)
+
+    def snapshot_path(self, hip_path, content_hash):
+        ext = os.path.splitext(hip_path)[1] or '.hip'
+        return os.path.join(self.directory, '{}.{}{}'.format(hip_base(hip_path), content_hash[:hash_length], ext))
+
+    def snapshot(self, hip_path, **info):
+        """
+        Returns the path of the snapshot of hip_path, writing it only if no snapshot of the same contents exists.
+        The use is recorded in the manifest with any extra info given, and old snapshots of the hip are evicted.
+        """
+        content_hash = file_hash(hip_path)
+        path = self.snapshot_path(hip_path, content_hash)
+        # a snapshot is verified before reuse, in case it was saved over while it was the session's hip
+        reused = os.path.isfile(path) and os.path.getsize(path) == os.path.getsize(hip_path) \
+            and file_hash(path) == content_hash
+        if reused:
+            # the mtime of a snapshot is the time it was last used, for eviction
+            os.utime(path, None)
+        else:
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            shutil.copyfile(hip_path, tmp_path)
+            os.rename(tmp_path, path)
+
+        record = dict(info)
+        record.update({
+            'time': time.time(),
+            'user': getpass.getuser(),
+            'hip': hip_path,
+            'snapshot': path,
+            'hash': content_hash,
+            'bytes': os.path.getsize(path),
+            'reused': reused,
+        })
+        self.record(record)
+        print '{} hip snapshot {} for {}'.format('reused' if reused else 'wrote', path, hip_path)
+
+        self.evict(hip_path, exclude=path)
+        return path
+
+    def record(self, record):
+        # appends are atomic for lines this size, so concurrent submissions don't interleave
+        with open(self.manifest_path, 'a') as manifest:
+            manifest.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def snapshots(self, hip_path):
+        """
+        Returns the snapshots of hip_path as (mtime, path), newest first.
+        """
+        pattern = re.compile(r'^%s\.[0-9a-f]{%d}%s$' % (
+            re.escape(hip_base(hip_path)), hash_length, re.escape(os.path.splitext(hip_path)[1] or '.hip')))
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if pattern.match(name):
+                path = os.path.join(self.directory, name)
+                try:
+                    snapshots.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        snapshots.sort(reverse=True)
+        return snapshots
+
+    def evict(self, hip_path, exclude=None):
+        """
+        Removes the snapshots of hip_path beyond the newest keep that haven't been used for days.
+        Returns the removed paths.
+        """
+        cutoff = time.time() - self.days * 86400
+        removed = []
+        for mtime, path in self.snapshots(hip_path)[self.keep:]:
+            if path == exclude or mtime >= cutoff:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                print "unable to remove hip snapshot", path, e
+                continue
+            removed.append(path)
+        if removed:
+            print 'evicted {} hip snapshots of {}'.format(len(removed), hip_path)
+        return removed
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+# A long lived hython process used by the local scheduler's hython pool to cook ROP fetch work items
+# without paying for hython startup and a hip load on every item.
+# Each line read from stdin is a json request to run the PDG rop.py job script:
+#   {"argv": [script, args...], "env": {...}, "cwd": dir, "log": path}
+# The script's output goes to the request's log, and one json reply line is written back per request:
+#   {"code": exit code, "utime": s, "stime": s, "maxrss": kb}
+# Replies are written to the fd given by $FIREHAWK_HYTHON_REPLY_FD, which nothing else writes to, so output of
+# hython's startup, asset loads and tasks without a log can't corrupt them.  That output goes to stderr.
+# maxrss is the peak of the worker over its lifetime, not of the task, and is used to recycle the worker.
+# The script reports its results to the PDG callback server itself, as it would in a fresh process.
+# The worker exits when stdin is closed.
+#
+# With --batch <file> it instead cooks the frame batch written by frame_batching.write_batch, a json list of requests
+# for work items, in one hython session.  A request's env is overlaid on the environment of the batch process.
+# Each work item is reported to the PDG result server as it completes.  The exit code is 0 unless a work item failed
+# and its failure couldn't be reported, so Deadline doesn't requeue a batch whose results PDG already has.  Frames
+# that succeed are marked in <batch file>.done, and a batch that is run again skips them.
+
+import os
+import sys
+import json
+import time
+import runpy
+import resource
+import traceback
+import xmlrpclib
+
+import hou
+
+# Modules of the PDG job scripts, which read the job environment on import, so are reimported for each task.
+job_module_prefixes = ('pdgcmd', 'pdgjob')
+
+loaded_hip = {'path': None, 'mtime': None}
+
+
+def patch_hip_load():
+    """
+    Wraps hou.hipFile.load to skip reloading the hip file already loaded by a previous task,
+    unless it changed on disk or the previous task left unsaved changes in the session.
+    """
+    hip_load = hou.hipFile.load
+
+    def load(file_name, *args, **kwargs):
+        path = os.path.abspath(os.path.expandvars(file_name))
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if path == loaded_hip['path'] and mtime == loaded_hip['mtime'] and mtime is not None \
+                and not hou.hipFile.hasUnsavedChanges():
+            print 'hython worker: {} is already loaded'.format(file_name)
+            return
+        loaded_hip['path'] = None
+        hip_load(file_name, *args, **kwargs)
+        loaded_hip['path'] = path
+        loaded_hip['mtime'] = mtime
+
+    hou.hipFile.load = load
+
+
+def exit_code(e):
+    """
+    Returns the process exit code for a SystemExit.
+    """
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print e.code
+    return 1
+
+
+def run_task(request):
+    """
+    Runs the request's script as __main__ with its argv and environment, and output redirected to its log if given.
+    Returns the exit code.
+    """
+    if request.get('log'):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        log_fd = os.open(request['log'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(log_fd)
+
+    os.environ.clear()
+    os.environ.update(dict((str(k), str(v)) for k, v in request['env'].iteritems()))
+    if request.get('cwd'):
+        os.chdir(request['cwd'])
+
+    saved_argv = sys.argv
+    sys.argv = [str(arg) for arg in request['argv']]
+    code = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit as e:
+        code = exit_code(e)
+    except:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.argv = saved_argv
+        for name in list(sys.modules):
+            if name.startswith(job_module_prefixes):
+                del sys.modules[name]
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return code
+
+
+def report_work_item(env, item_name, succeeded, cook_duration):
+    """
+    Reports a work item's completion to the PDG result server of its environment.  Returns True if it was reported.
+    """
+    result_server = env.get('PDG_RESULT_SERVER')
+    if not result_server:
+        return False
+    jobid = env.get('PDG_JOBID', '')
+    try:
+        proxy = xmlrpclib.ServerProxy('http://' + result_server)
+        if succeeded:
+            proxy.success(item_name, -1, cook_duration, jobid)
+        else:
+            proxy.failed(item_name, -1, jobid)
+    except:
+        # the scheduler reports the remaining items of the batch when the process exits
+        traceback.print_exc()
+        return False
+    return True
+
+
+def done_marker(batch_path, item_name):
+    """
+    Returns the path of the file marking that a work item of a batch succeeded.
+    """
+    return os.path.join(batch_path + '.done', item_name)
+
+
+def run_batch(batch_path):
+    """
+    Cooks each work item of a batch in turn, reporting them individually.  Work items marked done by an earlier
+    run of the batch are only reported again.  Returns the exit code.
+    """
+    with open(batch_path, 'r') as batch_file:
+        requests = json.load(batch_file)
+
+    base_env = dict(os.environ)
+    worker_out = os.dup(1)
+    worker_err = os.dup(2)
+    unreported_failures = 0
+    for request in requests:
+        env = dict(base_env)
+        env.update(request['env'])
+        request['env'] = env
+        item_name = str(request['item_name'])
+        marker = done_marker(batch_path, item_name)
+        if os.path.exists(marker):
+            print 'hython worker: {} already succeeded'.format(item_name)
+            sys.stdout.flush()
+            report_work_item(env, item_name, True, 0)
+            continue
+        start = time.time()
+        code = run_task(request)
+        os.dup2(worker_out, 1)
+        os.dup2(worker_err, 2)
+        cook_duration = time.time() - start
+        print 'hython worker: {} exited with {} in {:.2f}s'.format(request['item_name'], code, cook_duration)
+        sys.stdout.flush()
+        if code == 0:
+            try:
+                if not os.path.isdir(os.path.dirname(marker)):
+                    os.makedirs(os.path.dirname(marker))
+                open(marker, 'w').close()
+            except (IOError, OSError):
+                traceback.print_exc()
+        reported = report_work_item(env, item_name, code == 0, cook_duration)
+        if code != 0 and not reported:
+            # only the exit code can fail the work item
+            unreported_failures += 1
+    return 1 if unreported_failures else 0
+
+
+def reply_channel():
+    """
+    Returns a file for replies, on the fd given by $FIREHAWK_HYTHON_REPLY_FD, else on the original stdout.
+    The worker's stdout is redirected to stderr either way.
+    """
+    reply_fd = os.environ.pop('FIREHAWK_HYTHON_REPLY_FD', None)
+    sys.stdout.flush()
+    if reply_fd is None:
+        reply_fd = os.dup(1)
+    os.dup2(2, 1)
+    return os.fdopen(int(reply_fd), 'w')
+
+
+def main():
+    reply = reply_channel()
+    worker_log = os.dup(2)
+
+    patch_hip_load()
+
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        code = run_task(request)
+        after = resource.getrusage(resource.RUSAGE_SELF)
+
+        os.dup2(worker_log, 1)
+        os.dup2(worker_log, 2)
+
+        reply.write(json.dumps({
+            'code': code,
+            'utime': after.ru_utime - before.ru_utime,
+            'stime': after.ru_stime - before.ru_stime,
+            'maxrss': after.ru_maxrss}) + '\n')
+        reply.flush()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--batch':
+        patch_hip_load()
+        sys.exit(run_batch(sys.argv[2]))
+    main()
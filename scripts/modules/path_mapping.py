@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+# Maps paths between the production roots of each site (PROD_ROOT, PROD_ONSITE_ROOT, PROD_CLOUD_ROOT).
+# Used by the deadline scheduler and the deadline pre task script to point hip files and result data
+# at the physical location of the submitting site, so the same job can run against any mounted site.
+
+import os
+import re
+
+# Marks a trie node that completes a root.
+_root_end = None
+
+# Matches the hip file argument of a hython command, eg: hython rop.py -p "/prod/shot/shot_v001.hip" -n ...
+hip_arg_re = re.compile(r'(^.*?-p.\")(.*?)(".-n.*)')
+
+site_root_vars = ('PROD_ROOT', 'PROD_ONSITE_ROOT', 'PROD_CLOUD_ROOT')
+
+separators = '/\\'
+separator_re = re.compile(r'[/\\]')
+
+
+def split_path(path, maxsplit=-1):
+    """
+    Splits a path into its components on either separator, so windows and mixed paths split the same as posix
+    paths.  The trailing separator of a directory is ignored.  With maxsplit, the rest of the path after that
+    many splits is left as the last component.
+    """
+    if len(path) > 1:
+        path = path.rstrip(separators)
+    if '\\' in path:
+        return separator_re.split(path, max(maxsplit, 0))
+    return path.split('/', maxsplit)
+
+
+def path_separator(path):
+    """
+    Returns the separator to join components of path with, a backslash only if path uses no forward slashes.
+    """
+    if '\\' in path and '/' not in path:
+        return '\\'
+    return '/'
+
+
+def part_key(part):
+    """
+    Returns the key a leading path component is matched by.  Drive letters are matched in either case.
+    """
+    if len(part) == 2 and part[1] == ':':
+        return part.lower()
+    return part
+
+
+class root_mapping():
+    def __init__(self, roots, target):
+        """
+        Builds the trie of path components for roots, each of which will be mapped to target.
+        Where roots overlap, the longest matching root wins.
+        Mapped paths are joined with the separator of target.
+        """
+        self.target = target.rstrip(separators) if len(target) > 1 else target
+        self.separator = path_separator(target)
+        self.roots = [root for root in roots if root]
+        self.trie = {}
+        self.depth = 0
+        for root in self.roots:
+            node = self.trie
+            parts = split_path(root)
+            self.depth = max(self.depth, len(parts))
+            parts[0] = part_key(parts[0])
+            for part in parts:
+                node = node.setdefault(part, {})
+            node[_root_end] = True
+
+    def match_length(self, parts):
+        """
+        Returns the number of leading path components of parts matching the longest root, or 0 if none match.
+        """
+        node = self.trie.get(part_key(parts[0]))
+        if node is None:
+            return 0
+        matched = 1 if _root_end in node else 0
+        for i in range(1, len(parts)):
+            node = node.get(parts[i])
+            if node is None:
+                break
+            if _root_end in node:
+                matched = i + 1
+        return matched
+
+    def map_path(self, path):
+        """
+        Returns path with its root replaced by the target root, or None if path is not under any root.
+        A trailing separator is kept.
+        """
+        # only the components a root could match are split, the rest is kept whole
+        parts = split_path(path, self.depth)
+        matched = self.match_length(parts)
+        if not matched:
+            return None
+        mapped = self.target
+        if matched < len(parts):
+            rest = self.separator.join(parts[matched:])
+            other = '/' if self.separator == '\\' else '\\'
+            if other in rest:
+                rest = rest.replace(other, self.separator)
+            mapped += self.separator + rest
+        if len(path) > 1 and path[-1] in separators:
+            mapped += self.separator
+        return mapped
+
+    def map_paths(self, paths):
+        """
+        Maps a list of paths, leaving any path that isn't under a root unchanged.
+        """
+        map_path = self.map_path
+        mapped = []
+        for path in paths:
+            result = map_path(path)
+            mapped.append(path if result is None else result)
+        return mapped
+
+    def map_hip_argument(self, command):
+        """
+        Returns command with the path of its -p "*.hip" argument mapped to the target root.
+        The command is returned unchanged if it has no hip argument, or the hip isn't under a root.
+        """
+        match = hip_arg_re.match(command)
+        if match is None or '.hip' not in match.group(2):
+            return command
+        hip_path = self.map_path(match.group(2))
+        if hip_path is None:
+            return command
+        return command[:match.start(2)] + hip_path + command[match.end(2):]
+
+
+_site_mapping = None
+
+# Paths mapped by map_site_path.  The pre task maps the same hip for every task of a job, and this module stays
+# imported for the life of a worker's sandbox process, so each path is only mapped once.
+_mapped_site_paths = {}
+max_mapped_site_paths = 10000
+
+def get_site_mapping():
+    """
+    Returns the mapping of all site roots to PROD_ROOT, built from the environment on first use.
+    """
+    global _site_mapping
+    if _site_mapping is None:
+        roots = [os.environ.get(var, '') for var in site_root_vars]
+        _site_mapping = root_mapping(roots, os.environ['PROD_ROOT'])
+    return _site_mapping
+
+
+def map_site_path(path):
+    """
+    Returns path mapped to PROD_ROOT by the site mapping, or None if it isn't under a site root.  Results are cached.
+    """
+    if path not in _mapped_site_paths:
+        if len(_mapped_site_paths) >= max_mapped_site_paths:
+            _mapped_site_paths.clear()
+        _mapped_site_paths[path] = get_site_mapping().map_path(path)
+    return _mapped_site_paths[path]
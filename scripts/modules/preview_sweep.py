@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# Resets interactive preview settings before a submission.
+# Switch nodes named "preview*" are useful for interactive session testing only, and revert to input 0 on submission.
+# read_wedges nodes have their preview_live toggle disabled.
+# Nodes are found through the instances of their node types rather than by walking the whole scene, and the
+# matching node types are indexed once per hip file.
+
+import time
+
+import hou
+
+# node types of switches that may be named as preview switches
+preview_switch_type_names = ('switch', 'switchif')
+
+_node_types = {}
+
+
+def node_types(match):
+    """
+    Returns the node types of all categories whose name matches, indexed on first use in each hip file,
+    since loading a hip can install the asset definitions it embeds.
+    """
+    key = (match, hou.hipFile.path())
+    types = _node_types.get(key)
+    if types is None:
+        types = []
+        for category in hou.nodeTypeCategories().values():
+            for type_name, node_type in category.nodeTypes().iteritems():
+                if match(type_name):
+                    types.append(node_type)
+        _node_types[key] = types
+    return types
+
+
+def is_read_wedges(type_name):
+    return type_name.startswith('read_wedges')
+
+
+def is_preview_switch_type(type_name):
+    return type_name in preview_switch_type_names
+
+
+def instances(match):
+    for node_type in node_types(match):
+        for node in node_type.instances():
+            yield node
+
+
+def set_parm(parm, value, changes):
+    """
+    Sets a parm if it differs from value, and records the change.
+    """
+    current = parm.eval()
+    if current != value:
+        parm.set(value)
+        changes.append((parm.path(), current, value))
+
+
+def disable_previews():
+    """
+    Sets preview switches to input 0 and disables preview_live on read_wedges nodes.
+    Returns the changes made as a list of (parm path, old value, new value).
+    """
+    start = time.time()
+    changes = []
+    for node in instances(is_preview_switch_type):
+        if node.name().startswith('preview'):
+            parm = node.parm('input')
+            if parm is not None:
+                set_parm(parm, 0, changes)
+    for node in instances(is_read_wedges):
+        try:
+            parm = node.parm('preview_live')
+            if parm:
+                set_parm(parm, 0, changes)
+        except hou.Error:
+            print "didn't disable preview switch", node.path()
+
+    for parm_path, old, new in changes:
+        print 'disable preview', parm_path, old, '->', new
+    print 'disabled {} previews in {:.3f}s'.format(len(changes), time.time() - start)
+    return changes
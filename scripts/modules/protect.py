@@ -0,0 +1,446 @@
+#!/usr/bin/python
+
+# Protection of work item result directories from cache cleanup.
+# A protected directory holds a .protect marker file, and is recorded in the protect index below.  Directory sizes are reported as each directory
+# is protected, and are cached per directory keyed by its mtime, so protecting the same tree again
+# only needs a stat of each directory.
+
+import os
+import re
+import json
+import stat
+import time
+import shutil
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+protect_file_name = '.protect'
+manifest_suffix = '.protect.json'
+
+default_size_cache_path = os.path.expanduser('~/.firehawk/protect_size_cache.json')
+# Size cache entries not used for this many seconds are dropped when the cache is saved, and at most this many are kept.
+size_cache_max_age = 30 * 24 * 60 * 60
+size_cache_max_entries = 200000
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['','Ki','Mi','Gi','Ti','Pi','Ei','Zi']:
+        if abs(num) < 1024.0:
+            return "%3.1f%s%s" % (num, unit, suffix)
+        num /= 1024.0
+    return "%.1f%s%s" % (num, 'Yi', suffix)
+
+
+def touch(path):
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def scan_directory(path):
+    """
+    Returns the total bytes of the files directly in path, and the paths of its subdirectories.
+    Symbolic links are skipped.
+    """
+    files_bytes = 0
+    subdirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_symlink():
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                files_bytes += entry.stat().st_size
+    else:
+        for name in os.listdir(path):
+            entry_path = os.path.join(path, name)
+            st = os.lstat(entry_path)
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append(entry_path)
+            elif stat.S_ISREG(st.st_mode):
+                files_bytes += st.st_size
+    return files_bytes, subdirs
+
+
+class size_cache():
+    def __init__(self, path=default_size_cache_path):
+        """
+        The sizes of directories, by path, as [mtime, bytes of the files in the directory, subdirectories, last used].
+        A directory's mtime changes when entries are added to or removed from it, so the entry is
+        rescanned then.  Subdirectories are sized through their own entries.
+        The entry of a directory that no longer exists is dropped when it is next sized, and entries that
+        haven't been used for max_age seconds are dropped when the cache is saved.
+        """
+        self.path = path
+        self.max_age = size_cache_max_age
+        self.max_entries = size_cache_max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = False
+        self.now = int(time.time())
+        try:
+            with open(self.path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+        except (IOError, ValueError):
+            pass
+
+    def directory_size(self, path):
+        """
+        Returns the total bytes of the files under path.
+        """
+        total = 0
+        pending = [path]
+        while pending:
+            dir_path = pending.pop()
+            try:
+                mtime = os.stat(dir_path).st_mtime
+            except OSError:
+                with self.lock:
+                    if self.entries.pop(dir_path, None) is not None:
+                        self.changed = True
+                continue
+            with self.lock:
+                entry = self.entries.get(dir_path)
+            if entry is None or entry[0] != mtime:
+                try:
+                    files_bytes, subdirs = scan_directory(dir_path)
+                except OSError:
+                    continue
+                entry = [mtime, files_bytes, subdirs, self.now]
+                with self.lock:
+                    self.entries[dir_path] = entry
+                    self.changed = True
+            elif len(entry) < 4 or self.now - entry[3] > 24 * 60 * 60:
+                # the last use is only updated daily, so sizing an unchanged tree doesn't rewrite the cache
+                with self.lock:
+                    self.entries[dir_path] = entry = entry[:3] + [self.now]
+                    self.changed = True
+            total += entry[1]
+            pending.extend(entry[2])
+        return total
+
+    def prune(self):
+        """
+        Drops the entries not used within max_age, then the least recently used beyond max_entries.
+        """
+        with self.lock:
+            cutoff = self.now - self.max_age
+            last_used = lambda item: item[1][3] if len(item[1]) > 3 else 0
+            entries = [item for item in self.entries.iteritems() if last_used(item) >= cutoff]
+            if len(entries) > self.max_entries:
+                entries.sort(key=last_used, reverse=True)
+                del entries[self.max_entries:]
+            if len(entries) < len(self.entries):
+                self.entries = dict(entries)
+                self.changed = True
+
+    def save(self):
+        self.prune()
+        if not self.changed:
+            return
+        with self.lock:
+            entries = dict(self.entries)
+            self.changed = False
+        try:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            print "unable to save protect size cache", self.path, e
+
+
+def protect_directories(directories, threads=8, cache=None):
+    """
+    Adds a .protect file to each directory, and sizes them concurrently.
+    Returns a list of (directory, bytes, protected) in the order of directories, without duplicates.
+    Directories that don't exist (eg. expected results not cooked yet) can't be protected.
+    """
+    unique = []
+    seen = set()
+    for directory in directories:
+        if directory and directory not in seen:
+            seen.add(directory)
+            unique.append(directory)
+    if cache is None:
+        cache = size_cache()
+
+    def protect_directory(directory):
+        if not os.path.isdir(directory):
+            return directory, 0, False
+        touch(os.path.join(directory, protect_file_name))
+        return directory, cache.directory_size(directory), True
+
+    pool = ThreadPool(max(1, min(threads, len(unique))))
+    try:
+        protected = pool.map(protect_directory, unique)
+    finally:
+        pool.close()
+        pool.join()
+    cache.save()
+    return protected
+
+
+def write_manifest(path, protected, **info):
+    """
+    Writes a json manifest of protected directories and their bytes, with any extra info given.
+    """
+    manifest = dict(info)
+    manifest['total_bytes'] = sum(size for directory, size, is_protected in protected)
+    manifest['directories'] = [{'path': directory, 'bytes': size, 'protected': is_protected}
+                               for directory, size, is_protected in protected]
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return manifest
+
+
+# Index of protected directories.
+# Protection is recorded in a SQLite database, so cleanup can query what is and isn't protected instead of
+# crawling the production tree for .protect files.  Alongside each protected result directory, the version
+# directories next to its own version (eg. v001, v002 beside v003) are registered, protected or not, so
+# unprotected versions can be found for cleanup.  The index only nominates candidates; cleanup checks each on disk
+# before removing it.
+# The manifests written next to each hip (<hip>.protect.json) remain the record of what was protected.  An index
+# that is missing is rebuilt from the manifests under the cleanup root.
+
+version_dir_re = re.compile(r'^v[0-9]+$')
+
+
+def default_index_path():
+    """
+    Returns the path of the protect index from $FIREHAWK_PROTECT_INDEX.  The index must be in one persistent
+    location that every user and host that protects or cleans up uses, so there is no per user or temp default.
+    SQLite's locking isn't reliable on NFS, so it shouldn't be on a shared mount with many concurrent writers.
+    """
+    path = os.environ.get('FIREHAWK_PROTECT_INDEX')
+    if not path:
+        raise RuntimeError('FIREHAWK_PROTECT_INDEX is not set, it must point at the shared protect index, eg. /prod/.firehawk/protect_index.db')
+    return path
+
+
+def version_directory(path):
+    """
+    Returns the deepest version directory (named like v003) containing or equal to path, or None.
+    """
+    parts = path.rstrip('/').split('/')
+    for i in range(len(parts) - 1, 0, -1):
+        if version_dir_re.match(parts[i]):
+            return '/'.join(parts[:i + 1])
+    return None
+
+
+def path_prefix_range(root):
+    """
+    Returns the bounds of paths under root, for an indexed range query.
+    """
+    root = root.rstrip('/') + '/'
+    return root, root[:-1] + '0'
+
+
+class protect_index():
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        # a new index has none of the protection recorded by the manifests, see rebuild
+        self.created = not os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            protected INTEGER NOT NULL DEFAULT 0,
+            hip TEXT,
+            node TEXT,
+            work_item TEXT,
+            bytes INTEGER,
+            mtime REAL,
+            protected_time REAL,
+            updated REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS dirs_kind_protected ON dirs (kind, protected, path)")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def record_protected(self, protected, hip=None, node=None, work_items=None):
+        """
+        Records the result of protect_directories.  work_items optionally maps each directory to the name
+        of a work item that wrote it.  The version directory of each protected directory is recorded as
+        protected, and its sibling versions are registered as unprotected unless already protected.
+        """
+        now = time.time()
+        work_items = work_items or {}
+        version_parents = set()
+        with self.db:
+            for directory, size, is_protected in protected:
+                if not is_protected:
+                    continue
+                self.db.execute("""INSERT OR REPLACE INTO dirs
+                    (path, kind, protected, hip, node, work_item, bytes, mtime, protected_time, updated)
+                    VALUES (?, 'result', 1, ?, ?, ?, ?, ?, ?, ?)""",
+                    (directory, hip, node, work_items.get(directory), size, _mtime(directory), now, now))
+                version_dir = version_directory(directory)
+                if version_dir is None:
+                    continue
+                self.db.execute("""INSERT OR REPLACE INTO dirs
+                    (path, kind, protected, hip, node, work_item, bytes, mtime, protected_time, updated)
+                    VALUES (?, 'version', 1, ?, ?, NULL, NULL, ?, ?, ?)""",
+                    (version_dir, hip, node, _mtime(version_dir), now, now))
+                version_parents.add(os.path.dirname(version_dir))
+
+            for parent in version_parents:
+                try:
+                    names = os.listdir(parent)
+                except OSError:
+                    continue
+                for name in names:
+                    sibling = os.path.join(parent, name)
+                    if not version_dir_re.match(name) or not os.path.isdir(sibling):
+                        continue
+                    self.db.execute("INSERT OR IGNORE INTO dirs (path, kind, protected, updated) VALUES (?, 'version', 0, ?)",
+                        (sibling, now))
+                    self.db.execute("UPDATE dirs SET mtime = ? WHERE path = ?", (_mtime(sibling), sibling))
+
+    def rebuild(self, root):
+        """
+        Records the protected directories of every manifest found under root, and returns the manifest paths.
+        """
+        manifests = []
+        for dir_path, dir_names, file_names in os.walk(root):
+            for name in file_names:
+                if not name.endswith(manifest_suffix):
+                    continue
+                manifest_path = os.path.join(dir_path, name)
+                try:
+                    with open(manifest_path, 'r') as manifest_file:
+                        manifest = json.load(manifest_file)
+                    protected = [(entry['path'], entry.get('bytes'), entry.get('protected', False))
+                                 for entry in manifest.get('directories', [])]
+                except (IOError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    print "unable to read protect manifest", manifest_path, e
+                    continue
+                self.record_protected(protected, hip=manifest.get('hip'), node=manifest.get('node'))
+                manifests.append(manifest_path)
+        self.created = False
+        return manifests
+
+    def protected_under(self, root):
+        """
+        Returns the protected directories under root.
+        """
+        low, high = path_prefix_range(root)
+        return [row[0] for row in self.db.execute(
+            "SELECT path FROM dirs WHERE kind = 'result' AND protected = 1 AND path >= ? AND path < ? ORDER BY path",
+            (low, high))]
+
+    def unprotected_versions(self, root, older_than_days=0):
+        """
+        Returns the unprotected version directories under root last modified more than older_than_days ago.
+        """
+        low, high = path_prefix_range(root)
+        cutoff = time.time() - older_than_days * 86400
+        return [row[0] for row in self.db.execute(
+            """SELECT path FROM dirs WHERE kind = 'version' AND protected = 0 AND path >= ? AND path < ?
+               AND mtime IS NOT NULL AND mtime < ? ORDER BY path""",
+            (low, high, cutoff))]
+
+    def cleanup_unprotected_versions(self, root, older_than_days, dry_run=True):
+        """
+        Removes the unprotected version directories under root older than older_than_days, and returns them.
+        The index only selects candidates.  Each is walked again before removal, and kept if it has a .protect
+        file at any depth, a protected result in the index, or anything modified since the cutoff, eg. a re-cook
+        since it was indexed.  With dry_run, the directories are only returned.
+        """
+        if self.created:
+            print "protect index", self.path, "is new, rebuilding it from the manifests under", root
+            self.rebuild(root)
+        cutoff = time.time() - older_than_days * 86400
+        removed = []
+        for path in self.unprotected_versions(root, older_than_days):
+            if self.protected_under(path):
+                continue
+            keep, mtime = check_tree(path, cutoff)
+            if keep:
+                if mtime is not None:
+                    # refresh the indexed mtime so the directory isn't a candidate again until it is old enough
+                    with self.db:
+                        self.db.execute("UPDATE dirs SET mtime = ?, updated = ? WHERE path = ?", (mtime, time.time(), path))
+                continue
+            if not dry_run:
+                try:
+                    shutil.rmtree(path)
+                except OSError as e:
+                    print "unable to remove", path, e
+                    continue
+                with self.db:
+                    self.db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+            removed.append(path)
+        return removed
+
+
+def check_tree(path, cutoff):
+    """
+    Walks path, stopping at the first .protect file or entry modified at or after cutoff.
+    Returns (keep, newest mtime seen), keep being True if either was found or path can't be read.
+    """
+    try:
+        newest = os.lstat(path).st_mtime
+    except OSError:
+        return True, None
+    if newest >= cutoff:
+        return True, newest
+    errors = []
+    for dir_path, dir_names, file_names in os.walk(path, onerror=errors.append):
+        if protect_file_name in file_names:
+            return True, None
+        for name in dir_names + file_names:
+            try:
+                mtime = os.lstat(os.path.join(dir_path, name)).st_mtime
+            except OSError:
+                continue
+            newest = max(newest, mtime)
+            if newest >= cutoff:
+                return True, newest
+    if errors:
+        # a directory that can't be read may hold protected data
+        print "unable to check", path, errors[0]
+        return True, None
+    return False, newest
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    # eg. python protect.py $SHOTPATH 30 --delete
+    import argparse
+    parser = argparse.ArgumentParser(description='Remove unprotected version directories found in the protect index.')
+    parser.add_argument('root', help='directory to clean up, eg. $SHOTPATH')
+    parser.add_argument('days', type=float, help='only versions last modified more than this many days ago')
+    parser.add_argument('--index', default=None, help='protect index path, defaults to $FIREHAWK_PROTECT_INDEX')
+    parser.add_argument('--delete', action='store_true', help='remove the directories, otherwise they are only listed')
+    parser.add_argument('--rebuild', action='store_true', help='record the protect manifests under root in the index first')
+    args = parser.parse_args()
+
+    index = protect_index(args.index)
+    if args.rebuild:
+        for manifest_path in index.rebuild(os.path.abspath(args.root)):
+            print 'indexed', manifest_path
+    for path in index.cleanup_unprotected_versions(os.path.abspath(args.root), args.days, dry_run=not args.delete):
+        print ('removed' if args.delete else 'unprotected'), path
+    index.close()
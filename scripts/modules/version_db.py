@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+# Version database of a ROP's wedges, mapping each index_key to its version.
+# The map is stored as json in the node's 'verdb' user data, and parsed once into the node's cached user data,
+# so looking up or inserting a version is a dict operation.  Changes are written back to the user data once per
+# batch of changes, deferred to the event loop in a UI session.
+# The versiondb0 multiparm only displays the map, and is synced from it lazily in the same way.  Versions edited
+# by hand on the multiparm are written back to the map by the node's parm callback.
+# Nodes versioned before the map existed kept 'verdb_<index_key>' user data holding the multiparm instance of each
+# key.  Their multiparm is read into the map on first use.
+
+import re
+import json
+
+import hou
+
+store_name = 'verdb'
+revision_name = 'verdbrev'
+cache_name = 'verdbcache'
+syncing_name = 'verdbsyncing'
+legacy_prefix = 'verdb_'
+
+# Expression of the version_int parm, to look up the version of the node's index_key in the map.
+# It must not depend on this module, so it can be evaluated wherever the hip is loaded.
+version_expression = \
+"""
+# This allows versioning to be inherited by the version db
+import hou
+import json
+
+node = hou.pwd()
+index_key = node.parm('index_key_template').eval()
+
+revision = node.userData('verdbrev')
+cached = node.cachedUserData('verdbcache')
+if cached is None or cached['revision'] != revision:
+    raw = node.userData('verdb')
+    cached = {'revision': revision, 'versions': json.loads(raw) if raw else {}, 'dirty': False, 'keys': None}
+    node.setCachedUserData('verdbcache', cached)
+
+return int(cached['versions'].get(index_key, 0))
+"""
+
+
+def sorted_nicely(l):
+    """
+    Sorts strings with embedded numbers in natural order, eg. wedge2 before wedge10.
+    """
+    convert = lambda text: int(text) if text.isdigit() else text
+    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
+    return sorted(l, key=alphanum_key)
+
+
+def multiparm_versions(node):
+    """
+    Returns the versions displayed on the node's versiondb0 multiparm, by index_key.
+    """
+    versions = {}
+    parm = node.parm('versiondb0')
+    if parm is None:
+        return versions
+    for index_int in range(1, int(parm.eval()) + 1):
+        index_key = node.parm('index_key' + str(index_int)).eval()
+        if index_key:
+            versions[index_key] = int(node.parm('version' + str(index_int)).eval())
+    return versions
+
+
+def legacy_keys(node):
+    return [name for name in node.userDataDict() if name.startswith(legacy_prefix)]
+
+
+class version_db():
+    def __init__(self, node):
+        self.node = node
+
+    def cache(self):
+        """
+        Returns the node's cached map, parsed again if the user data has changed since, eg. by an undo or hip load.
+        """
+        node = self.node
+        revision = node.userData(revision_name)
+        cached = node.cachedUserData(cache_name)
+        if cached is not None and cached['revision'] == revision:
+            return cached
+
+        raw = node.userData(store_name)
+        versions = None
+        if raw:
+            try:
+                versions = json.loads(raw)
+            except ValueError:
+                print "version db of", node.path(), "is not valid json, it will be read from the multiparm"
+        if versions is None:
+            versions = multiparm_versions(node)
+        cached = {'revision': revision, 'versions': versions, 'dirty': False, 'keys': None}
+        node.setCachedUserData(cache_name, cached)
+        if raw is None and node.parm('versiondb0') is not None:
+            self.migrate(cached)
+        return cached
+
+    def versions(self):
+        """
+        Returns the dict of versions by index_key.  It is shared by all version_db instances of the node,
+        so must only be changed through set_version and remove.
+        """
+        return self.cache()['versions']
+
+    def version(self, index_key, default=None):
+        return self.versions().get(index_key, default)
+
+    def set_version(self, index_key, version, save=True):
+        """
+        Sets the version of index_key.  Returns True if it changed, in which case the change is saved
+        and displayed on the multiparm later, or on save().  To set many versions, pass save=False
+        and call changed() after the last.
+        """
+        cached = self.cache()
+        version = int(version)
+        if cached['versions'].get(index_key) == version:
+            return False
+        cached['versions'][index_key] = version
+        if save:
+            self.changed()
+        else:
+            cached['dirty'] = True
+        return True
+
+    def remove(self, index_key, save=True):
+        """
+        Removes index_key from the map.  As with set_version, pass save=False to remove many and call changed() after the last.
+        """
+        cached = self.cache()
+        if index_key not in cached['versions']:
+            return False
+        del cached['versions'][index_key]
+        if save:
+            self.changed()
+        else:
+            cached['dirty'] = True
+        return True
+
+    def changed(self):
+        """
+        Marks the map as changed, and schedules it to be saved and displayed.  Without a UI
+        there is no event loop to defer to, so it is saved now, and the multiparm is left to sync in a UI session.
+        """
+        cached = self.cache()
+        cached['dirty'] = True
+        if cached.get('pending'):
+            return
+        cached['pending'] = True
+        if hou.isUIAvailable():
+            import hdefereval
+            hdefereval.executeDeferred(self.save)
+        else:
+            self.save(sync=False)
+
+    def save(self, sync=True):
+        """
+        Writes the map to the node's user data if it changed, and syncs the multiparm to it.
+        """
+        cached = self.node.cachedUserData(cache_name)
+        if cached is None:
+            return
+        cached['pending'] = False
+        if not cached['dirty']:
+            return
+        try:
+            self.node.path()
+        except hou.ObjectWasDeleted:
+            return
+        revision = str(int(cached['revision'] or 0) + 1)
+        with hou.undos.disabler():
+            self.node.setUserData(store_name, json.dumps(cached['versions'], sort_keys=True))
+            self.node.setUserData(revision_name, revision)
+        cached['revision'] = revision
+        cached['dirty'] = False
+        if sync:
+            self.sync_multiparm()
+
+    def migrate(self, cached):
+        """
+        Replaces the user data of the old store with the map, and the node's version expression with one reading the map.
+        """
+        print "migrating version db of", self.node.path()
+        with hou.undos.disabler():
+            for name in legacy_keys(self.node):
+                self.node.destroyUserData(name)
+            set_version_expression(self.node)
+        cached['dirty'] = True
+        self.save(sync=False)
+
+    def sync_multiparm(self):
+        """
+        Makes the versiondb0 multiparm display the map in natural order of index_key.
+        Only instances that differ are set.
+        """
+        node = self.node
+        parm = node.parm('versiondb0')
+        if parm is None:
+            return
+        cached = self.cache()
+        keys = sorted_nicely(cached['versions'].keys())
+        node.setCachedUserData(syncing_name, True)
+        try:
+            with hou.undos.disabler():
+                if int(parm.eval()) != len(keys):
+                    parm.set(len(keys))
+                for index_int, index_key in enumerate(keys, 1):
+                    key_parm = node.parm('index_key' + str(index_int))
+                    if key_parm.eval() != index_key:
+                        key_parm.set(index_key)
+                    version_parm = node.parm('version' + str(index_int))
+                    if version_parm.eval() != cached['versions'][index_key]:
+                        version_parm.set(cached['versions'][index_key])
+        finally:
+            node.destroyCachedUserData(syncing_name)
+        cached['keys'] = keys
+
+    def syncing(self):
+        """
+        Returns True while the multiparm is being synced, so the parm callback can ignore the changes.
+        """
+        return bool(self.node.cachedUserData(syncing_name))
+
+    def update_from_multiparm(self, index_int, save=True):
+        """
+        Writes a multiparm instance edited by hand back to the map.  If its index_key was renamed,
+        the version moves to the new key.  With save=False the change is left for changed() to save.
+        """
+        node = self.node
+        cached = self.cache()
+        index_int = int(index_int)
+        index_key_parm = node.parm('index_key' + str(index_int))
+        if index_key_parm is None:
+            return
+        index_key = index_key_parm.eval()
+        version = int(node.parm('version' + str(index_int)).eval())
+        keys = cached['keys']
+        if keys is not None and index_int <= len(keys) and keys[index_int - 1] != index_key:
+            self.remove(keys[index_int - 1], save=save)
+            keys[index_int - 1] = index_key
+        if index_key:
+            self.set_version(index_key, version, save=save)
+
+    def mark_dirty(self, index_int=None):
+        """
+        Records a multiparm instance edited by hand, or with no index_int, that instances may have been inserted
+        or removed, and schedules the recorded changes to be reconciled.  Changes made together are reconciled once.
+        """
+        cached = self.cache()
+        if index_int is None:
+            cached['instances_changed'] = True
+        else:
+            cached.setdefault('dirty_indices', set()).add(int(index_int))
+        if cached.get('reconcile_pending'):
+            return
+        cached['reconcile_pending'] = True
+        if hou.isUIAvailable():
+            import hdefereval
+            hdefereval.executeDeferred(self.reconcile_dirty)
+        else:
+            self.reconcile_dirty()
+
+    def reconcile_dirty(self):
+        """
+        Writes the multiparm instances recorded by mark_dirty back to the map, and saves it once.
+        """
+        try:
+            self.node.path()
+        except hou.ObjectWasDeleted:
+            return
+        cached = self.cache()
+        cached['reconcile_pending'] = False
+        dirty_indices = cached.pop('dirty_indices', set())
+        if cached.pop('instances_changed', False) and cached['keys'] is not None:
+            self.reconcile_instances()
+        for index_int in sorted(dirty_indices):
+            self.update_from_multiparm(index_int, save=False)
+        if cached['dirty']:
+            self.changed()
+
+    def reconcile_instances(self):
+        """
+        Finds the instances inserted or removed since the multiparm was last synced, by matching the keys it
+        displayed then from the start and end of the multiparm, and reconciles the instances in between.
+        The changes are left for the caller to save.
+        """
+        node = self.node
+        cached = self.cache()
+        keys = cached['keys']
+        count = int(node.parm('versiondb0').eval())
+        key_at = lambda index_int: node.parm('index_key' + str(index_int)).eval()
+
+        start = 0
+        while start < min(len(keys), count) and key_at(start + 1) == keys[start]:
+            start += 1
+        end_old = len(keys)
+        end_new = count
+        while end_old > start and end_new > start and key_at(end_new) == keys[end_old - 1]:
+            end_old -= 1
+            end_new -= 1
+
+        new_keys = [key_at(index_int) for index_int in range(start + 1, end_new + 1)]
+        for index_key in keys[start:end_old]:
+            if index_key not in new_keys:
+                self.remove(index_key, save=False)
+        for index_int, index_key in enumerate(new_keys, start + 1):
+            if index_key:
+                self.set_version(index_key, node.parm('version' + str(index_int)).eval(), save=False)
+        cached['keys'] = keys[:start] + new_keys + keys[end_old:]
+
+    def reconcile_multiparm(self):
+        """
+        Makes the map match the whole multiparm.  Keys the multiparm
+        displayed when it was last synced that are no longer on it are removed, and keys added since are kept.
+        Until the multiparm has been synced in this session it may be stale, eg. if versions were set without
+        a UI, so the map is left as it is.  The map is saved once after all the changes, since without a UI
+        each save writes it now, so saving every change would rewrite the whole map per key.
+        """
+        cached = self.cache()
+        if cached['keys'] is None:
+            return
+        displayed = multiparm_versions(self.node)
+        for index_key, version in displayed.iteritems():
+            self.set_version(index_key, version, save=False)
+        for index_key in cached['keys']:
+            if index_key not in displayed:
+                self.remove(index_key, save=False)
+        cached['keys'] = sorted_nicely(displayed.keys())
+        if cached['dirty']:
+            self.changed()
+
+
+def set_version_expression(node):
+    """
+    Sets the expression of the node's version_int parm to look up its version in the map.
+    """
+    parm = node.parm('version_int')
+    if parm is None:
+        return
+    keyframe = hou.Keyframe()
+    keyframe.setTime(0)
+    keyframe.setExpression(version_expression, hou.exprLanguage.Python)
+    parm.setKeyframe(keyframe)
@@ -12,8 +12,400 @@ home_site_packages = os.path.expanduser('~/.local/lib/python2.7/site-packages')
 sys.path.append(home_site_packages)
 sys.path.append('/usr/lib/python2.7/site-packages')
 
-from awscli.clidriver import create_clidriver
+import glob
+import json
+import time
+import fnmatch
+import sqlite3
+import getpass
+import tempfile
+import calendar
+import threading
+from multiprocessing.pool import ThreadPool
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# Transfers run on a thread pool and s3 client shared by the process.  Each directory's prefix is listed once per
+# batch, and only files that differ are transferred, by the same rule as aws s3 sync: a file is transferred if the
+# destination is missing, its size differs, or the source is newer.  Keys are the path without the leading
+# separator, as aws s3 sync from the bucket root writes them.
+
+max_threads = 16
+
+transfer_config = TransferConfig(
+  multipart_threshold=64 * 1024 * 1024,
+  multipart_chunksize=16 * 1024 * 1024,
+  max_concurrency=8,
+  use_threads=True)
+
+_client = None
+_pool = None
+_shared_lock = threading.Lock()
+
+def get_client():
+  """
+  Returns the s3 client shared by all transfers.  boto3 clients are thread safe.
+  """
+  global _client
+  with _shared_lock:
+    if _client is None:
+      _client = boto3.client('s3', config=Config(max_pool_connections=max_threads * transfer_config.max_concurrency))
+  return _client
+
+def get_pool():
+  global _pool
+  with _shared_lock:
+    if _pool is None:
+      _pool = ThreadPool(max_threads)
+  return _pool
+
+def s3_key(path):
+  return path.lstrip('/')
+
+def has_magic(name):
+  return any(c in name for c in '*?[')
+
+def timestamp(datetime):
+  return calendar.timegm(datetime.utctimetuple())
+
+# Sync state cache.  After each transfer the size, mtime, etag and direction of the file are recorded, and the
+# listing of each prefix is kept with the time it was listed.  A file whose local stat matches its record from
+# within the ttl is skipped without any network calls, and a prefix listed within the ttl isn't listed again.
+# Local changes invalidate a file's record through its stat.  Remote changes are found when records expire, by
+# size and mtime, or by the etag differing from the recorded one, which also finds rewrites of the same size.
+# A cached listing only proves an object exists, since others may upload to the prefix at any time, so pulls of a
+# glob, or of a name missing from the cached listing, always list the prefix again.
+# The cache is at $FIREHAWK_S3_SYNC_STATE, or disabled if that is set to 0.  The default is on local disk, since
+# SQLite's locking isn't reliable on NFS, where home directories of render nodes often are.
+# The ttl in seconds is $FIREHAWK_S3_SYNC_TTL, default 600.
+
+default_state_path = os.path.join(tempfile.gettempdir(), 'firehawk-{}'.format(getpass.getuser()), 's3_sync_state.db')
+
+class sync_state():
+  def __init__(self, path=default_state_path, ttl=600):
+    self.path = path
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    if not os.path.isdir(os.path.dirname(self.path)):
+      os.makedirs(os.path.dirname(self.path))
+    # connections are shared by the threads of a process, so access is serialised by the lock
+    self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+    with self.lock, self.db:
+      self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+        bucket TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER,
+        mtime INTEGER,
+        etag TEXT,
+        direction TEXT,
+        synced REAL,
+        PRIMARY KEY (bucket, path))""")
+      self.db.execute("""CREATE TABLE IF NOT EXISTS listings (
+        bucket TEXT NOT NULL,
+        prefix TEXT NOT NULL,
+        objects TEXT,
+        listed REAL,
+        PRIMARY KEY (bucket, prefix))""")
+
+  def fresh(self, synced):
+    return synced is not None and time.time() - synced < self.ttl
+
+  def unchanged(self, bucket, path, st):
+    """
+    Returns True if path was synced within the ttl, and its local stat is as it was then.
+    """
+    with self.lock:
+      row = self.db.execute("SELECT size, mtime, synced FROM files WHERE bucket = ? AND path = ?", (bucket, path)).fetchone()
+    return row is not None and row[0] == st.st_size and row[1] == int(st.st_mtime) and self.fresh(row[2])
+
+  def synced_etag(self, bucket, path, st):
+    """
+    Returns the etag recorded when path was last synced, at any age, if its local stat is as it was then, or None.
+    """
+    with self.lock:
+      row = self.db.execute("SELECT size, mtime, etag FROM files WHERE bucket = ? AND path = ?", (bucket, path)).fetchone()
+    if row is None or row[0] != st.st_size or row[1] != int(st.st_mtime):
+      return None
+    return row[2]
+
+  def record(self, bucket, entries):
+    """
+    Records files after they were synced, from a list of (path, size, mtime, etag, direction).
+    """
+    now = time.time()
+    with self.lock, self.db:
+      self.db.executemany("INSERT OR REPLACE INTO files (bucket, path, size, mtime, etag, direction, synced) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(bucket, path, size, mtime, etag, direction, now) for path, size, mtime, etag, direction in entries])
+
+  def listing(self, bucket, prefix):
+    """
+    Returns the objects of a prefix listed within the ttl, or None.
+    """
+    with self.lock:
+      row = self.db.execute("SELECT objects, listed FROM listings WHERE bucket = ? AND prefix = ?", (bucket, prefix)).fetchone()
+    if row is None or not self.fresh(row[1]):
+      return None
+    return dict((name, tuple(value)) for name, value in json.loads(row[0]).iteritems())
+
+  def set_listing(self, bucket, prefix, objects, listed=None):
+    with self.lock, self.db:
+      if listed is None:
+        self.db.execute("INSERT OR REPLACE INTO listings (bucket, prefix, objects, listed) VALUES (?, ?, ?, ?)",
+          (bucket, prefix, json.dumps(objects), time.time()))
+      else:
+        # keep the time the prefix was listed, so changes made by others are still found when it expires
+        self.db.execute("UPDATE listings SET objects = ? WHERE bucket = ? AND prefix = ?", (json.dumps(objects), bucket, prefix))
+
+_state = None
+
+def get_state():
+  """
+  Returns the sync state cache shared by the process, or None if it is disabled.
+  """
+  global _state
+  path = os.environ.get('FIREHAWK_S3_SYNC_STATE', default_state_path)
+  if path in ('', '0'):
+    return None
+  with _shared_lock:
+    if _state is None or _state.path != path:
+      _state = sync_state(path, ttl=float(os.environ.get('FIREHAWK_S3_SYNC_TTL', 600)))
+  return _state
+
+class syncbatch():
+  def __init__(self, paths=[], bucketname='', state=None):
+    """
+    Syncs a batch of paths or globs (eg. /prod/shot/cache/v001/sphere.*.bgeo.sc) with the bucket.
+    state is the sync state cache, by default the process's if it is enabled.
+    """
+    self.paths = list(paths)
+    self.bucketname = bucketname
+    self.state = state if state is not None else get_state()
+
+    self.force = False
+    self.quiet = False
+    self.ignore_errors = False
+
+    self.listings = {}
+    self.listed = set()
+    self.uploaded = {}
+    self.transferred = []
+    self.skipped = []
+    self.errors = []
+
+  def directories(self):
+    """
+    Returns the file names or patterns of the paths, grouped by directory.
+    """
+    directories = {}
+    for path in self.paths:
+      dirname, filename = os.path.split(path)
+      directories.setdefault(dirname, []).append(filename)
+    return directories
+
+  def remote_files(self, dirname, fresh=False):
+    """
+    Returns (size, mtime, etag) of the objects directly in a directory by file name, listing its prefix once,
+    or not at all if the sync state has a listing from within the ttl.  With fresh, the prefix is listed
+    unless it already was by this batch.
+    """
+    fresh = fresh and dirname not in self.listed
+    if fresh or dirname not in self.listings:
+      prefix = s3_key(dirname).rstrip('/') + '/'
+      objects = None
+      if self.state is not None and not fresh:
+        objects = self.state.listing(self.bucketname, prefix)
+      if objects is None:
+        objects = {}
+        paginator = get_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucketname, Prefix=prefix, Delimiter='/'):
+          for obj in page.get('Contents', []):
+            objects[obj['Key'][len(prefix):]] = (obj['Size'], timestamp(obj['LastModified']), obj['ETag'].strip('"'))
+        self.listed.add(dirname)
+        if self.state is not None:
+          self.state.set_listing(self.bucketname, prefix, objects)
+      self.listings[dirname] = objects
+    return self.listings[dirname]
+
+  def remote_changed(self, path, st, current):
+    """
+    Returns True if the object's etag differs from the one recorded when the unchanged local file was last
+    synced, so the object was rewritten since, even if its size and mtime still look in sync.
+    """
+    if self.state is None or current[2] is None:
+      return False
+    etag = self.state.synced_etag(self.bucketname, path, st)
+    return etag is not None and etag != current[2]
+
+  def push(self):
+    """
+    Uploads the local files of the batch that differ from the bucket.
+    """
+    uploads = []
+    stats = {}
+    in_sync = []
+    for dirname, names in self.directories().iteritems():
+      remote = None
+      for name in names:
+        if has_magic(name):
+          paths = [path for path in glob.glob(os.path.join(dirname, name)) if os.path.isfile(path)]
+        else:
+          paths = [os.path.join(dirname, name)]
+        for path in paths:
+          if path in stats:
+            continue
+          try:
+            st = os.stat(path)
+          except OSError:
+            # as with aws s3 sync, a missing source isn't an error
+            print 'no local file to upload', path
+            continue
+          stats[path] = st
+          if not self.force:
+            if self.state is not None and self.state.unchanged(self.bucketname, path, st):
+              self.skipped.append(path)
+              continue
+            if remote is None:
+              remote = self.remote_files(dirname)
+            current = remote.get(os.path.basename(path))
+            if (current is not None and current[0] == st.st_size and int(st.st_mtime) <= current[1] and
+                not self.remote_changed(path, st, current)):
+              self.skipped.append(path)
+              in_sync.append((path, st.st_size, int(st.st_mtime), current[2], 'push'))
+              continue
+          uploads.append(path)
+    transferred = self.run(self.upload, uploads)
+    if self.state is not None:
+      self.state.record(self.bucketname, in_sync +
+        [(path, stats[path].st_size, int(stats[path].st_mtime), self.uploaded[path][2], 'push') for path in transferred])
+      self.update_listings([(path,) + self.uploaded[path] for path in transferred])
+
+  def pull(self):
+    """
+    Downloads the files of the batch in the bucket that differ from the local files.
+    """
+    downloads = []
+    seen = set()
+    in_sync = []
+    for dirname, names in self.directories().iteritems():
+      for name in names:
+        path = os.path.join(dirname, name)
+        if not has_magic(name):
+          if path in seen:
+            continue
+          if self.force:
+            seen.add(path)
+            downloads.append((path, None))
+            continue
+          if self.state is not None:
+            try:
+              if self.state.unchanged(self.bucketname, path, os.stat(path)):
+                seen.add(path)
+                self.skipped.append(path)
+                continue
+            except OSError:
+              pass
+        # a glob may match objects uploaded since a cached listing, so is always matched against a fresh one
+        remote = self.remote_files(dirname, fresh=has_magic(name))
+        if not has_magic(name) and name not in remote:
+          # missing from a cached listing doesn't mean it doesn't exist now
+          remote = self.remote_files(dirname, fresh=True)
+        if has_magic(name):
+          matches = [(filename, remote[filename]) for filename in remote if fnmatch.fnmatch(filename, name)]
+        elif name in remote:
+          matches = [(name, remote[name])]
+        else:
+          print 'no object to download', path
+          matches = []
+        for filename, current in matches:
+          path = os.path.join(dirname, filename)
+          if path in seen:
+            continue
+          seen.add(path)
+          if not self.force:
+            try:
+              st = os.stat(path)
+              if st.st_size == current[0] and int(st.st_mtime) >= current[1] and not self.remote_changed(path, st, current):
+                self.skipped.append(path)
+                in_sync.append((path, st.st_size, int(st.st_mtime), current[2], 'pull'))
+                continue
+            except OSError:
+              pass
+          downloads.append((path, current[1]))
+    etags = dict((os.path.join(dirname, filename), current[2])
+      for dirname, remote in self.listings.iteritems() for filename, current in remote.iteritems())
+    transferred = self.run(self.download, downloads)
+    if self.state is not None:
+      entries = []
+      for path, mtime in transferred:
+        st = os.stat(path)
+        entries.append((path, st.st_size, int(st.st_mtime), etags.get(path), 'pull'))
+      self.state.record(self.bucketname, in_sync + entries)
+
+  def update_listings(self, objects):
+    """
+    Updates the cached listings of this batch with objects uploaded, as (path, size, mtime, etag).
+    """
+    changed = set()
+    for path, size, mtime, etag in objects:
+      dirname, filename = os.path.split(path)
+      if dirname in self.listings:
+        self.listings[dirname][filename] = (size, mtime, etag)
+        changed.add(dirname)
+    for dirname in changed:
+      prefix = s3_key(dirname).rstrip('/') + '/'
+      self.state.set_listing(self.bucketname, prefix, self.listings[dirname],
+        listed=None if dirname in self.listed else True)
+
+  def upload(self, path):
+    client = get_client()
+    client.upload_file(path, self.bucketname, s3_key(path), Config=transfer_config)
+    # upload_file doesn't return the object, so its etag is read back to record it, and to find rewrites later
+    head = client.head_object(Bucket=self.bucketname, Key=s3_key(path))
+    self.uploaded[path] = (head['ContentLength'], timestamp(head['LastModified']), head['ETag'].strip('"'))
+    return path
+
+  def download(self, item):
+    path, mtime = item
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+      try:
+        os.makedirs(dirname)
+      except OSError:
+        if not os.path.isdir(dirname):
+          raise
+    get_client().download_file(self.bucketname, s3_key(path), path, Config=transfer_config)
+    # as aws s3 sync does, the local mtime is set to the object's so the file isn't seen as changed
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+    return item
+
+  def run(self, transfer, items):
+    """
+    Runs transfer for each item on the shared thread pool, and returns the items transferred.
+    """
+    def safe_transfer(item):
+      try:
+        return transfer(item), None
+      except Exception as e:
+        return item, e
+
+    transferred = []
+    if items:
+      for item, error in get_pool().map(safe_transfer, items):
+        if error is None:
+          transferred.append(item)
+          if not self.quiet:
+            print transfer.__name__, item
+        else:
+          self.errors.append((item, error))
+    self.transferred.extend(transferred)
+    if not self.quiet:
+      print 'transferred {} files, skipped {} unchanged'.format(len(transferred), len(self.skipped))
+    if self.errors and not self.ignore_errors:
+      raise RuntimeError('S3 sync failed for {} files: {}'.format(len(self.errors), self.errors[:10]))
+    return transferred
 
 class syncfile():
   def __init__(self, fullpath='', bucketname=''):
@@ -23,13 +415,6 @@ class syncfile():
     self.filename = os.path.split(self.fullpath)[1]
     
     self.bucketname = bucketname
-    self.bucketdirname = 's3://' + self.bucketname + os.path.split(self.fullpath)[0]
-    
-    self.s3_client = boto3.client('s3')
-    self.s3_resource = boto3.resource('s3')
-    self.s3_client_result = None
-
-    self.s3_args = []
 
     self.force = False
     self.quiet = False
@@ -37,48 +422,21 @@ class syncfile():
     self.pushed = False
     self.pulled = False
 
-  def aws_cli(self, *cmd):
-    self.old_env = dict(os.environ)
-    try:
-
-        # Environment
-        self.env = os.environ.copy()
-        self.env['LC_CTYPE'] = u'en_US.UTF'
-        os.environ.update(self.env)
-
-        # Run awscli in the same process
-        self.exit_code = create_clidriver().main(*cmd)
-
-        # Deal with problems
-        if (self.exit_code > 0) and (not self.ignore_errors) and (self.exit_code != 2):
-            raise RuntimeError('AWS CLI exited with code {}'.format(self.exit_code))
-    finally:
-        os.environ.clear()
-        os.environ.update(self.old_env)
+  def batch(self):
+    batch = syncbatch([self.fullpath], self.bucketname)
+    batch.force = self.force
+    batch.quiet = self.quiet
+    batch.ignore_errors = self.ignore_errors
+    return batch
 
   def local_push(self):
     if self.pushed==False:
       print 'upload', self.fullpath
-      if self.force:
-        self.s3_client_reesult = self.s3_client.upload_file(self.fullpath, self.bucketname, self.fullpath)
-        # upload to s3 with boto is prefereable to the cli.  However the cli proivdes the sync function below which will only transfer if the files don't match which is a better default behaviour.
-      else:
-        self.s3_args = ['s3', 'sync', self.dirname, self.bucketdirname, '--exclude', '*', '--include', self.filename]
-        if self.quiet:
-          self.s3_args.append('--quiet')
-        print 'args', self.s3_args
-        self.cli_operation = self.aws_cli( self.s3_args )
+      self.batch().push()
     self.pushed = True
 
   def local_pull(self):
     if self.pulled==False:
       print 'download', self.fullpath
-      if self.force:
-        self.s3_client_result = self.s3_client.download_file(self.bucketname, self.fullpath, self.fullpath)
-      else:
-        self.s3_args = ['s3', 'sync', self.bucketdirname, self.dirname, '--exclude', '*', '--include', self.filename]
-        if self.quiet:
-          self.s3_args.append('--quiet')
-        print 'args', self.s3_args
-        self.cli_operation = self.aws_cli( self.s3_args )
+      self.batch().pull()
     self.pulled = True
@@ -9,13 +9,13 @@
 import os, sys, argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-f', '--file', type=str, help='file path')
+parser.add_argument('-f', '--file', type=str, action='append', help='file path or glob, may be given more than once to sync a batch')
 parser.add_argument('-d', '--direction', type=str, help='direction: push/pull')
 parser.add_argument('-b', '--bucket', type=str, help='bucket: mys3bucket.example.com')
 parser.add_argument('-p', '--pdg', type=str, help='pdg command: True/False')
 
 _args, other_args = parser.parse_known_args()
-file = _args.file
+files = _args.file or []
 direction = _args.direction
 bucket = _args.bucket
 if _args.pdg:
@@ -26,7 +26,7 @@ else:
     print_log = True
 
 if print_log:
-    print "sync", file
+    print "sync", files
 
 
 import logging
@@ -64,25 +64,21 @@ if direction != 'push' and direction != 'pull':
     super_logger.error('error no push/pull direction selected')
     sys.exit('error no push/pull direction selected')
 
-### import s3_sync and aws cli libraries to push and pull from AWS S3
-    
-from awscli.clidriver import create_clidriver
+### import s3_sync to push and pull from AWS S3
+
 import s3_sync as s3
 
 display_output = True
 
-syncfiles=[]
-syncfiles.append(
-    s3.syncfile(file,bucket)
-    )
-
-for index, syncfile in enumerate(syncfiles):
-  if direction=='push':
-    if display_output: logger.info("push sync file %s %s up" % (syncfile.dirname, syncfile.filename))
-    syncfile.local_push()
-  elif direction=='pull':
-    if display_output: logger.info("pull sync file %s %s down" % (syncfile.dirname, syncfile.filename))
-    syncfile.local_pull()
+# all files are synced as one batch, listing each directory once
+batch = s3.syncbatch(files, bucket)
+
+if direction=='push':
+  if display_output: logger.info("push sync files %s up" % files)
+  batch.push()
+elif direction=='pull':
+  if display_output: logger.info("pull sync files %s down" % files)
+  batch.pull()
 
 #return 'complete'
 
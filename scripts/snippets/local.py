@@ -16,6 +16,7 @@
 #               commands in asynchronously. The commands run in seperate
 #               processes, up to some specified maximum process count.
 
+import errno
 import json
 import logging
 import os
@@ -31,6 +32,12 @@ from collections import namedtuple
 from distutils.spawn import find_executable
 from multiprocessing import cpu_count
 
+try:
+    import fcntl
+except ImportError:
+    # hython worker pools aren't used on windows
+    fcntl = None
+
 from pdg import createHarsServer, createProcessJob, scheduleResult
 from pdg.job.callbackserver import CallbackServerMixin
 from pdg.scheduler import PyScheduler, convertEnvMapToUTF8
@@ -42,10 +49,30 @@ import hou
 menu_path = os.environ['FIREHAWK_HOUDINI_TOOLS'] + '/scripts/modules'
 sys.path.append(menu_path)
 import firehawk_submit as firehawk_submit
+import frame_batching
 ###
 
-RunItem = namedtuple('RunItem', 'item_name process output_file single hars_server cpu_slots')
+RunItem = namedtuple('RunItem', 'item_name process output_file single hars_server cpu_slots work_item memory_budget hython_worker batch_items')
+# Work items of a ROP and wedge waiting to be launched as one frame batch
+FrameBatch = namedtuple('FrameBatch', 'entries work_item cpu_slots memory_budget started')
 HarsServer = namedtuple('HarsServer', 'hdanorm token pipe pid')
+# Resource usage of a task run on a hython worker, in the form of the rusage from os.wait4.
+# ru_maxrss is the worker's lifetime peak, so it isn't recorded for the work item.
+WorkerUsage = namedtuple('WorkerUsage', 'ru_utime ru_stime ru_maxrss')
+# Matches parm values that evaluate differently per work item: @attributes, pdg expression functions
+# (pdgattrib, pdginput, ...) and python expressions using the work item.
+_per_item_expression_re = re.compile(r'@|\bpdg[a-z]*\s*\(|work_?item', re.IGNORECASE)
+
+class HythonWorker(object):
+    """
+    A long lived hython process running hython_worker.py, which cooks ROP fetch work items
+    of one hip file.  The worker replies to each task on its own pipe, read through reply.
+    """
+    def __init__(self, hip, process, reply):
+        self.hip = hip
+        self.process = process
+        self.reply = reply
+        self.tasks = 0
 
 logger = logging.getLogger(__name__)
 
@@ -58,9 +85,41 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
             self.initLogger(logger, logging.ERROR)
             self.schedule_lock = threading.RLock()
             self.running_single = False
-            self.run_list = []
+            # RunItems of running processes by pid, and the cpu slots they hold
+            self.run_items = {}
+            self.cpu_slots_used = 0
+            # Serializes requests for more work between the tick timer and process waiters
+            self.request_lock = threading.Lock()
+            # Memory admission, budgets are in kilobytes
+            self.memory_aware = False
+            self.memory_reserve = 0
+            self.default_memory_budget = 0
+            # Learned peak RSS of each node's work items, persisted between cooks
+            self.memory_estimates = {}
+            self.memory_estimates_path = None
+            self.learned_nodes = set()
+            # Node level environment layers by (node name, cpu slots), see _nodeEnvironment.
+            # env_varying records, by node name, whether the node's env parms vary per work item.
+            self.cache_environment = False
+            self.env_cache = {}
+            self.env_varying = {}
+            self.env_checks = set()
+            # Versions of work items, resolved for all work items of a node at once, see firehawk_submit.version_batch
+            self.version_batch = firehawk_submit.version_batch()
             self.subprocessJob = None
             self.hars_pools = {}
+            # idle hython workers and the number of workers started, by hip file
+            self.hython_idle = {}
+            self.hython_count = {}
+            self.hython_pool_size = 0
+            self.hython_max_tasks = 0
+            self.hython_max_memory = 0
+            # open frame batches by batch key, and the batch key of each batched work item
+            # until its result is reported
+            self.batch_buffers = {}
+            self.batch_items = {}
+            self.batch_sizer = frame_batching.batch_sizer(60, 10)
+            self.batch_linger = 2.0
             # timer for our tick function
             self.tick_timer = None
             self.static_cook = False
@@ -133,6 +192,55 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                     "size" : 1,
                     "value" : 0
                 },
+                # max hython worker processes kept warm for each hip file to
+                # cook ROP fetch work items.  0 starts a new hython for every item.
+                {
+                    "name" : "hythonpoolsize",
+                    "label" : "Hython Pool Size",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0
+                },
+                # hython workers are restarted after this many work items
+                {
+                    "name" : "hythonpoolmaxtasks",
+                    "label" : "Hython Worker Max Tasks",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 50
+                },
+                # hython workers are restarted once their peak memory reaches this many MB
+                {
+                    "name" : "hythonpoolmaxmemory",
+                    "label" : "Hython Worker Max Memory (MB)",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 16384
+                },
+                # frame batches are sized to cook in about this many seconds
+                {
+                    "name" : "batchtargetseconds",
+                    "label" : "Frame Batch Target Time",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 60
+                },
+                # most frames cooked in one frame batch
+                {
+                    "name" : "batchmaxframes",
+                    "label" : "Frame Batch Max Frames",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 10
+                },
+                # toggles cooking consecutive ROP fetch frames of the same ROP
+                # and wedge together in one hython
+                {
+                    "name" : "local_batch_frames",
+                    "label" : "Batch Frames",
+                    "type" : "Integer",
+                    "tag" : ["pdg::scheduler"]
+                },
                 # toggles the use of HARS pooling on and off
                 {
                     "name" : "local_usepool",
@@ -184,6 +292,48 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                     "label" : "CPUs per Job",
                     "type" : "Integer",
                     "tag" : ["pdg::scheduler"]
+                },
+                # toggles building the environment of a node's work items once per cook.
+                # Nodes whose env parms refer to work item attributes are never cached.
+                {
+                    "name" : "cacheenvironment",
+                    "label" : "Cache Node Environment",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0
+                },
+                # toggles admitting work by available memory as well as cpu slots
+                {
+                    "name" : "memoryaware",
+                    "label" : "Limit By Available Memory",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0
+                },
+                # memory in MB to keep free for the host process and the OS
+                {
+                    "name" : "memoryreserve",
+                    "label" : "Reserved Memory (MB)",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 2048
+                },
+                # memory in MB assumed for work items of nodes with no budget
+                # and no observed peak yet
+                {
+                    "name" : "defaultmemorybudget",
+                    "label" : "Default Memory per Job (MB)",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 1024
+                },
+                # memory in MB each task needs.  0 uses the observed peak of the node's
+                # work items from previous cooks.
+                {
+                    "name" : "local_memory_budget",
+                    "label" : "Memory per Job (MB)",
+                    "type" : "Integer",
+                    "tag" : ["pdg::scheduler"]
                 }
             ]
         })
@@ -274,6 +424,28 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         elif max_cpu_slots_mode == -1:
             self.max_cpu_slots = max(1, cpu_count() - 1)
         
+        self.memory_aware = self['memoryaware'].evaluateInt() > 0 and os.path.exists('/proc/meminfo')
+        self.memory_reserve = max(0, self['memoryreserve'].evaluateInt()) * 1024
+        self.default_memory_budget = max(0, self['defaultmemorybudget'].evaluateInt()) * 1024
+        self.memory_estimates_path = self.workingDir(True) + '/pdgtemp/local_memory_estimates.json'
+        self.memory_estimates = _loadMemoryEstimates(self.memory_estimates_path)
+        self.learned_nodes = set()
+
+        self.cache_environment = self['cacheenvironment'].evaluateInt() > 0
+
+        self.hython_pool_size = 0 if os.name == 'nt' else self['hythonpoolsize'].evaluateInt()
+        self.hython_max_tasks = max(1, self['hythonpoolmaxtasks'].evaluateInt())
+        self.hython_max_memory = max(1, self['hythonpoolmaxmemory'].evaluateInt()) * 1024
+
+        self.batch_buffers = {}
+        self.batch_items = {}
+        self.batch_sizer = frame_batching.batch_sizer(self['batchtargetseconds'].evaluateInt(),
+                                                      self['batchmaxframes'].evaluateInt())
+        self.env_cache = {}
+        self.env_varying = {}
+        self.env_checks = set()
+        self.version_batch = firehawk_submit.version_batch()
+
         self.static_onStartCook()
         self.static_cook = static
         if not os.path.exists(self.workingDir(True)):
@@ -296,6 +468,7 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
             self.tick_timer.cancel()
             self.tick_timer.join()
         self.kill()
+        _saveMemoryEstimates(self.memory_estimates_path, self.memory_estimates)
         return True
 
     def submitAsJob(self, graph_file, node_path):
@@ -322,12 +495,17 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
     def killPools(self):
         try:
             # gather all the unused and used pool servers and kill them
-            servers = [ri.hars_server for ri in self.run_list if ri.hars_server is not None]
+            servers = [ri.hars_server for ri in self.run_items.itervalues() if ri.hars_server is not None]
             for harss in self.hars_pools.itervalues():
                 servers.extend(harss)
             for server in servers:
                 self._terminateProcess(server.pid)
 
+            # busy hython workers are killed with their run items
+            for workers in self.hython_idle.itervalues():
+                for worker in workers:
+                    self._stopHythonWorker(worker)
+
             # Also kill all the sharedservers
             for sharedserver_name in self.getSharedServers():
                 ok = self.endSharedServer(sharedserver_name, True)
@@ -336,11 +514,169 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         except:
             traceback.print_exc()
         self.hars_pools = {}
+        self.hython_idle = {}
+        self.hython_count = {}
+
+    def _reserveHythonWorker(self, hip):
+        """
+        Reserves a worker of the hip's hython pool.  Returns an idle worker, or None if a new
+        worker may be started.  Returns False if all the pool's workers are busy.
+        """
+        idle = self.hython_idle.setdefault(hip, [])
+        if idle:
+            return idle.pop()
+        if self.hython_count.get(hip, 0) >= self.hython_pool_size:
+            return False
+        self.hython_count[hip] = self.hython_count.get(hip, 0) + 1
+        return None
+
+    def _runOnHythonWorker(self, worker, hip, item_command, item_log_path, job_env):
+        """
+        Sends the ROP fetch command to a hython worker, starting the worker if it's None.
+        Returns the worker.
+        """
+        argv = shlex.split(item_command)
+        if worker is None:
+            try:
+                worker_log = '{}/hython_worker_{}.log'.format(self.getLocalLogDir(), os.path.basename(hip))
+                worker = HythonWorker(hip, *start_hython_worker(argv[0], job_env, worker_log))
+            except:
+                self.hython_count[hip] -= 1
+                raise
+        request = {'argv': argv[1:], 'env': job_env, 'cwd': os.getcwd(), 'log': item_log_path}
+        try:
+            worker.process.stdin.write(json.dumps(request) + '\n')
+            worker.process.stdin.flush()
+        except:
+            self._stopHythonWorker(worker)
+            raise
+        return worker
+
+    def _releaseHythonWorker(self, worker, rusage):
+        """
+        Returns a worker to its pool after a task, or stops it if it died or is due to be recycled.
+        """
+        worker.tasks += 1
+        if rusage is None or worker.tasks >= self.hython_max_tasks or \
+                rusage.ru_maxrss >= self.hython_max_memory:
+            self._stopHythonWorker(worker)
+        else:
+            self.hython_idle.setdefault(worker.hip, []).append(worker)
+
+    def _stopHythonWorker(self, worker):
+        """
+        Asks a hython worker to exit by closing its stdin, and reaps it in the background.
+        """
+        if self.hython_count.get(worker.hip, 0) > 0:
+            self.hython_count[worker.hip] -= 1
+        try:
+            worker.process.stdin.close()
+        except:
+            pass
+
+        def reap():
+            worker.process.wait()
+            worker.reply.close()
+
+        reaper = threading.Thread(target=reap)
+        reaper.daemon = True
+        reaper.start()
 
     def _generateEnvironment(self, work_item, cpu_slots):
         """
         Generate an environment dict for the given workitem, based on 
         the current process's environ.
+        With cacheenvironment, the node level layers are built once per node each cook by _nodeEnvironment,
+        and only the work item's own variables are overlaid here.  Layers are only cached once the node's
+        env parms are known not to refer to the work item, see _checkEnvironmentParms.
+        """
+        node_env = None
+        if self.cache_environment:
+            node_name = work_item.node.name
+            key = (node_name, cpu_slots)
+            varying = self.env_varying.get(node_name)
+            if varying is None:
+                self._checkEnvironmentParms(work_item.node)
+            elif not varying:
+                node_env = self.env_cache.get(key)
+            if node_env is None:
+                node_env = self._nodeEnvironment(work_item, cpu_slots)
+                if varying is False:
+                    self.env_cache[key] = node_env
+        else:
+            node_env = self._nodeEnvironment(work_item, cpu_slots)
+        base_env, pdg_env, override_env, removekeys, path_prefix = node_env
+
+        job_env = base_env.copy()
+
+        # check the task environment variables
+        env_map = work_item.environment
+        for var,val in env_map.iteritems():
+            var = str(var.strip().encode('ascii', 'ignore'))
+            job_env[var] = str(val).strip().encode('ascii', 'ignore')
+
+        # set the special env vars
+        job_env.update(pdg_env)
+        job_env['PDG_ITEM_NAME'] = str(work_item.name)
+        job_env['PDG_INDEX'] = str(work_item.index)
+        job_env['PDG_INDEX4'] = '{:04d}'.format(work_item.index)
+
+        # special case PATH - we want to prepend the given value instead of replace
+        if 'PATH' in override_env and 'PATH' in env_map:
+            job_env['PATH'] = path_prefix + os.pathsep + job_env['PATH']
+            override_env = dict(override_env)
+            del override_env['PATH']
+
+        job_env.update(override_env)
+
+        # process any removals
+        for k in removekeys:
+            if k in job_env:
+                del job_env[k]
+
+        return job_env
+
+    def _checkEnvironmentParms(self, node):
+        """
+        Checks, once per node each cook, whether the env and thread parms of the node's TOP node or of this
+        scheduler's TOP node refer to the work item, eg. an env value of @wedgeindex.  hou is used on the
+        main thread, so the result is recorded in env_varying later, and the node isn't cached until then.
+        """
+        if node.name in self.env_checks:
+            return
+        self.env_checks.add(node.name)
+        try:
+            top_node = node.topNode()
+        except AttributeError:
+            top_node = None
+        if top_node is None:
+            self.env_varying[node.name] = True
+            return
+
+        def check():
+            check_nodes = [top_node]
+            # the scheduler's TOP node shares the scheduler's name, in the same network
+            scheduler_name = getattr(self, 'name', '')
+            if scheduler_name and top_node.parent() is not None:
+                scheduler_node = top_node.parent().node(scheduler_name)
+                if scheduler_node is not None:
+                    check_nodes.append(scheduler_node)
+            varying = False
+            for check_node in check_nodes:
+                for parm in check_node.parms():
+                    name = parm.name()
+                    if (name.startswith('local_env') or name.endswith('houdinimaxthreads')) and _parmVariesPerItem(parm):
+                        varying = True
+            self.env_varying[node.name] = varying
+
+        _runOnMainThread(check)
+
+    def _nodeEnvironment(self, work_item, cpu_slots):
+        """
+        Returns the environment layers shared by the work items of a node using cpu_slots:
+        the base environment, the special PDG vars, the node's env parms (which override the
+        work item environment), the keys to remove and the node's PATH prefix.
+        All values are already UTF8.
         """
         # Populate the task environment.  We inherit the PDG host
         # process's environment
@@ -367,123 +703,253 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                 maxthreads = min(maxthreads, int(job_env['HOUDINI_MAXTHREADS']))
             job_env['HOUDINI_MAXTHREADS'] = str(maxthreads)
 
-        # check the task environment variables
-        env_map = work_item.environment
-        setmap = {}
-        for var,val in env_map.iteritems():
-            var = str(var.strip().encode('ascii', 'ignore'))
-            setmap[var] = str(val).strip().encode('ascii', 'ignore')
-        job_env.update(setmap)
-
-        # set the special env vars
-        job_env['PDG_RESULT_SERVER'] = str(self.workItemResultServerAddr())
-        job_env['PDG_ITEM_NAME'] = str(work_item.name)
-        job_env['PDG_DIR'] = str(self.workingDir(False))
-        job_env['PDG_TEMP'] = str(self.tempDir(False))
-        job_env['PDG_SHARED_TEMP'] = str(self.tempDir(False))
-        job_env['PDG_INDEX'] = str(work_item.index)
-        job_env['PDG_INDEX4'] = '{:04d}'.format(work_item.index)
-        job_env['PDG_SCRIPTDIR'] = str(self.scriptDir(False))
+        pdg_env = {}
+        pdg_env['PDG_RESULT_SERVER'] = str(self.workItemResultServerAddr())
+        pdg_env['PDG_DIR'] = str(self.workingDir(False))
+        pdg_env['PDG_TEMP'] = str(self.tempDir(False))
+        pdg_env['PDG_SHARED_TEMP'] = str(self.tempDir(False))
+        pdg_env['PDG_SCRIPTDIR'] = str(self.scriptDir(False))
         # The env var that will hold our job identifier on the farm, it
         # is used to detect stale / invalid result callbacks
-        job_env['PDG_JOBID'] = self.cook_id
-        job_env['PDG_JOBID_VAR'] = 'PDG_JOBID'
+        pdg_env['PDG_JOBID'] = self.cook_id
+        pdg_env['PDG_JOBID_VAR'] = 'PDG_JOBID'
 
         # local env is supplied as multiparm of key:key
-        job_env_dict, removekeys = self.resolveEnvParams('local', work_item, True)
+        override_env, removekeys = self.resolveEnvParams('local', work_item, True)
 
-        # special case PATH - we want to prepend the given value instead of replace
-        if 'PATH' in job_env_dict and 'PATH' in job_env:
-            job_env_dict['PATH'] = job_env_dict['PATH'] + os.pathsep + job_env['PATH']
-        
-        job_env.update(job_env_dict)
+        # special case PATH - we want to prepend the given value instead of replace.
+        # The prefix is kept for work items that set their own PATH.
+        path_prefix = ''
+        if 'PATH' in override_env:
+            path_prefix = str(override_env['PATH'])
+            if 'PATH' in job_env:
+                override_env['PATH'] = override_env['PATH'] + os.pathsep + job_env['PATH']
 
         try:
             # add special houdini vars
             local_environ = os.environ
-            job_env['HIP'] = local_environ['HIP']
+            override_env['HIP'] = local_environ['HIP']
             # we don't want HFS in the environment because it will short-circuit houdini
             # normal startup
-            job_env['ORIGINAL_HFS'] = local_environ['HFS']
+            override_env['ORIGINAL_HFS'] = local_environ['HFS']
             # backup special vars - this only matters for hython and hbatch-based jobs
-            job_env['ORIGINAL_HIP'] = job_env['HIP']
-            job_env['HIPNAME'] = local_environ['HIPNAME']
-            job_env['ORIGINAL_HIPNAME'] = job_env['HIPNAME']
+            override_env['ORIGINAL_HIP'] = override_env['HIP']
+            override_env['HIPNAME'] = local_environ['HIPNAME']
+            override_env['ORIGINAL_HIPNAME'] = override_env['HIPNAME']
         except KeyError:
             pass
 
-        # process any removals
-        for k in removekeys:
-            if k in job_env:
-                del job_env[k]
-
         # ensure there is no unicode in the environment
-        job_env = convertEnvMapToUTF8(job_env)
-
-        return job_env
+        return (convertEnvMapToUTF8(job_env), convertEnvMapToUTF8(pdg_env),
+                convertEnvMapToUTF8(override_env), list(removekeys), path_prefix)
 
     def tick(self):
         """
-        Called during a cook. Checks on jobs in flight to see if
-        any have finished.  Also starts new jobs if any are availible.
+        Called during a cook. Starts new jobs if any are availible.
+        Finished jobs are reaped as they exit by their process waiter, see _waitProcess.
         """
         try:
-            want_yield = False
-            for run_item in self.run_list:
-                if run_item.process is None:
-                    # early fail for process that didn't start
-                    run_item.output_file.close()
-                    try:
-                        if os.path.getsize(run_item.output_file.name) == 0:
-                            os.remove(run_item.output_file.name)
-                    except:
-                        pass
-                    self.run_list.remove(run_item)
-                    self.workItemFailed(run_item.item_name, -1)
-                    continue
-                # check if we have a return code yet
-                code = run_item.process.poll()
-                if code is not None:
-                    run_item.output_file.close()
-                    try:
-                        if os.path.getsize(run_item.output_file.name) == 0:
-                            os.remove(run_item.output_file.name)
-                    except:
-                        pass
-                    self.run_list.remove(run_item)
-
-                    if run_item.single:
-                        self.running_single = False
-                        logger.debug("Running Single OFF")
-
-                    # if this item was using a pool slot, return the slave spec to the pool
-                    if run_item.hars_server:
-                        self.hars_pools[run_item.hars_server.hdanorm].append(run_item.hars_server)
-                        # yield this tick to allow HARS time to clean up the connection
-                        want_yield = True
-
-                    if code == 0:
-                        self.workItemSucceeded(run_item.item_name, -1, 0)
-                    else:
-                        self.workItemFailed(run_item.item_name, -1)
-            if want_yield:
-                return
+            self._flushBatches()
+            self._requestWork()
+        except:
+            traceback.print_exc()
+            sys.stderr.flush()
 
-            cpu_slots_used = sum([run_item.cpu_slots for run_item in self.run_list])
-            if cpu_slots_used < self.max_cpu_slots:
+    def _requestWork(self):
+        """
+        Requests an onSchedule callback if we have a free slot.  Called from the tick timer
+        and whenever a process exits, so short tasks don't wait on the tick to be replaced.
+        """
+        if not self.request_lock.acquire(False):
+            # another thread is already requesting work
+            return
+        try:
+            if self.cpu_slots_used < self.max_cpu_slots:
                 # we have a free slot, request an onSchedule callback right now!
                 if self.static_cook:
                     self.static_tick()
                 else:
                     self.requestTask()
+        finally:
+            self.request_lock.release()
+
+    def _startWaiter(self, run_item):
+        """
+        Starts a daemon thread that blocks until the run_item's process exits,
+        or its hython worker replies.
+        """
+        target = self._waitHythonWorker if run_item.hython_worker else self._waitProcess
+        waiter = threading.Thread(target=target, args=(run_item,))
+        waiter.daemon = True
+        waiter.start()
+
+    def _waitProcess(self, run_item):
+        """
+        Waits for the run_item's process to exit, records its resource usage and reports the result.
+        """
+        try:
+            proc = run_item.process
+            rusage = None
+            if hasattr(os, 'wait4'):
+                while True:
+                    try:
+                        pid, status, rusage = os.wait4(proc.pid, 0)
+                        break
+                    except OSError as e:
+                        if e.errno != errno.EINTR:
+                            raise
+                if os.WIFSIGNALED(status):
+                    code = -os.WTERMSIG(status)
+                else:
+                    code = os.WEXITSTATUS(status)
+                # we reaped the process, so let Popen know it has exited
+                proc.returncode = code
+            else:
+                code = proc.wait()
+            self._finishRunItem(run_item, code, rusage)
+        except:
+            traceback.print_exc()
+            sys.stderr.flush()
+            # eg. ECHILD if the process was reaped elsewhere, the item fails rather than holding its slots forever
+            self._failRunItem(run_item)
+
+    def _waitHythonWorker(self, run_item):
+        """
+        Waits for the run_item's hython worker to reply with the task's result and resource usage.
+        """
+        try:
+            reply = run_item.hython_worker.reply.readline()
+            if reply:
+                reply = json.loads(reply)
+                code = reply['code']
+                rusage = WorkerUsage(reply['utime'], reply['stime'], reply['maxrss'])
+            else:
+                # the worker died
+                code = run_item.process.wait() or -1
+                rusage = None
+            self._finishRunItem(run_item, code, rusage)
         except:
             traceback.print_exc()
             sys.stderr.flush()
+            # the worker's state is unknown, so it is stopped, and the item fails rather than never completing
+            self._failRunItem(run_item)
+
+    def _finishRunItem(self, run_item, code, rusage=None, request_work=True):
+        """
+        Releases the run_item's slots and reports the work item's result.  With request_work, more work is
+        requested for the free slots.
+        """
+        with self.schedule_lock:
+            if run_item.process is not None:
+                if self.run_items.pop(run_item.process.pid, None) is None:
+                    # killed by the scheduler
+                    return
+            self.cpu_slots_used -= run_item.cpu_slots
+
+            if rusage is not None and code == 0 and not run_item.hython_worker:
+                self._learnMemoryEstimate(run_item.work_item.node.name, rusage.ru_maxrss)
+
+            _closeOutputFile(run_item.output_file)
+
+            if run_item.single:
+                self.running_single = False
+                logger.debug("Running Single OFF")
+
+            # if this item was using a pool slot, return the slave spec to the pool
+            if run_item.hars_server:
+                self.hars_pools[run_item.hars_server.hdanorm].append(run_item.hars_server)
+
+            if run_item.hython_worker:
+                self._releaseHythonWorker(run_item.hython_worker, rusage)
+
+        if rusage is not None:
+            self._setResourceUsage(run_item, rusage)
+
+        # items of a batch that the runner didn't report take the result of the batch
+        for item_name in run_item.batch_items or [run_item.item_name]:
+            if code == 0:
+                self.workItemSucceeded(item_name, -1, 0)
+            else:
+                self.workItemFailed(item_name, -1)
+
+        # leave the next request to the tick to allow HARS time to clean up the connection
+        if request_work and not run_item.hars_server:
+            self._requestWork()
+
+    def _failRunItem(self, run_item):
+        """
+        Fails a run_item whose waiter hit an error, so its slots and memory aren't held forever.
+        _finishRunItem only releases a run_item still tracked, so it can't be released twice.
+        """
+        try:
+            self._finishRunItem(run_item, -1)
+        except:
+            traceback.print_exc()
+            sys.stderr.flush()
+
+    def _setResourceUsage(self, run_item, rusage):
+        """
+        Records the cpu time and peak memory of the work item's process as attributes.
+        The peak memory of a hython worker isn't the task's own, so isn't recorded.
+        """
+        max_rss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            # reported in bytes rather than kilobytes
+            max_rss /= 1024
+        try:
+            run_item.work_item.data.setFloat('cpu_time', rusage.ru_utime + rusage.ru_stime, 0)
+            if not run_item.hython_worker:
+                run_item.work_item.data.setInt('max_rss_kb', int(max_rss), 0)
+        except:
+            logger.debug('Unable to set resource usage of {}'.format(run_item.item_name))
+
+    def _memoryBudget(self, work_item):
+        """
+        Returns the memory in kilobytes the work item is expected to need: its node's
+        local_memory_budget, or else the node's observed peak, or else the default budget.
+        """
+        budget = self.evaluateIntOverride(work_item.node, 'local', 'memory_budget', work_item, 0)
+        if budget > 0:
+            return budget * 1024
+        return self.memory_estimates.get(work_item.node.name, self.default_memory_budget)
+
+    def _learnMemoryEstimate(self, node_name, max_rss):
+        """
+        Feeds an observed peak RSS (kilobytes) of a node's work item back into its estimate.
+        The estimate follows the largest peak of the current cook, so it also comes down
+        when a node gets lighter between cooks.
+        """
+        if sys.platform == 'darwin':
+            max_rss /= 1024
+        # headroom for variation between work items
+        max_rss = int(max_rss * 1.2)
+        if node_name in self.learned_nodes:
+            max_rss = max(max_rss, self.memory_estimates.get(node_name, 0))
+        self.learned_nodes.add(node_name)
+        self.memory_estimates[node_name] = max_rss
+
+    def _hasMemoryFor(self, budget):
+        """
+        Returns True if a process needing budget kilobytes fits in available memory, after
+        the outstanding budget of running processes that haven't reached their peak yet, and the
+        whole budget of open frame batches, which hold memory for a process that hasn't started.
+        """
+        if not self.run_items and not self.batch_buffers:
+            # always run something so work can't be starved
+            return True
+        committed = 0
+        # values() copies, since callers may not hold the schedule lock
+        for run_item in self.run_items.values():
+            committed += max(0, run_item.memory_budget - _processRSS(run_item.process.pid))
+        for batch in self.batch_buffers.values():
+            committed += batch.memory_budget
+        available = _availableMemory() - committed - self.memory_reserve
+        return budget <= available
 
     def kill(self):
         with self.schedule_lock:
             try:
-                for run_item in self.run_list:
+                for run_item in self.run_items.itervalues():
                     try:
                         if run_item.process.pid > 0:
                             self._terminateProcess(run_item.process.pid)
@@ -493,7 +959,9 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                         pass
                 self.killPools()
             finally:
-                self.run_list = []
+                self.run_items = {}
+                self.batch_buffers = {}
+                self.cpu_slots_used = 0
                 self.running_single = False
 
     def _verifyJobId(self, name, jobid):
@@ -513,6 +981,8 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         job_id = self._verifyJobId(name, jobid)
         if job_id is None:
             return
+        if not self._untrackBatchItem(name, cook_duration):
+            return
         self.onWorkItemSucceeded(name, index, cook_duration)
 
         if self.static_cook:
@@ -525,6 +995,8 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         job_id = self._verifyJobId(name, jobid)
         if job_id is None:
             return
+        if not self._untrackBatchItem(name):
+            return
         self.onWorkItemFailed(name, index)
 
     def workItemCanceled(self, name, index, jobid=''):
@@ -624,6 +1096,165 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         item_command = item_command.replace("__PDG_HYTHON__", self.hythonBin(sys.platform))
         return item_command
     
+    def _prepareCommand(self, work_item, cpu_slots):
+        """
+        Prepares a work item to run, and returns its name, expanded command, environment and log path.
+        """
+        item_name = str(work_item.name)
+        item_command = work_item.command
+
+        item_command = self._replaceMagicVars(item_command, work_item)
+
+        ### firehawk on schedule version handling
+        # all work items of the node are versioned when the first is scheduled, the rest are a lookup
+        self.version_batch.version_work_item(work_item)
+        ### end firehawk on schedule version handling
+
+        # Ensure directories exist and serialize the work item
+        self.createJobDirsAndSerializeWorkItems(work_item)
+
+        job_env = self._generateEnvironment(work_item, cpu_slots)
+
+        log_dir = self.getLocalLogDir()
+        item_log_path = log_dir + '/' + item_name + '.log'
+
+        # replace any job vars, and then any Houdini vars ($HFS etc) 
+        item_command = expand_vars(item_command, job_env)
+        item_command = os.path.expandvars(item_command)
+
+        # ensure no unicode is in the command, because we want to use shlex
+        item_command = item_command.encode('ascii', 'ignore')
+
+        return item_name, item_command, job_env, item_log_path
+
+    def _cpuSlots(self, work_item):
+        """
+        Returns the number of cpu slots the work item uses.
+        """
+        node = work_item.node
+        use_cpu_slots = self.evaluateIntOverride(node, "local", "is_CPU_number_set", work_item, 0) > 0
+        cpu_slots = 1
+        if use_cpu_slots:
+            cpu_slots = self.evaluateIntOverride(node, 'local', 'CPUs_to_use', work_item, 1)
+            if cpu_slots <= 0:
+                # Use Max-N slots
+                cpu_slots = max(0, self.max_cpu_slots - cpu_slots)
+        return cpu_slots
+
+    def _scheduleBatchFrame(self, work_item, key):
+        """
+        Adds a ROP fetch work item to the open frame batch of its ROP and wedge.  Opening a new batch
+        needs the cpu slots and memory of one process, which the batch holds while it fills.
+        Full batches are launched right away, partial batches by tick after batch_linger seconds.
+        A frame that isn't consecutive with the open batch launches it, and opens a new batch.
+        """
+        cpu_slots = self._cpuSlots(work_item)
+        gap_batch = None
+        with self.schedule_lock:
+            open_batch = self.batch_buffers.get(key)
+            if open_batch is not None and not frame_batching.continues_run(
+                    [entry['frame'] for entry in open_batch.entries], work_item.frame, frame_batching.frame_step(work_item)):
+                gap_batch = self.batch_buffers.pop(key)
+        if gap_batch:
+            self._launchBatch(gap_batch)
+
+        batch = None
+        with self.schedule_lock:
+            open_batch = self.batch_buffers.get(key)
+            if open_batch is None:
+                if (self.cpu_slots_used + cpu_slots) > self.max_cpu_slots:
+                    if self.cpu_slots_used == self.max_cpu_slots:
+                        return scheduleResult.FullDeferred
+                    return scheduleResult.Deferred
+
+                memory_budget = 0
+                if self.memory_aware:
+                    memory_budget = self._memoryBudget(work_item)
+                    if not self._hasMemoryFor(memory_budget):
+                        return scheduleResult.Deferred
+
+                open_batch = FrameBatch([], work_item, cpu_slots, memory_budget, time.time())
+                self.batch_buffers[key] = open_batch
+                self.cpu_slots_used += cpu_slots
+
+            item_name, item_command, job_env, item_log_path = self._prepareCommand(work_item, open_batch.cpu_slots)
+            argv = shlex.split(item_command)
+            open_batch.entries.append({
+                'item_name' : item_name,
+                'hython' : argv[0],
+                'argv' : argv[1:],
+                'env' : job_env,
+                'log' : item_log_path,
+                'frame' : work_item.frame})
+            self.batch_items[item_name] = key
+            if len(open_batch.entries) >= self.batch_sizer.size(key):
+                batch = self.batch_buffers.pop(key)
+
+        self.workItemStartCook(item_name, -1)
+        if batch:
+            self._launchBatch(batch)
+        return scheduleResult.Succeeded
+
+    def _flushBatches(self):
+        """
+        Launches the frame batches that have waited at least batch_linger seconds for more frames.
+        """
+        now = time.time()
+        with self.schedule_lock:
+            ready = [key for key, batch in self.batch_buffers.iteritems() if now - batch.started >= self.batch_linger]
+            batches = [self.batch_buffers.pop(key) for key in ready]
+        for batch in batches:
+            self._launchBatch(batch)
+
+    def _launchBatch(self, batch):
+        """
+        Runs a frame batch as one hython process, which reports each work item as it completes.
+        """
+        entries = sorted(batch.entries, key=lambda entry: entry['frame'])
+        item_names = [entry['item_name'] for entry in entries]
+        first = entries[0]
+        batch_path = '{}/batches/{}.json'.format(self.tempDir(True), first['item_name'])
+
+        proc = None
+        output_file = open('{}/{}_batch.log'.format(self.getLocalLogDir(), first['item_name']), 'w')
+        try:
+            frame_batching.write_batch(batch_path, entries)
+            batch_command = '"{}" "{}" --batch "{}"'.format(first['hython'],
+                os.path.join(menu_path, 'hython_worker.py'), batch_path)
+            proc = start_async(batch_command, output_file, first['env'])
+        except:
+            output_file.write(traceback.format_exc())
+
+        with self.schedule_lock:
+            run_item = RunItem(first['item_name'], proc, output_file, False, None, batch.cpu_slots, batch.work_item,
+                               batch.memory_budget, None, item_names)
+            if proc is not None:
+                self.run_items[proc.pid] = run_item
+        logger.debug("Running batch: " + repr(item_names))
+
+        if proc is None:
+            # may be called from onSchedule, so the next request is left to the tick
+            self._finishRunItem(run_item, -1, request_work=False)
+        else:
+            self._startWaiter(run_item)
+
+    def _untrackBatchItem(self, name, cook_duration=0):
+        """
+        Returns False if name is a batched work item whose result was already reported, so that the
+        runner's report and the batch process exit only report it once.
+        The cook duration of a frame is fed back into the batch sizes.
+        """
+        with self.schedule_lock:
+            if name not in self.batch_items:
+                return True
+            key = self.batch_items[name]
+            if key is None:
+                return False
+            self.batch_items[name] = None
+        if cook_duration > 0:
+            self.batch_sizer.record(key, cook_duration)
+        return True
+
     def onScheduleStatic(self, dependency_map, dependent_map, ready_items):
         self.static_loadDependencies(dependency_map, dependent_map, ready_items)
 
@@ -632,18 +1263,18 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
 
         # we can't run a single task if we are already doing so
         is_single = self.evaluateIntOverride(node, 'local', 'single', work_item, 0) > 0
-        use_cpu_slots = self.evaluateIntOverride(node, "local", "is_CPU_number_set", work_item, 0) > 0
+
+        # ROP fetch frames of batching nodes are cooked together in one hython
+        if not is_single and self.evaluateIntOverride(node, 'local', 'batch_frames', work_item, 0) > 0:
+            batch_key = frame_batching.batch_key(work_item, work_item.command)
+            if batch_key is not None:
+                return self._scheduleBatchFrame(work_item, batch_key)
 
         with self.schedule_lock:
-            cpu_slots_used = sum([run_item.cpu_slots for run_item in self.run_list])
+            cpu_slots_used = self.cpu_slots_used
             logger.debug("onSchedule [{}/{} S:{}]: {}".format(cpu_slots_used, self.max_cpu_slots, self.running_single, work_item.name))
 
-            cpu_slots = 1
-            if use_cpu_slots:
-                cpu_slots = self.evaluateIntOverride(node, 'local', 'CPUs_to_use', work_item, 1)
-                if cpu_slots <= 0:
-                    # Use Max-N slots
-                    cpu_slots = max(0, self.max_cpu_slots - cpu_slots)
+            cpu_slots = self._cpuSlots(work_item)
 
             # if the slots are full we can't run anything else
             if (cpu_slots_used + cpu_slots) > self.max_cpu_slots:
@@ -655,6 +1286,13 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
             if self.running_single and is_single:
                 return scheduleResult.Deferred
 
+            # wait for memory to be freed if this would risk running out
+            memory_budget = 0
+            if self.memory_aware:
+                memory_budget = self._memoryBudget(work_item)
+                if not self._hasMemoryFor(memory_budget):
+                    return scheduleResult.Deferred
+
             # for work items in hdaprocessor we have to consider the HARS pool state
             hars_server = None
             is_hdaworkitem = work_item.node.__class__.__name__.lower() == "hdaprocessor"
@@ -677,6 +1315,17 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                         else:
                             hars_server = hars_pool.pop()
 
+            # ROP fetch items can be cooked by a warm hython worker of the hip's pool
+            hython_hip = None
+            hython_worker = None
+            if hars_server is None and self.hython_pool_size > 0:
+                hython_hip = _ropFetchHip(work_item.command)
+                if hython_hip is not None:
+                    hython_worker = self._reserveHythonWorker(hython_hip)
+                    if hython_worker is False:
+                        # pool busy, we can't accept this task
+                        return scheduleResult.Deferred
+
             # Everything looks good - we're going to run it
             #
 
@@ -684,46 +1333,31 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
             if is_single:
                 self.running_single = True
 
-            item_name = str(work_item.name)
-            item_command = work_item.command
-
-            item_command = self._replaceMagicVars(item_command, work_item)
-
-            ### firehawk on schedule version handling
-            index_key = work_item.data.stringData('index_key', 0)
-            if index_key is not None:
-                print "on schedule version handling", work_item
-                rop_path = work_item.data.stringData('rop', 0)
-                hou_node = hou.node(rop_path)
-                print "hou_node", hou_node
-                firehawk_submit.submit(hou_node).onScheduleVersioning(work_item)
-            ### end firehawk on schedule version handling
-
-            # Ensure directories exist and serialize the work item
-            self.createJobDirsAndSerializeWorkItems(work_item)
-
-            job_env = self._generateEnvironment(work_item, cpu_slots)
-
-            log_dir = self.getLocalLogDir()
-            item_log_path = log_dir + '/' + item_name + '.log'
-
-            def open_output_file():
-                outf = open(item_log_path, 'w')
-                return outf
-            
-            # replace any job vars, and then any Houdini vars ($HFS etc) 
-            item_command = expand_vars(item_command, job_env)
-            item_command = os.path.expandvars(item_command)
-
-            # ensure no unicode is in the command, because we want to use shlex
-            item_command = item_command.encode('ascii', 'ignore')
+            try:
+                item_name, item_command, job_env, item_log_path = self._prepareCommand(work_item, cpu_slots)
+                output_file = open(item_log_path, 'w')
+            except:
+                # nothing was started, so give back what was reserved for the item
+                if hython_hip is not None:
+                    if hython_worker is None:
+                        self.hython_count[hython_hip] -= 1
+                    else:
+                        self.hython_idle.setdefault(hython_hip, []).append(hython_worker)
+                if hars_server is not None:
+                    self.hars_pools[hda].append(hars_server)
+                if is_single:
+                    self.running_single = False
+                raise
 
             proc = None
-            output_file = open_output_file()
 
             # Actually start the process
             try:
-                if hars_server is not None:
+                if hython_hip is not None:
+                    # this is a pooled ROP fetch task - send it to the worker
+                    hython_worker = self._runOnHythonWorker(hython_worker, hython_hip, item_command, item_log_path, job_env)
+                    proc = hython_worker.process
+                elif hars_server is not None:
                     # this is a pooled hda task - start it!
                     proc = start_hdaprocessor_async(item_command, output_file, hars_server.pipe, job_env)
                 else:
@@ -735,13 +1369,22 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
                 # via the cook failure instead of schedule failure.
                 output_file.write(errs)
 
-            # add a RunItem to the run_list to track the running process
-            run_item = RunItem(item_name, proc, output_file, is_single, hars_server, cpu_slots)
-            self.run_list.append(run_item)
+            # track the running process until its waiter reaps it
+            run_item = RunItem(item_name, proc, output_file, is_single, hars_server, cpu_slots, work_item, memory_budget,
+                               hython_worker if proc is not None else None, None)
+            self.cpu_slots_used += cpu_slots
+            if proc is not None:
+                self.run_items[proc.pid] = run_item
             logger.debug("Running: " + repr(run_item))
             logger.debug("Command: " + item_command)
 
         self.workItemStartCook(item_name, -1)
+        if proc is None:
+            # early fail for process that didn't start.  Requesting work here would re-enter onSchedule,
+            # so it is left to the tick.
+            self._finishRunItem(run_item, -1, request_work=False)
+        else:
+            self._startWaiter(run_item)
         return scheduleResult.Succeeded
     
     def getStatusURI(self, work_item):
@@ -753,6 +1396,159 @@ class LocalScheduler(CallbackServerMixin, StaticCookMixin, PyScheduler):
         uri = 'file:///' + log_path
         return uri
 
+def _runOnMainThread(func, *args):
+    """
+    Runs func on Houdini's main thread, where hou must be used.  Scheduler callbacks arrive on PDG threads.
+    """
+    if hou.isUIAvailable():
+        import hdefereval
+        hdefereval.executeDeferred(func, *args)
+    else:
+        func(*args)
+
+def _parmVariesPerItem(parm):
+    """
+    Returns True if parm's expression or raw string refers to the work item, so it can't be evaluated once per node.
+    """
+    try:
+        if _per_item_expression_re.search(parm.expression()):
+            return True
+    except hou.OperationFailed:
+        # the parm has no expression
+        pass
+    try:
+        return _per_item_expression_re.search(parm.unexpandedString()) is not None
+    except hou.OperationFailed:
+        # not a string parm
+        return False
+
+def _availableMemory():
+    """
+    Returns the memory in kilobytes available for new processes without swapping.
+    """
+    meminfo = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                meminfo[fields[0].rstrip(':')] = int(fields[1])
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    # kernels before 3.14
+    return meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+
+_page_kb = os.sysconf('SC_PAGE_SIZE') / 1024 if hasattr(os, 'sysconf') else 4
+
+def _processRSS(pid):
+    """
+    Returns the current resident set size of a process in kilobytes, or 0 if it has exited.
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * _page_kb
+    except (IOError, IndexError, ValueError):
+        return 0
+
+def _loadMemoryEstimates(path):
+    """
+    Loads the learned memory estimates of each node, saved by a previous cook.
+    """
+    try:
+        with open(path) as f:
+            return dict((str(k), int(v)) for k, v in json.load(f).iteritems())
+    except (IOError, ValueError, AttributeError):
+        return {}
+
+def _saveMemoryEstimates(path, estimates):
+    """
+    Saves the learned memory estimates of each node for the next cook.
+    """
+    if not path or not estimates:
+        return
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(estimates, f, indent=1, sort_keys=True)
+    except (IOError, OSError):
+        logger.warning('Unable to save memory estimates to ' + path)
+
+def _closeOutputFile(output_file):
+    """
+    Closes a work item's log, removing it if nothing was written.
+    """
+    output_file.close()
+    try:
+        if os.path.getsize(output_file.name) == 0:
+            os.remove(output_file.name)
+    except:
+        pass
+
+def _ropFetchHip(item_command):
+    """
+    Returns the hip file argument of a ROP fetch command running rop.py, or None
+    if item_command isn't one.
+    """
+    try:
+        argv = shlex.split(item_command.encode('ascii', 'ignore'))
+    except ValueError:
+        return None
+    args = frame_batching.rop_fetch_args(argv)
+    if args is None:
+        return None
+    return args[0]
+
+# Held while the scheduler starts processes.  A hython worker's reply pipe is inheritable only while its
+# worker starts, so other processes started by the scheduler don't inherit it.
+_spawn_lock = threading.Lock()
+
+def _setCloseOnExec(fd, close_on_exec):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if close_on_exec:
+        flags |= fcntl.FD_CLOEXEC
+    else:
+        flags &= ~fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+def start_hython_worker(hython, job_env, log_path):
+    """
+    Starts a hython worker process running hython_worker.py.
+    The worker's output is appended to log_path, and it replies on a pipe of its own, whose fd
+    is passed in FIREHAWK_HYTHON_REPLY_FD.
+    hython: the hython executable of the ROP fetch command
+    job_env: environment of the worker's first task
+    log_path: the worker's log
+    return: Popen object, reply file
+    """
+    if find_executable(hython) is None:
+        raise OSError("Could not find executable '{}'".format(hython))
+    worker_script = os.path.join(menu_path, 'hython_worker.py')
+    read_fd, write_fd = os.pipe()
+    # other processes mustn't inherit the pipe, or the worker's death wouldn't close it
+    _setCloseOnExec(read_fd, True)
+    env = dict(job_env)
+    env['FIREHAWK_HYTHON_REPLY_FD'] = str(write_fd)
+    try:
+        with open(log_path, 'a') as log_file:
+            # the write end is left inheritable, rather than marked in a preexec_fn, which isn't safe to run
+            # in the child of a multithreaded process.  It is closed in this process as soon as the worker starts.
+            with _spawn_lock:
+                proc = subprocess.Popen([hython, worker_script],
+                                        stdin=subprocess.PIPE,
+                                        stdout=log_file,
+                                        stderr=subprocess.STDOUT,
+                                        close_fds=False,
+                                        shell=False, env=env)
+                os.close(write_fd)
+                write_fd = None
+    except:
+        os.close(read_fd)
+        raise
+    finally:
+        if write_fd is not None:
+            os.close(write_fd)
+    return proc, os.fdopen(read_fd, 'r')
+
 def start_async(item_command, output_file, job_env):
     """
     Executes the given cmd in a non-blocking subprocess
@@ -774,13 +1570,14 @@ def start_async(item_command, output_file, job_env):
         output_file.write(err)
         logging.warning(err)
         return None
-    proc = subprocess.Popen(argv,
-                            stdout=output_file, 
-                            stderr=subprocess.STDOUT,
-                            stdin=subprocess.PIPE,
-                            shell=False, env=job_env,
-                            startupinfo=startupinfo,
-                            creationflags=creationflags)
+    with _spawn_lock:
+        proc = subprocess.Popen(argv,
+                                stdout=output_file, 
+                                stderr=subprocess.STDOUT,
+                                stdin=subprocess.PIPE,
+                                shell=False, env=job_env,
+                                startupinfo=startupinfo,
+                                creationflags=creationflags)
     proc.stdin.close()
     return proc
 
@@ -809,12 +1606,13 @@ def start_hdaprocessor_async(item_command, output_file, poolname, job_env):
         output_file.write(err)
         logging.warning(err)
         return None
-    proc = subprocess.Popen(argv, 
-                            stdout=output_file,
-                            stderr=subprocess.STDOUT,
-                            stdin=subprocess.PIPE,
-                            shell=False, env=job_env,
-                            startupinfo=startupinfo,
-                            creationflags=creationflags)
+    with _spawn_lock:
+        proc = subprocess.Popen(argv, 
+                                stdout=output_file,
+                                stderr=subprocess.STDOUT,
+                                stdin=subprocess.PIPE,
+                                shell=False, env=job_env,
+                                startupinfo=startupinfo,
+                                creationflags=creationflags)
     proc.stdin.close()
     return proc
@@ -45,12 +45,17 @@ import re
 import threading
 import json
 import traceback
+from collections import namedtuple
+from cStringIO import StringIO
 
 ### Firehawk versioning alterations
 import hou
 menu_path = os.environ['FIREHAWK_HOUDINI_TOOLS'] + '/scripts/modules'
 sys.path.append(menu_path)
 import firehawk_submit as firehawk_submit
+import path_mapping
+import deadline_command
+import frame_batching
 ###
 
 import pdg
@@ -60,6 +65,15 @@ from pdg.utils import TickTimer
 
 logger = logging.getLogger(__name__)
 
+# task_items is None for a job running a single work item, else the item names of each task of the job
+JobSubmission = namedtuple('JobSubmission', 'work_items item_names job_file plugin_file task_items')
+PackedTask = namedtuple('PackedTask', 'work_item item_name item_index executable arguments')
+# Pre-rendered node-invariant sections of a node's job and plugin info files
+JobTemplate = namedtuple('JobTemplate', 'job_lines frames_line env_lines env_count plugin_lines')
+# Matches parm values that evaluate differently per work item: @attributes, pdg expression functions
+# (pdgattrib, pdginput, ...) and python expressions using the work item.
+per_item_expression_re = re.compile(r'@|\bpdg[a-z]*\s*\(|work_?item', re.IGNORECASE)
+
 def GetDeadlineCommand():
     """
     Finds and returns the Deadline command with full path on current platform, or empty string if not found.
@@ -84,16 +98,10 @@ def GetDeadlineCommand():
 
     return deadlineCommand
 
-def CallDeadlineCommand(arguments, hideWindow=True, readStdout=True):
+def GetDeadlineStartupInfo(hideWindow=True):
     """
-    Calls the deadline command with given arguments.
-    Requires that Deadline be installed and DEADLINE_PATH environment path is setup. 
-    Returns the output from the invoked command as well as any errors.
+    Returns the (startupinfo, creationflags) used to launch the deadline command on the current platform.
     """
-    deadlineCommand = GetDeadlineCommand()
-    if len(deadlineCommand) == 0:
-        return ""
-
     startupinfo = None
     creationflags = 0
     if os.name == 'nt':
@@ -109,7 +117,12 @@ def CallDeadlineCommand(arguments, hideWindow=True, readStdout=True):
             # Still show top-level windows, but don't show a console window
             CREATE_NO_WINDOW = 0x08000000   #MSDN process creation flag
             creationflags = CREATE_NO_WINDOW
+    return startupinfo, creationflags
 
+def GetDeadlineEnvironment(deadlineCommand):
+    """
+    Returns the environment the deadline command is launched with, based on the current process's environ.
+    """
     environment = {}
     for key in os.environ.keys():
         environment[key] = str(os.environ[key])
@@ -119,6 +132,20 @@ def CallDeadlineCommand(arguments, hideWindow=True, readStdout=True):
         deadlineCommandDir = os.path.dirname( deadlineCommand )
         if not deadlineCommandDir == "" :
             environment['PATH'] = deadlineCommandDir + os.pathsep + os.environ['PATH']
+    return environment
+
+def CallDeadlineCommand(arguments, hideWindow=True, readStdout=True):
+    """
+    Calls the deadline command with given arguments.
+    Requires that Deadline be installed and DEADLINE_PATH environment path is setup. 
+    Returns the output from the invoked command as well as any errors.
+    """
+    deadlineCommand = GetDeadlineCommand()
+    if len(deadlineCommand) == 0:
+        return "", ""
+
+    startupinfo, creationflags = GetDeadlineStartupInfo(hideWindow)
+    environment = GetDeadlineEnvironment(deadlineCommand)
 
     arguments.insert( 0, deadlineCommand )
     #logger.debug("deadline popen: {}".format(str(arguments)))
@@ -133,6 +160,40 @@ def CallDeadlineCommand(arguments, hideWindow=True, readStdout=True):
 
     return output.strip(), errors.strip()
 
+def ResolveDeadlineCommand():
+    """
+    Returns the deadline command, its launch flags and environment, for a DeadlineCommandPool.
+    """
+    deadlineCommand = GetDeadlineCommand()
+    startupinfo, creationflags = GetDeadlineStartupInfo(True)
+    return deadlineCommand, startupinfo, creationflags, GetDeadlineEnvironment(deadlineCommand)
+
+def RunOnMainThread(func, *args):
+    """
+    Runs func on Houdini's main thread, where hou must be used.  Scheduler callbacks arrive on PDG threads.
+    """
+    if hou.isUIAvailable():
+        import hdefereval
+        hdefereval.executeDeferred(func, *args)
+    else:
+        func(*args)
+
+def ParmVariesPerItem(parm):
+    """
+    Returns True if parm's expression or raw string refers to the work item, so it can't be evaluated once per node.
+    """
+    try:
+        if per_item_expression_re.search(parm.expression()):
+            return True
+    except hou.OperationFailed:
+        # the parm has no expression
+        pass
+    try:
+        return per_item_expression_re.search(parm.unexpandedString()) is not None
+    except hou.OperationFailed:
+        # not a string parm
+        return False
+
 def GetJobIdFromSubmission(submissionResults):
     """
     Returns the job ID found in the given submission results string.
@@ -146,6 +207,78 @@ def GetJobIdFromSubmission(submissionResults):
 
     return job_id
 
+def GetJobIdsFromSubmission(submissionResults):
+    """
+    Returns all job IDs found in the given submission results string, in submission order.
+    The submission results may be the output of a single or a multiple job submission.
+    """
+    return [line.replace( "JobID=", "" ).strip() for line in submissionResults.split() if line.startswith( "JobID=" )]
+
+def ParseInfoBlocks(info):
+    """
+    Parses deadline command output made of blank line separated blocks of key=value lines
+    into a list of dicts, one per block.
+    """
+    blocks = []
+    current = {}
+    for line in info.splitlines():
+        line = line.strip()
+        if not line:
+            if current:
+                blocks.append(current)
+                current = {}
+            continue
+        key, sep, value = line.partition('=')
+        if sep:
+            current[key.strip()] = value.strip()
+    if current:
+        blocks.append(current)
+    return blocks
+
+def ParseJobInfoBatch(job_info, job_ids):
+    """
+    Parses the output of a multi-job GetJob query into a status table of
+    {job_id: {key: value}}.
+    Job blocks are separated by blank lines. Each block is keyed by its ID entry,
+    and if the ID entry is missing the blocks are matched to job_ids in query order.
+    """
+    blocks = ParseInfoBlocks(job_info)
+    status_table = {}
+    match_by_order = len(blocks) == len(job_ids)
+    for block_idx, block in enumerate(blocks):
+        job_id = block.get('ID') or block.get('JobId')
+        if not job_id and match_by_order:
+            job_id = job_ids[block_idx]
+        if job_id:
+            status_table[job_id] = block
+    return status_table
+
+def ParseJobTasks(task_info):
+    """
+    Parses the output of a GetJobTasks query into {task_index: {key: value}}.
+    Tasks are keyed by the trailing number of their TaskId, or by their order in the output.
+    """
+    tasks = {}
+    for block_idx, block in enumerate(ParseInfoBlocks(task_info)):
+        task_index = block_idx
+        task_id = block.get('TaskId') or block.get('TaskID')
+        if task_id:
+            task_id_match = re.search(r'(\d+)$', task_id)
+            if task_id_match:
+                task_index = int(task_id_match.group(1))
+        tasks[task_index] = block
+    return tasks
+
+def ParseTotalRenderTime(time_value):
+    """
+    Returns the total render time in seconds for a TotalRenderTime value (e.g. 00:00:07.4310000)
+    """
+    try:
+        h, m, s = time_value.split(':')
+        return int(datetime.timedelta(hours=int(h), minutes=int(m), seconds=float(s)).total_seconds())
+    except ValueError:
+        return 0
+
 
 class DeadlineScheduler(CallbackServerMixin, PyScheduler):
     """
@@ -158,6 +291,62 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         CallbackServerMixin.__init__(self, False)
         self.active_jobs = {}
         self.jobs_lock = threading.Lock()
+        # Max job ids per GetJob status query, keeps the command line within Windows limits.
+        self.status_query_chunk_size = 200
+        # Pool of threads running deadlinecommand calls for submit, poll, fail and log lookup.
+        # When a web service is set, the calls are sent to its REST api over kept alive connections instead.
+        self.deadline_pool = deadline_command.DeadlineCommandPool(ResolveDeadlineCommand)
+        self.deadline_webservice = ''
+        # Asynchronous submission pipeline. onSchedule queues submissions, which are sent
+        # in batches of submit_batch_size jobs through the pool workers. Once
+        # max_submits_in_flight submissions are outstanding onSchedule defers new items.
+        # Submissions are tagged with the cook_generation they were queued in, so returns from an
+        # earlier cook's submissions are recognised and their jobs failed.
+        self.submit_lock = threading.Lock()
+        self.pending_submissions = []
+        self.submits_in_flight = 0
+        self.submit_batch_size = 1
+        self.max_submits_in_flight = 64
+        self.cook_active = False
+        self.cook_generation = 0
+        self.item_job_ids = {}
+        self.monitor_host_name = ''
+        # Packing mode. Ready items of a node with deadline_pack_size > 1 are buffered
+        # and submitted together as one multi-task job, tracked per task in packed_jobs
+        # as {job_id: {task_index: [item_name, ...]}}.
+        self.pack_lock = threading.Lock()
+        self.pack_buffers = {}
+        self.packed_jobs = {}
+        # Seconds a partially filled pack waits for more items before it is submitted
+        self.pack_linger = 2.0
+        # Frame batching. ROP fetch frames of nodes with deadline_batch_frames are buffered
+        # per ROP and wedge in batch_buffers, and each batch is cooked by one task running
+        # hython_worker.py --batch.  batch_keys maps each batched item to its batch key until
+        # its cook time is fed back into the batch sizes.
+        self.batch_buffers = {}
+        self.batch_keys = {}
+        self.batch_sizer = frame_batching.batch_sizer(300, 10)
+        # Push completion. The post task script reports each finished task straight to the
+        # result server, and repository polling drops to a reconciliation sweep every
+        # poll_interval seconds that only catches lost messages.
+        # tracked_items maps item_name to (job_id, task_index) while the item is in flight.
+        self.tracked_items = {}
+        self.poll_interval = 0
+        self.last_poll_time = 0
+        # Job templates cached per (node name, plugin parm) for the cook, see getJobTemplate.
+        self.template_lock = threading.Lock()
+        self.job_templates = {}
+        self.cache_job_templates = False
+        # PDG nodes whose TOP nodes are watched, and the parm callbacks registered by TOP node path.
+        # template_varying records, by PDG node name, whether the node's deadline parms vary per work item.
+        self.template_watched_nodes = set()
+        self.template_top_nodes = {}
+        self.template_varying = {}
+        self.template_callbacks = {}
+        # the same callable is passed to addEventCallback and removeEventCallback
+        self.template_parm_callback = self.onTemplateParmChanged
+        # Versions of work items, resolved for all work items of a node at once, see firehawk_submit.version_batch.
+        self.version_batch = firehawk_submit.version_batch()
         self.tick_timer = None
         self.custom_port_range = None
         self.launched_monitor = False
@@ -187,6 +376,12 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
                     "type" : "String",
                     "size" : 1,
                 },
+                {
+                    "name" : "deadline_webservice",
+                    "label" : "Web Service (host:port)",
+                    "type" : "String",
+                    "size" : 1,
+                },
                 {
                     "name" : "localsharedroot",
                     "label" : "Local Shared Root Path",
@@ -224,6 +419,95 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
                     "type" : "Integer",
                     "size" : 1,
                 },
+                {
+                    "name" : "deadline_submit_batch_size",
+                    "label" : "Jobs per Submission",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 1
+                },
+                {
+                    "name" : "deadline_max_submits_in_flight",
+                    "label" : "Max Pending Submissions",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 64
+                },
+                {
+                    "name" : "deadline_pack_size",
+                    "label" : "Work Items per Job",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0,
+                    "tag" : ["pdg::scheduler"]
+                },
+                {
+                    "name" : "deadline_pack_plugin",
+                    "label" : "Packed Job Plugin",
+                    "type" : "String",
+                    "size" : 1,
+                    "value" : "PDGDeadline",
+                    "tag" : ["pdg::scheduler"]
+                },
+                {
+                    "name" : "deadline_batch_frames",
+                    "label" : "Batch Frames",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0,
+                    "tag" : ["pdg::scheduler"]
+                },
+                {
+                    "name" : "deadline_batch_runner",
+                    "label" : "Frame Batch Runner",
+                    "type" : "String",
+                    "size" : 1,
+                    "value" : "\$FIREHAWK_HOUDINI_TOOLS/scripts/modules/hython_worker.py",
+                    "tag" : ["pdg::scheduler"]
+                },
+                {
+                    "name" : "deadline_batch_target_seconds",
+                    "label" : "Frame Batch Target Time",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 300
+                },
+                {
+                    "name" : "deadline_batch_max_frames",
+                    "label" : "Frame Batch Max Frames",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 10
+                },
+                {
+                    "name" : "deadline_push_completion",
+                    "label" : "Report Completion From Post Task",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0
+                },
+                {
+                    "name" : "deadline_reconcile_interval",
+                    "label" : "Reconcile Interval",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 30
+                },
+                {
+                    "name" : "deadline_post_task_script",
+                    "label" : "Post Task Script",
+                    "type" : "String",
+                    "size" : 1,
+                    "value" : "\$FIREHAWK_HOUDINI_TOOLS/scripts/modules/deadline_post_task.py",
+                    "tag" : ["pdg::scheduler"]
+                },
+                {
+                    "name" : "deadline_cache_job_template",
+                    "label" : "Cache Job Templates",
+                    "type" : "Integer",
+                    "size" : 1,
+                    "value" : 0
+                },
                 {
                     "name" : "deadline_plugin",
                     "label" : "Plugin",
@@ -383,6 +667,8 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         """
         self.stopCallbackServer()
         self._stopSharedServers()
+        self.deadline_pool.stop()
+        self.unwatchTemplateNodes()
         return True
 
     def onStartCook(self, static, cook_set):
@@ -459,6 +745,18 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
 
         self._updateWorkingDir()
 
+        # Pick up any change to DEADLINE_PATH or the environment since the last cook
+        webservice = self['deadline_webservice'].evaluateString().strip()
+        if webservice != self.deadline_webservice:
+            self.deadline_pool.stop()
+            if webservice:
+                self.deadline_pool = deadline_command.DeadlineWebServicePool(webservice, ResolveDeadlineCommand)
+            else:
+                self.deadline_pool = deadline_command.DeadlineCommandPool(ResolveDeadlineCommand)
+            self.deadline_webservice = webservice
+        else:
+            self.deadline_pool.refresh()
+
         file_root = self.workingDir(True)
         if not os.path.exists(file_root):
             os.makedirs(file_root)
@@ -479,6 +777,34 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         if not self.isCallbackServerRunning():
             self.startCallbackServer()
 
+        self.submit_batch_size = max(1, evaluateParamOr(self, 'deadline_submit_batch_size', 1))
+        self.max_submits_in_flight = max(1, evaluateParamOr(self, 'deadline_max_submits_in_flight', 64))
+        # Submissions of the previous cook still in flight keep counting against the throttle until they return,
+        # since they occupy the pool, and their jobs are failed then as they belong to an older generation.
+        with self.submit_lock:
+            self.submits_in_flight -= len(self.pending_submissions)
+            self.pending_submissions = []
+            self.cook_generation += 1
+            self.cook_active = True
+        with self.pack_lock:
+            self.pack_buffers = {}
+            self.batch_buffers = {}
+        self.batch_keys = {}
+        self.batch_sizer = frame_batching.batch_sizer(evaluateParamOr(self, 'deadline_batch_target_seconds', 300),
+                                                      evaluateParamOr(self, 'deadline_batch_max_frames', 10))
+        self.packed_jobs = {}
+        self.item_job_ids = {}
+        self.version_batch = firehawk_submit.version_batch()
+        self.tracked_items = {}
+        self.poll_interval = 0
+        if evaluateParamOr(self, 'deadline_push_completion', 0) > 0:
+            self.poll_interval = max(1, evaluateParamOr(self, 'deadline_reconcile_interval', 30))
+        self.last_poll_time = 0
+        self.cache_job_templates = evaluateParamOr(self, 'deadline_cache_job_template', 0) > 0
+        self.invalidateJobTemplates()
+        # Evaluated here since the monitor is launched from a pool worker once the first job is submitted
+        self.monitor_host_name = self['deadline_launch_monitor'].evaluate()
+
         self.tick_timer = TickTimer(0.25, self.tick)
         self.tick_timer.start()
 
@@ -489,16 +815,26 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         Callback invoked by PDG when graph cook ends.
         Notify Deadline to stop (fail) all active jobs.
         """
-        if self.active_jobs and len(self.active_jobs) > 0:
+        # Submissions still queued are dropped, and jobs from submissions in flight are failed as they return.
+        with self.submit_lock:
+            self.cook_active = False
+            self.submits_in_flight -= len(self.pending_submissions)
+            self.pending_submissions = []
+        with self.pack_lock:
+            self.pack_buffers = {}
+            self.batch_buffers = {}
+
+        if self.active_jobs or self.packed_jobs:
             self.jobs_lock.acquire()
-            job_ids = ''.join('{},'.format(item) for item in self.active_jobs.keys())
+            job_ids = ''.join('{},'.format(item) for item in self.active_jobs.keys() + self.packed_jobs.keys())
             self.jobs_lock.release()
             cmd_arg = self.getUserRepositoryCommandArgument(['FailJob', job_ids])
-            CallDeadlineCommand(cmd_arg)
+            self.deadline_pool.call(cmd_arg)
 
         if self.tick_timer:
             self.tick_timer.cancel()
 
+        self.unwatchTemplateNodes()
         self._stopSharedServers()
         return True
 
@@ -512,6 +848,11 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         if len(work_item.command) == 0:
             return pdg.scheduleResult.CookSucceeded
 
+        # Back-pressure: defer while the submission pipeline is saturated
+        with self.submit_lock:
+            if self.submits_in_flight >= self.max_submits_in_flight:
+                return pdg.scheduleResult.Deferred
+
         try:
             item_name = work_item.name
             item_id = work_item.index
@@ -559,32 +900,10 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
             
             print "item_command", item_command
             
-            render_hip = re.sub(r'(^.*?-p.\")(.*?)(".-n.*)', r"\2", item_command)
-            print "render_hip", render_hip
-            if '.hip' in render_hip:
-                print "Hip file ref will be replaced with optimal path for data transfer.  Ensure that the hip is synchronised correctly prior to submission."
-                prod_root = os.environ['PROD_ROOT']
-                prod_onsite_root = os.environ['PROD_ONSITE_ROOT']
-                prod_cloud_root = os.environ['PROD_CLOUD_ROOT']
-
-                def convert_path(item, target_base_path):
-                    result = ''
-                    if item.startswith(prod_root):
-                        result = "{base}"+item[len(prod_root):]
-                    elif item.startswith(prod_onsite_root):
-                        result = "{base}"+item[len(prod_onsite_root):]
-                    elif item.startswith(prod_cloud_root):
-                        result = "{base}"+item[len(prod_cloud_root):]
-                    else:
-                        print "No path match:", item, 'for items:', prod_root, prod_onsite_root, prod_cloud_root
-                    result = target_base_path+result[len("{base}"):]
-                    return result
-
-                render_hip = convert_path(render_hip, prod_root)
-                
-                # ensure the item command uses hip from current physical location
-                item_command = re.sub(r'(^.*?-p.\")(.*?)(".-n.*)', r"\1"+render_hip+r"\3", item_command)
-                print "item_command post edit", item_command
+            # Ensure the item command uses the hip from the submitting site's physical location.
+            # The hip must be synchronised correctly prior to submission.
+            item_command = path_mapping.get_site_mapping().map_hip_argument(item_command)
+            print "item_command post edit", item_command
 
             cmd_argv = shlex.split(item_command)
 
@@ -598,13 +917,8 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
             temp_root_local = self.tempDir(True)
             
             ### firehawk on schedule version handling
-            index_key = work_item.data.stringData('index_key', 0)
-            if index_key is not None:
-                print "on schedule version handling", work_item
-                rop_path = work_item.data.stringData('rop', 0)
-                hou_node = hou.node(rop_path)
-                print "hou_node", hou_node
-                firehawk_submit.submit(hou_node).onScheduleVersioning(work_item)
+            # all work items of the node are versioned when the first is scheduled, the rest are a lookup
+            self.version_batch.version_work_item(work_item)
             ### end firehawk on schedule version handling
 
             # Json data is written at this point for the live session.
@@ -612,105 +926,45 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
             # Ensure directories exist and serialize the work item
             self.createJobDirsAndSerializeWorkItems(work_item)
 
-            # Get HFS from parm
-            hfs_path = self.evaluateStringOverride(work_item.node, 'deadline', 'hfs', work_item, '')
+            executable = cmd_argv[0]
+            # Remove executable from arguments and surround each argument with quotes
+            arguments = ''.join('"{}" '.format(item) for item in cmd_argv[1:])
+
+            # ROP fetch frames of batching nodes are cooked together by one task
+            if self.evaluateIntOverride(node, 'deadline', 'batch_frames', work_item, 0) > 0:
+                batch_key = frame_batching.batch_key(work_item, item_command)
+                if batch_key is not None:
+                    self.queueBatchFrame(batch_key, work_item, cmd_argv)
+                    return pdg.scheduleResult.Succeeded
+
+            # Items of nodes with a pack size above 1 are grouped into multi-task jobs
+            pack_size = self.evaluateIntOverride(node, 'deadline', 'pack_size', work_item, 0)
+            if pack_size > 1:
+                self.queuePackedTask(PackedTask(work_item, item_name, item_id, executable, arguments), pack_size)
+                return pdg.scheduleResult.Succeeded
 
             # Job info file: __PDG_TEMP__/cmdjob_item_name_index.txt
             job_file_name = '{}/cmdjob_{}_{}.txt'.format(temp_root_local, item_name, str(item_id))
-            
-            # import hou
-            # from shutil import copyfile
-
-            # hip_path = hou.hipFile.path()
-            # hip_basename = hou.hipFile.basename()
-            # hou.hipFile.save()
-            
-            # pdg_hip_name = '/'+work_dir.strip('/')+'/'+hip_basename
-            # print "copy hip to staging dir again", pdg_hip_name
-            # copyfile(hip_path, pdg_hip_name)
-            # # version_dir = work_dir
-            # # print 'write verison to ', work_dir
 
             with open(job_file_name, 'w') as job_file:
-                plugin_name = self.evaluateStringOverride(node, 'deadline', 'plugin', work_item, '')
-                job_file.write('Plugin={}\n'.format(plugin_name))
-                job_file.write('Name={}\n'.format(job_name))
-
-                self.writeStringDataFromWorkItem(work_item, job_file, 'pre_job_script', 'PreJobScript')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'post_job_script', 'PostJobScript')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_pool', 'Pool')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_group', 'Group')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_frames', 'Frames')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_dept', 'Department')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_batch_name', 'BatchName')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'job_comment', 'Comment')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'on_job_complete', 'OnJobComplete')
-                self.writeStringDataFromWorkItem(work_item, job_file, 'force_reload_plugin', 'ForceReloadPlugin')
-
-                self.writeIntDataFromWorkItem(work_item, job_file, 'job_priority', 'Priority')
-
-                self.writeJobFileKeyValues(job_file, work_item, work_dir)
-
-                # Job environment
-                env_idx = 0
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_RESULT_SERVER', str(self.workItemResultServerAddr()))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_ITEM_NAME', item_name)
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_DIR', str(work_dir))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_TEMP', str(temp_dir))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_SHARED_TEMP', str(temp_dir))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_INDEX', str(work_item.index))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_INDEX4', "{:04d}".format(work_item.index))
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_SCRIPTDIR', str(script_dir))
-
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_JOBID', 'DL_JOB_ID')
-                env_idx = self.writeJobEnv(job_file, env_idx, 'PDG_JOBID_VAR', 'PDG_JOBID')
-
-                env_idx = self.writeJobEnv(job_file, env_idx, 'HFS', hfs_path)
-
-                env_idx = self.writeJobFileEnvKeyValues(job_file, work_item, env_idx)
-                
+                template = self.writeJobInfo(job_file, work_item, 'plugin', job_name, [
+                    ('PDG_ITEM_NAME', item_name),
+                    ('PDG_INDEX', str(work_item.index)),
+                    ('PDG_INDEX4', "{:04d}".format(work_item.index))])
 
             # Plugin info file: __PDG_TEMP__/cmdplugin.txt_name_index.txt
             plugin_file_name = '{}/cmdplugin_{}_{}.txt'.format(temp_root_local, item_name, str(item_id))
 
             with open(plugin_file_name, 'w') as plugin_file:
                 plugin_file.write('ShellExecute=False\n')
-                plugin_file.write('Executable=%s\n' % cmd_argv[0])
-
-                # Remove executable from arguments and surround each argument with quotes
-                del cmd_argv[0]
-                cmd_str = ''.join('"{}" '.format(item) for item in cmd_argv)
-                plugin_file.write('Arguments={}\n'.format(str(cmd_str)))
-
-                self.writePluginFileKeyValues(plugin_file, work_item)
-
-            deadline_cmd = self.getUserRepositoryCommandArgument(['-submitJob', job_file_name, plugin_file_name])
-            logger.debug('onSchedule deadline command: {}'.format(deadline_cmd))
-
-            job_result, job_err = CallDeadlineCommand( deadline_cmd )
-            if job_result.startswith("Error"):
-                error_msg = "Deadline submit job command failed!\n{}\n{}".format(job_result, job_err)
-                logger.error(error_msg)
-                return pdg.scheduleResult.Failed
+                plugin_file.write('Executable=%s\n' % executable)
+                plugin_file.write('Arguments={}\n'.format(str(arguments)))
+                plugin_file.write(template.plugin_lines)
 
-            job_id = GetJobIdFromSubmission( job_result )
-            if not job_id:
-                logger.error('onSchedule: Failed to schedule job or no job id found!')
-                return pdg.scheduleResult.Failed
-            else:
-                logger.debug('Job submitted with ID: {}'.format(job_id))
+            # Submission happens asynchronously, the job id is recorded and the item
+            # tracked (or failed) once deadlinecommand returns.
+            self.queueSubmission(JobSubmission([work_item], [item_name], job_file_name, plugin_file_name, None))
 
-            self.jobs_lock.acquire()
-            self.active_jobs[job_id] = item_name
-            self.jobs_lock.release()
-            work_item.data.setString("deadline_jobid", job_id, 0)
-
-            # Launch monitor if set
-            monitor_host_name = self['deadline_launch_monitor'].evaluate()
-            if len(monitor_host_name) and not self.launched_monitor:
-                deadline_cmd = self.getUserRepositoryCommandArgument(['--RemoteControl', monitor_host_name, 'LaunchMonitor'])
-                CallDeadlineCommand( deadline_cmd )
-                self.launched_monitor = True
             print "### end onschedule ###"
             return pdg.scheduleResult.Succeeded
         except:
@@ -750,14 +1004,500 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         """
         return self.evaluateStringOverride( work_item.node, 'deadline', 'hython', work_item, '')
 
+    def writeJobInfo(self, job_file, work_item, plugin_parm, job_name, item_env, frames=None):
+        """
+        Writes the job info file for a job running work_item's node, using the plugin named by
+        the plugin_parm scheduler parm.
+        The node-invariant sections come from the node's cached job template, and only the job name,
+        item_env, a list of (key, value) work item specific environment entries, and frames,
+        which replaces the Frames entry of the job if given, are written per job.
+        Returns the JobTemplate used.
+        """
+        template = self.getJobTemplate(work_item, plugin_parm)
+
+        job_file.write('Name={}\n'.format(job_name))
+        job_file.write(template.job_lines)
+        if frames is None:
+            job_file.write(template.frames_line)
+        else:
+            job_file.write('Frames={}\n'.format(frames))
+
+        # Job environment
+        job_file.write(template.env_lines)
+        env_idx = template.env_count
+        for key, value in item_env:
+            env_idx = self.writeJobEnv(job_file, env_idx, key, value)
+        return template
+
+    def getJobTemplate(self, work_item, plugin_parm):
+        """
+        Returns the JobTemplate for work_item's node, building it on first use in the cook.
+        Templates are rebuilt every cook and whenever the TOP node's parms change.  They are only cached
+        with deadline_cache_job_template on, and once the node's deadline parms are known not to refer to the
+        work item (see templateParmsVary), until then each work item gets its own template.
+        """
+        if not self.cache_job_templates:
+            return self.buildJobTemplate(work_item, plugin_parm)
+
+        node_name = work_item.node.name
+        key = (node_name, plugin_parm)
+        with self.template_lock:
+            varying = self.template_varying.get(node_name)
+            template = self.job_templates.get(key) if varying is False else None
+        if template is None:
+            template = self.buildJobTemplate(work_item, plugin_parm)
+            if varying is False:
+                with self.template_lock:
+                    self.job_templates[key] = template
+            self.watchTemplateNodes(work_item.node)
+        return template
+
+    def buildJobTemplate(self, work_item, plugin_parm):
+        """
+        Evaluates the scheduler and node parms of work_item's node into a JobTemplate.
+        """
+        work_dir = self.workingDir(False)
+        temp_dir = self.tempDir(False)
+        script_dir = self.scriptDir(False)
+        node = work_item.node
+
+        job_lines = StringIO()
+        plugin_default = 'PDGDeadline' if plugin_parm == 'pack_plugin' else ''
+        plugin_name = self.evaluateStringOverride(node, 'deadline', plugin_parm, work_item, plugin_default)
+        job_lines.write('Plugin={}\n'.format(plugin_name))
+
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'pre_job_script', 'PreJobScript')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'post_job_script', 'PostJobScript')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'job_pool', 'Pool')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'job_group', 'Group')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'job_dept', 'Department')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'job_batch_name', 'BatchName')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'job_comment', 'Comment')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'on_job_complete', 'OnJobComplete')
+        self.writeStringDataFromWorkItem(work_item, job_lines, 'force_reload_plugin', 'ForceReloadPlugin')
+
+        self.writeIntDataFromWorkItem(work_item, job_lines, 'job_priority', 'Priority')
+
+        # With push completion each task reports to the result server from the post task script
+        if self.poll_interval > 0:
+            self.writeStringDataFromWorkItem(work_item, job_lines, 'post_task_script', 'PostTaskScript')
+
+        self.writeJobFileKeyValues(job_lines, work_item, work_dir)
+
+        frames_line = StringIO()
+        self.writeStringDataFromWorkItem(work_item, frames_line, 'job_frames', 'Frames')
+
+        # Get HFS from parm
+        hfs_path = self.evaluateStringOverride(node, 'deadline', 'hfs', work_item, '')
+
+        env_lines = StringIO()
+        env_idx = 0
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_RESULT_SERVER', str(self.workItemResultServerAddr()))
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_DIR', str(work_dir))
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_TEMP', str(temp_dir))
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_SHARED_TEMP', str(temp_dir))
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_SCRIPTDIR', str(script_dir))
+
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_JOBID', 'DL_JOB_ID')
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'PDG_JOBID_VAR', 'PDG_JOBID')
+
+        env_idx = self.writeJobEnv(env_lines, env_idx, 'HFS', hfs_path)
+
+        env_idx = self.writeJobFileEnvKeyValues(env_lines, work_item, env_idx)
+
+        plugin_lines = StringIO()
+        self.writePluginFileKeyValues(plugin_lines, work_item)
+
+        return JobTemplate(job_lines.getvalue(), frames_line.getvalue(), env_lines.getvalue(), env_idx, plugin_lines.getvalue())
+
+    def invalidateJobTemplates(self):
+        """
+        Drops all cached job templates, they will be rebuilt as items are scheduled.
+        """
+        with self.template_lock:
+            self.job_templates = {}
+
+    def watchTemplateNodes(self, node):
+        """
+        Invalidates the cached job templates when a parm changes on the TOP node for the PDG node, or on
+        this scheduler's TOP node.  The callbacks are added on the main thread, where the parms are also
+        checked for per item values, and removed by unwatchTemplateNodes when the cook stops.
+        """
+        with self.template_lock:
+            if node.name in self.template_watched_nodes:
+                return
+            self.template_watched_nodes.add(node.name)
+        try:
+            top_node = node.topNode()
+        except AttributeError:
+            return
+        if top_node is not None:
+            RunOnMainThread(self.addTemplateCallbacks, node.name, top_node)
+
+    def addTemplateCallbacks(self, node_name, top_node):
+        with self.template_lock:
+            if node_name not in self.template_watched_nodes:
+                # the cook stopped before the callbacks were added
+                return
+        watch_nodes = self.templateNodes(top_node)
+        varying = self.templateParmsVary(watch_nodes)
+        with self.template_lock:
+            self.template_top_nodes[node_name] = top_node
+            self.template_varying[node_name] = varying
+        for watch_node in watch_nodes:
+            path = watch_node.path()
+            if path in self.template_callbacks:
+                continue
+            watch_node.addEventCallback((hou.nodeEventType.ParmTupleChanged, ), self.template_parm_callback)
+            self.template_callbacks[path] = watch_node
+
+    def templateNodes(self, top_node):
+        """
+        Returns the TOP node and this scheduler's TOP node, whose parms a job template is built from.
+        """
+        template_nodes = [top_node]
+        # the scheduler's TOP node shares the scheduler's name, in the same network
+        scheduler_name = getattr(self, 'name', '')
+        if scheduler_name and top_node.parent() is not None:
+            scheduler_node = top_node.parent().node(scheduler_name)
+            if scheduler_node is not None:
+                template_nodes.append(scheduler_node)
+        return template_nodes
+
+    def templateParmsVary(self, template_nodes):
+        """
+        Returns True if any deadline parm of the nodes refers to the work item, eg. a pool of @pool or a
+        priority expression using pdgattrib, so job templates of the node can't be shared by its work items.
+        """
+        for template_node in template_nodes:
+            for parm in template_node.parms():
+                if parm.name().startswith('deadline_') and ParmVariesPerItem(parm):
+                    return True
+        return False
+
+    def onTemplateParmChanged(self, **kwargs):
+        # parm callbacks run on the main thread, so the parms can be checked again here
+        with self.template_lock:
+            top_nodes = dict(self.template_top_nodes)
+        varying = {}
+        for node_name, top_node in top_nodes.iteritems():
+            try:
+                varying[node_name] = self.templateParmsVary(self.templateNodes(top_node))
+            except hou.ObjectWasDeleted:
+                varying[node_name] = True
+        with self.template_lock:
+            self.template_varying.update(varying)
+        self.invalidateJobTemplates()
+
+    def unwatchTemplateNodes(self):
+        """
+        Removes the parm callbacks added by watchTemplateNodes, so they don't keep the scheduler alive.
+        """
+        with self.template_lock:
+            self.template_watched_nodes = set()
+            self.template_top_nodes = {}
+            self.template_varying = {}
+        RunOnMainThread(self.removeTemplateCallbacks)
+
+    def removeTemplateCallbacks(self):
+        callbacks = self.template_callbacks
+        self.template_callbacks = {}
+        for watch_node in callbacks.itervalues():
+            try:
+                watch_node.removeEventCallback((hou.nodeEventType.ParmTupleChanged, ), self.template_parm_callback)
+            except hou.Error:
+                # the node was deleted, or the callback is already gone
+                pass
+
+    def queuePackedTask(self, task, pack_size):
+        """
+        Buffers a work item of a packing node. Once pack_size items of the node are
+        buffered they are submitted as one job, partial packs are submitted by tick
+        after pack_linger seconds.
+        """
+        node_name = task.work_item.node.name
+        batch = None
+        with self.pack_lock:
+            if node_name not in self.pack_buffers:
+                self.pack_buffers[node_name] = ([], time.time())
+            tasks = self.pack_buffers[node_name][0]
+            tasks.append(task)
+            if len(tasks) >= pack_size:
+                batch = tasks
+                del self.pack_buffers[node_name]
+        if batch:
+            self.submitPackedJob(batch)
+
+    def flushPackedTasks(self):
+        """
+        Submits the packs and frame batches that have waited at least pack_linger seconds for more items.
+        """
+        now = time.time()
+        with self.pack_lock:
+            ready = [node_name for node_name, (tasks, started) in self.pack_buffers.iteritems() if now - started >= self.pack_linger]
+            batches = [self.pack_buffers.pop(node_name)[0] for node_name in ready]
+            ready = [key for key, (entries, started) in self.batch_buffers.iteritems() if now - started >= self.pack_linger]
+            frame_batches = [self.batch_buffers.pop(key)[0] for key in ready]
+        for batch in batches:
+            self.submitPackedJob(batch)
+        for batch in frame_batches:
+            self.submitBatchJob(batch)
+
+    def submitPackedJob(self, tasks):
+        """
+        Writes one Deadline job with a task per work item and queues its submission.
+        Task n runs the work item in task_n.txt of the job's PDGJobDirectory, which the
+        pack plugin (and TestPreTask) read as json with the executable, arguments and
+        item environment.
+        """
+        work_item = tasks[0].work_item
+        node = work_item.node
+        temp_root_local = self.tempDir(True)
+        job_name = '{}_{}-{}'.format(node.name, tasks[0].item_index, tasks[-1].item_index)
+
+        task_dir_local = '{}/packed/{}'.format(temp_root_local, job_name)
+        task_dir = '{}/packed/{}'.format(self.tempDir(False), job_name)
+        if not os.path.exists(task_dir_local):
+            os.makedirs(task_dir_local)
+
+        for task_idx, task in enumerate(tasks):
+            task_data = {
+                'executable' : task.executable,
+                'arguments' : task.arguments,
+                'item_name' : task.item_name,
+                'item_index' : task.item_index,
+                'env' : {
+                    'PDG_ITEM_NAME' : task.item_name,
+                    'PDG_INDEX' : str(task.item_index),
+                    'PDG_INDEX4' : "{:04d}".format(task.item_index)
+                }
+            }
+            with open('{}/task_{}.txt'.format(task_dir_local, task_idx), 'w') as task_file:
+                json.dump(task_data, task_file)
+
+        job_file_name = '{}/cmdjob_{}.txt'.format(temp_root_local, job_name)
+        with open(job_file_name, 'w') as job_file:
+            template = self.writeJobInfo(job_file, work_item, 'pack_plugin', job_name, [], '0-{}'.format(len(tasks) - 1))
+            job_file.write('ChunkSize=1\n')
+
+        plugin_file_name = '{}/cmdplugin_{}.txt'.format(temp_root_local, job_name)
+        with open(plugin_file_name, 'w') as plugin_file:
+            plugin_file.write('PDGJobDirectory={}\n'.format(task_dir))
+            plugin_file.write(template.plugin_lines)
+
+        self.queueSubmission(JobSubmission([task.work_item for task in tasks], [task.item_name for task in tasks],
+            job_file_name, plugin_file_name, [[task.item_name] for task in tasks]))
+
+    def queueBatchFrame(self, key, work_item, cmd_argv):
+        """
+        Buffers a ROP fetch work item in the frame batch of its ROP and wedge. Once the batch holds
+        as many frames as the batch sizer asks for it is submitted, partial batches are submitted
+        by tick after pack_linger seconds.  A frame that isn't consecutive with the buffered frames
+        submits them, and starts a new batch.
+        """
+        entry = {
+            'work_item' : work_item,
+            'item_name' : work_item.name,
+            'frame' : work_item.frame,
+            'hython' : cmd_argv[0],
+            'argv' : cmd_argv[1:],
+            'env' : {
+                'PDG_ITEM_NAME' : work_item.name,
+                'PDG_INDEX' : str(work_item.index),
+                'PDG_INDEX4' : "{:04d}".format(work_item.index)
+            }
+        }
+        batch = None
+        gap_batch = None
+        with self.pack_lock:
+            self.batch_keys[work_item.name] = key
+            if key in self.batch_buffers and not frame_batching.continues_run(
+                    [buffered['frame'] for buffered in self.batch_buffers[key][0]], work_item.frame,
+                    frame_batching.frame_step(work_item)):
+                gap_batch = self.batch_buffers.pop(key)[0]
+            if key not in self.batch_buffers:
+                self.batch_buffers[key] = ([], time.time())
+            entries = self.batch_buffers[key][0]
+            entries.append(entry)
+            if len(entries) >= self.batch_sizer.size(key):
+                batch = entries
+                del self.batch_buffers[key]
+        if gap_batch:
+            self.submitBatchJob(gap_batch)
+        if batch:
+            self.submitBatchJob(batch)
+
+    def submitBatchJob(self, entries):
+        """
+        Writes one Deadline job with a single task that cooks the frames of a batch in one hython,
+        with the batch runner reporting each work item to the result server as it completes.
+        """
+        entries = sorted(entries, key=lambda entry: entry['frame'])
+        work_item = entries[0]['work_item']
+        node = work_item.node
+        temp_root_local = self.tempDir(True)
+        job_name = '{}_batch_{}-{}'.format(node.name, work_item.index, entries[-1]['work_item'].index)
+
+        batch_file_name = '{}/batches/{}.json'.format(self.tempDir(False), job_name)
+        frame_batching.write_batch('{}/batches/{}.json'.format(temp_root_local, job_name), entries)
+
+        job_file_name = '{}/cmdjob_{}.txt'.format(temp_root_local, job_name)
+        with open(job_file_name, 'w') as job_file:
+            template = self.writeJobInfo(job_file, work_item, 'plugin', job_name, [], '0')
+
+        runner = self.evaluateStringOverride(node, 'deadline', 'batch_runner', work_item, '')
+        plugin_file_name = '{}/cmdplugin_{}.txt'.format(temp_root_local, job_name)
+        with open(plugin_file_name, 'w') as plugin_file:
+            plugin_file.write('ShellExecute=False\n')
+            plugin_file.write('Executable=%s\n' % entries[0]['hython'])
+            plugin_file.write('Arguments="{}" --batch "{}"\n'.format(runner, batch_file_name))
+            plugin_file.write(template.plugin_lines)
+
+        item_names = [entry['item_name'] for entry in entries]
+        self.queueSubmission(JobSubmission([entry['work_item'] for entry in entries], item_names,
+            job_file_name, plugin_file_name, [item_names]))
+
+    def queueSubmission(self, submission):
+        """
+        Adds a job submission to the pipeline, and dispatches a batch once submit_batch_size jobs are pending.
+        Remaining pending jobs are dispatched on the next tick.
+        """
+        batch = None
+        with self.submit_lock:
+            self.pending_submissions.append(submission)
+            self.submits_in_flight += 1
+            if len(self.pending_submissions) >= self.submit_batch_size:
+                batch = self.pending_submissions
+                self.pending_submissions = []
+            generation = self.cook_generation
+        if batch:
+            self.dispatchSubmissions(batch, generation)
+
+    def flushSubmissions(self):
+        """
+        Dispatches any pending job submissions.
+        """
+        with self.submit_lock:
+            batch = self.pending_submissions
+            self.pending_submissions = []
+            generation = self.cook_generation
+        if batch:
+            self.dispatchSubmissions(batch, generation)
+
+    def dispatchSubmissions(self, batch, generation):
+        """
+        Sends a batch of job submissions queued in the cook generation to Deadline without blocking.
+        A single job uses -submitJob, several jobs are sent with one -SubmitMultipleJobs call.
+        """
+        if len(batch) == 1:
+            submit_args = ['-submitJob', batch[0].job_file, batch[0].plugin_file]
+        else:
+            submit_args = ['-SubmitMultipleJobs']
+            for submission in batch:
+                submit_args += ['-job', submission.job_file, submission.plugin_file]
+        deadline_cmd = self.getUserRepositoryCommandArgument(submit_args)
+        logger.debug('dispatchSubmissions deadline command: {}'.format(deadline_cmd))
+        self.deadline_pool.callAsync(deadline_cmd, lambda request: self.onSubmissionsComplete(batch, generation, request))
+
+    def onSubmissionsComplete(self, batch, generation, request):
+        """
+        Called on a pool worker when a batch submission returns.
+        Records the deadline_jobid of each work item and starts tracking the job,
+        or reports the work items as failed back to PDG.
+        Submissions of a cook that has since ended, or been followed by another, are failed on the farm
+        without touching their work items.
+        """
+        job_result, job_err = request.output, request.errors
+        job_ids = GetJobIdsFromSubmission(job_result)
+
+        with self.submit_lock:
+            self.submits_in_flight -= len(batch)
+            current = self.cook_active and generation == self.cook_generation
+
+        if not current:
+            # The cook ended while submitting, don't leave the jobs running on the farm
+            if job_ids:
+                self.deadline_pool.callAsync(self.getUserRepositoryCommandArgument(['FailJob', ','.join(job_ids)]))
+            return
+
+        if job_result.startswith("Error") or len(job_ids) != len(batch):
+            error_msg = "Deadline submit job command failed!\n{}\n{}".format(job_result, job_err)
+            logger.error(error_msg)
+            if job_ids:
+                # Job ids can't be matched to work items when only part of a batch submitted
+                self.deadline_pool.callAsync(self.getUserRepositoryCommandArgument(['FailJob', ','.join(job_ids)]))
+            for submission in batch:
+                for item_name in submission.item_names:
+                    self.workItemFailed(item_name, -1)
+            return
+
+        self.jobs_lock.acquire()
+        for submission, job_id in zip(batch, job_ids):
+            if submission.task_items is not None:
+                self.packed_jobs[job_id] = dict((task_index, list(item_names)) for task_index, item_names in enumerate(submission.task_items))
+                for task_index, item_names in enumerate(submission.task_items):
+                    for item_name in item_names:
+                        self.tracked_items[item_name] = (job_id, task_index)
+            else:
+                self.active_jobs[job_id] = submission.item_names[0]
+                self.tracked_items[submission.item_names[0]] = (job_id, None)
+            for item_name in submission.item_names:
+                self.item_job_ids[item_name] = job_id
+        self.jobs_lock.release()
+
+        for submission, job_id in zip(batch, job_ids):
+            logger.debug('Job submitted with ID: {}'.format(job_id))
+            for work_item in submission.work_items:
+                work_item.data.setString("deadline_jobid", job_id, 0)
+
+        # Launch monitor if set
+        if len(self.monitor_host_name) and not self.launched_monitor:
+            self.launched_monitor = True
+            deadline_cmd = self.getUserRepositoryCommandArgument(['--RemoteControl', self.monitor_host_name, 'LaunchMonitor'])
+            self.deadline_pool.callAsync( deadline_cmd )
+
     def submitAsJob(self, graph_file, node_path):
         logger.error("This Deadline scheduler does not support cooking the network as a single job.")
         return ""
 
+    def untrackWorkItem(self, name):
+        """
+        Stops tracking a submitted work item once its completion is known.
+        Returns False if the completion was already handled, either pushed by the post task
+        script or found by polling, so that it is only reported once.
+        """
+        self.jobs_lock.acquire()
+        try:
+            tracked = self.tracked_items.pop(name, None)
+            if tracked is None:
+                # Items that were never submitted (eg. failed submissions) are always reported
+                return name not in self.item_job_ids
+            job_id, task_index = tracked
+            if task_index is None:
+                self.active_jobs.pop(job_id, None)
+            else:
+                pending_tasks = self.packed_jobs.get(job_id)
+                if pending_tasks is not None:
+                    item_names = pending_tasks.get(task_index, [])
+                    if name in item_names:
+                        item_names.remove(name)
+                    if not item_names:
+                        pending_tasks.pop(task_index, None)
+                    if not pending_tasks:
+                        del self.packed_jobs[job_id]
+            return True
+        finally:
+            self.jobs_lock.release()
+
     def workItemSucceeded(self, name, index, cook_duration, jobid=''):
         """
         Called by CallbackServerMixin when a workitem signals success.
         """
+        if not self.untrackWorkItem(name):
+            return
+        batch_key = self.batch_keys.pop(name, None)
+        if batch_key is not None and cook_duration > 0:
+            self.batch_sizer.record(batch_key, cook_duration)
         logger.debug('Job Succeeded: {}'.format(name))
         self.onWorkItemSucceeded(name, index, cook_duration)
 
@@ -765,6 +1505,8 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         """
         Called by CallbackServerMixin when a workitem signals failure.
         """
+        if not self.untrackWorkItem(name):
+            return
         logger.debug('Job Failed: name={}, index={}, jobid={}'.format(name, index, jobid))
         self.onWorkItemFailed(name, index)
 
@@ -797,55 +1539,141 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         """
         Called during a cook. Checks on jobs in flight to see if
         any have finished.
+        All active jobs are queried with one GetJob call per chunk of job ids,
+        and every completion found in the snapshot is handled in the same tick.
+        With push completion the query only runs every poll_interval seconds.
         """
         try:
-            finished_job_id = None
+            self.flushPackedTasks()
+            self.flushSubmissions()
+
+            now = time.time()
+            if now - self.last_poll_time < self.poll_interval:
+                return True
+            self.last_poll_time = now
+
             self.jobs_lock.acquire()
+            try:
+                job_ids = self.active_jobs.keys()
+                packed_job_ids = self.packed_jobs.keys()
+            finally:
+                self.jobs_lock.release()
 
-            for id,work_item_name in self.active_jobs.iteritems():
-                deadline_cmd = self.getUserRepositoryCommandArgument(["GetJob", str(id)])
-                job_info, job_err = CallDeadlineCommand(deadline_cmd)
-                if len(job_info) < 1 or job_info.startswith("Error"):
-                    error_msg = "Deadline get job info command failed!\n{}\n{}".format(job_info, job_err)
-                    logger.error(error_msg)
-                    self.workItemFailed(work_item_name, -1)
-                    finished_job_id = id
-                    break
+            if not job_ids and not packed_job_ids:
+                return True
 
-                # Get the Status from the job info (e.g. Status=Completed)
-                status_match = re.search('^Status=.*$', job_info, re.MULTILINE)
-                if status_match:
-                    status = status_match.group(0).replace("Status=", "").strip()
-                    if status == "Completed":
-                        # Parse the TotalRenderTime to get total time in seconds (e.g. TotalRenderTime=00:00:07.4310000)
-                        total_render_time = 0
-                        time_match = re.search('^TotalRenderTime=.*$', job_info, re.MULTILINE)
-                        if time_match:
-                            time_value = time_match.group(0).replace("TotalRenderTime=", "").strip()
-                            h, m, s = time_value.split(':')
-                            total_render_time = int(datetime.timedelta(hours=int(h), minutes=int(m), seconds=float(s)).total_seconds())
-
-                        self.workItemSucceeded(work_item_name, -1, total_render_time)
-                        finished_job_id = id
-                        break
-                    elif status == "Failed":
-                        self.workItemFailed(work_item_name, -1)
-                        finished_job_id = id
-                        break
-
-            if finished_job_id:
-                del self.active_jobs[finished_job_id]
+            status_table = self.queryJobStatus(job_ids) if job_ids else {}
+            task_table = self.queryTaskStatus(packed_job_ids) if packed_job_ids else {}
 
-            self.jobs_lock.release()
+            finished_jobs = []
+            self.jobs_lock.acquire()
+            try:
+                for job_id, job_status in status_table.iteritems():
+                    work_item_name = self.active_jobs.pop(job_id, None)
+                    if work_item_name is not None:
+                        finished_jobs.append((work_item_name, job_status))
+
+                # Tasks of packed jobs are reported individually as each one finishes
+                for job_id, task_status in task_table.iteritems():
+                    pending_tasks = self.packed_jobs.get(job_id)
+                    if pending_tasks is None:
+                        continue
+                    for task_index, job_status in task_status.iteritems():
+                        for work_item_name in pending_tasks.pop(task_index, []):
+                            finished_jobs.append((work_item_name, job_status))
+                    if not pending_tasks:
+                        del self.packed_jobs[job_id]
+            finally:
+                self.jobs_lock.release()
+
+            for work_item_name, job_status in finished_jobs:
+                status, total_render_time = job_status
+                if status == "Completed":
+                    self.workItemSucceeded(work_item_name, -1, total_render_time)
+                else:
+                    self.workItemFailed(work_item_name, -1)
 
         except:
             import traceback
             traceback.print_exc()
             sys.stderr.flush()
-            self.jobs_lock.release()
             return False
         return True
 
+    def queryJobStatus(self, job_ids):
+        """
+        Returns a status table of {job_id: (status, total_render_time)} for the jobs in
+        job_ids that have finished, either Completed or Failed.
+        Jobs that Deadline can no longer report on are returned as Failed.
+        """
+        finished = {}
+        chunk_size = self.status_query_chunk_size
+        requests = []
+        # Queue all chunk queries first so they are run concurrently across the pool workers
+        for chunk_start in xrange(0, len(job_ids), chunk_size):
+            chunk = job_ids[chunk_start:chunk_start + chunk_size]
+            deadline_cmd = self.getUserRepositoryCommandArgument(["GetJob", ','.join(chunk)])
+            requests.append((chunk, self.deadline_pool.callAsync(deadline_cmd)))
+
+        for chunk, request in requests:
+            job_info, job_err = request.result()
+            if len(job_info) < 1 or job_info.startswith("Error"):
+                if len(chunk) > 1:
+                    # One bad job id fails the whole query, so query the chunk individually to isolate it.
+                    for job_id in chunk:
+                        finished.update(self.queryJobStatus([job_id]))
+                    continue
+                error_msg = "Deadline get job info command failed!\n{}\n{}".format(job_info, job_err)
+                logger.error(error_msg)
+                finished[chunk[0]] = ("Failed", 0)
+                continue
+
+            status_table = ParseJobInfoBatch(job_info, chunk)
+            for job_id, job_fields in status_table.iteritems():
+                # Get the Status from the job info (e.g. Status=Completed)
+                status = job_fields.get('Status', '')
+                if status == "Completed":
+                    # Parse the TotalRenderTime to get total time in seconds (e.g. TotalRenderTime=00:00:07.4310000)
+                    total_render_time = ParseTotalRenderTime(job_fields.get('TotalRenderTime', ''))
+                    finished[job_id] = (status, total_render_time)
+                elif status == "Failed":
+                    finished[job_id] = (status, 0)
+        return finished
+
+    def queryTaskStatus(self, job_ids):
+        """
+        Returns {job_id: {task_index: (status, render_time)}} for the finished tasks,
+        either Completed or Failed, of the packed jobs in job_ids.
+        If Deadline can no longer report on a job, all of its tasks are returned as Failed.
+        """
+        requests = []
+        for job_id in job_ids:
+            deadline_cmd = self.getUserRepositoryCommandArgument(["GetJobTasks", job_id])
+            requests.append((job_id, self.deadline_pool.callAsync(deadline_cmd)))
+
+        finished = {}
+        for job_id, request in requests:
+            task_info, task_err = request.result()
+            if len(task_info) < 1 or task_info.startswith("Error"):
+                error_msg = "Deadline get job tasks command failed!\n{}\n{}".format(task_info, task_err)
+                logger.error(error_msg)
+                self.jobs_lock.acquire()
+                task_indices = self.packed_jobs.get(job_id, {}).keys()
+                self.jobs_lock.release()
+                finished[job_id] = dict((task_index, ("Failed", 0)) for task_index in task_indices)
+                continue
+
+            task_status = {}
+            for task_index, task_fields in ParseJobTasks(task_info).iteritems():
+                status = task_fields.get('TaskStatus') or task_fields.get('Status', '')
+                if status == "Completed":
+                    render_time = task_fields.get('TaskRenderTime') or task_fields.get('RenderTime', '')
+                    task_status[task_index] = (status, ParseTotalRenderTime(render_time))
+                elif status == "Failed":
+                    task_status[task_index] = (status, 0)
+            finished[job_id] = task_status
+        return finished
+
     def getLogURI(self, work_item):
         """
         Returns the URI to the log file for the given work_item.
@@ -853,9 +1681,11 @@ class DeadlineScheduler(CallbackServerMixin, PyScheduler):
         'file:///path/to/log.bz2' will be returned
         """
         work_item_id = work_item.data.stringData('deadline_jobid', 0)
+        if work_item_id is None:
+            work_item_id = self.item_job_ids.get(work_item.name)
         if work_item_id is not None:
             deadline_cmd = self.getUserRepositoryCommandArgument(['--GetJobLogReportFilenames', work_item_id])
-            log_query, log_err = CallDeadlineCommand(deadline_cmd)
+            log_query, log_err = self.deadline_pool.call(deadline_cmd)
             if log_query.startswith("Error"):
                 error_msg = "Deadline get job log command failed!\n{}\n{}".format(log_query, log_err)
                 logger.error(error_msg)